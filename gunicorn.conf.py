@@ -1,4 +1,42 @@
+import os
+import shutil
+
 workers = 4
+# Async views (invoice/client lists and details, PDF downloads) are served on
+# an event loop. Set GUNICORN_WORKER_CLASS=sync to serve the WSGI app instead.
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "uvicorn_worker.UvicornWorker")
+if worker_class == "sync":
+    wsgi_app = "invoice_system.wsgi:application"
+else:
+    wsgi_app = "invoice_system.asgi:application"
+    # Django can't reuse connections across ASGI requests, see
+    # invoice_system/database.py for pooling them with PgBouncer instead
+    os.environ.setdefault("DATABASE_CONN_MAX_AGE", "0")
 accesslog = "-"
 errorlog = "-"
 bind = "0.0.0.0:8000"
+
+# Workers keep their Prometheus samples here so /metrics can add them up
+prometheus_dir = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", "/tmp/invoices-prometheus"
+)
+
+
+def on_starting(server):
+    # Samples left by an earlier run would be counted again
+    shutil.rmtree(prometheus_dir, ignore_errors=True)
+    os.makedirs(prometheus_dir)
+
+
+def post_worker_init(worker):
+    # Parse the invoice stylesheet, set up fonts and compile the PDF template
+    # once per worker rather than on every render
+    from invoices.pdf import warm_up
+
+    warm_up()
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
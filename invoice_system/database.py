@@ -0,0 +1,104 @@
+"""
+Database settings from the environment.
+
+DATABASE_URL selects the database, e.g. ``sqlite:////data/db.sqlite3`` or
+``postgres://user:password@db:5432/invoices?sslmode=require``; query string
+parameters become backend OPTIONS. Without it the project uses the SQLite
+file next to manage.py.
+
+DATABASE_REPLICA_URLS is a comma separated list of read replicas of that
+database, added as `replica1`, `replica2`... and used as described in
+invoices/replicas.py.
+
+DATABASE_CONN_MAX_AGE keeps connections open between requests for that many
+seconds, with a health check before reuse. Django only reuses connections
+safely under WSGI, so gunicorn.conf.py sets it to 0 for ASGI workers, where
+DATABASE_POOL=pgbouncer and a PgBouncer in transaction mode reuse them
+instead.
+"""
+
+import os
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+ENGINES = {
+    "sqlite": "django.db.backends.sqlite3",
+    "postgres": "django.db.backends.postgresql",
+    "postgresql": "django.db.backends.postgresql",
+    "pgsql": "django.db.backends.postgresql",
+}
+
+# Applied to every new SQLite connection by configure_sqlite(). WAL lets
+# readers carry on while a worker writes, so gunicorn workers don't queue up
+# behind each other for the database file.
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    # Durable at checkpoints rather than every commit, safe in WAL mode
+    "synchronous": "NORMAL",
+    # Wait this many ms for another worker's write lock instead of failing
+    "busy_timeout": 5000,
+    "mmap_size": 256 * 1024 * 1024,
+}
+
+
+def parse_url(url):
+    """DATABASES entry for a database URL"""
+    parts = urlsplit(url)
+    try:
+        engine = ENGINES[parts.scheme]
+    except KeyError:
+        raise ValueError(f"Unsupported database URL scheme {parts.scheme!r}")
+    options = dict(parse_qsl(parts.query))
+
+    if engine == ENGINES["sqlite"]:
+        # sqlite:///relative/path or sqlite:////absolute/path
+        return {"ENGINE": engine, "NAME": unquote(parts.path[1:]), "OPTIONS": options}
+    return {
+        "ENGINE": engine,
+        "NAME": unquote(parts.path.lstrip("/")),
+        "USER": unquote(parts.username or ""),
+        "PASSWORD": unquote(parts.password or ""),
+        "HOST": parts.hostname or "",
+        "PORT": str(parts.port or ""),
+        "OPTIONS": options,
+    }
+
+
+def from_env(default_url, environ=os.environ):
+    """The `default` DATABASES entry, from DATABASE_* environment variables"""
+    return _with_connection_settings(
+        parse_url(environ.get("DATABASE_URL", default_url)), environ
+    )
+
+
+def replicas_from_env(environ=os.environ):
+    """DATABASES entries for the replicas in DATABASE_REPLICA_URLS"""
+    urls = [url for url in environ.get("DATABASE_REPLICA_URLS", "").split(",") if url]
+    replicas = {}
+    for n, url in enumerate(urls, start=1):
+        config = _with_connection_settings(parse_url(url.strip()), environ)
+        # Tests read the test database through the replica aliases
+        config["TEST"] = {"MIRROR": "default"}
+        replicas[f"replica{n}"] = config
+    return replicas
+
+
+def _with_connection_settings(config, environ):
+    config["CONN_MAX_AGE"] = int(environ.get("DATABASE_CONN_MAX_AGE", 60))
+    config["CONN_HEALTH_CHECKS"] = config["CONN_MAX_AGE"] > 0
+    pool = environ.get("DATABASE_POOL", "")
+    if pool == "pgbouncer":
+        # A transaction pooler may hand each query to a different server
+        # connection, and server-side cursors don't survive that
+        config["DISABLE_SERVER_SIDE_CURSORS"] = True
+    elif pool:
+        raise ValueError(f"Unsupported DATABASE_POOL {pool!r}")
+    return config
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    """connection_created receiver applying SQLITE_PRAGMAS"""
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
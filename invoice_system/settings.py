@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 
 from pathlib import Path
 
+from invoice_system import database
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -47,6 +49,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "invoices.metrics.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -54,6 +57,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "invoices.replicas.ReplicaMiddleware",
 ]
 
 ROOT_URLCONF = "invoice_system.urls"
@@ -80,12 +84,15 @@ WSGI_APPLICATION = "invoice_system.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# Configured by DATABASE_URL and friends, see invoice_system/database.py
 DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
-    }
+    "default": database.from_env(default_url=f"sqlite:///{BASE_DIR / 'db.sqlite3'}"),
+    **database.replicas_from_env(),
 }
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != "default"]
+DATABASE_ROUTERS = ["invoices.replicas.ReplicaRouter"]
+# How long a user reads from the primary after changing something, seconds
+DATABASE_REPLICA_PIN_SECONDS = 10
 
 
 # Password validation
@@ -140,3 +147,55 @@ CSRF_TRUSTED_ORIGINS = [
     "https://localhost",
     "https://invoices.vndprojects.com",
 ]
+
+# Rendered invoice PDFs are cached on disk, see invoices/pdf_cache.py
+PDF_CACHE_DIR = BASE_DIR / "pdf_cache"
+PDF_CACHE_MAX_SIZE = 256 * 1024 * 1024  # bytes
+# Worker processes used by `manage.py render_pdfs`
+PDF_RENDER_PROCESSES = 2
+# Render processes per web worker for PDF downloads and bulk exports. With 0,
+# exports render in-process and downloads in a thread pool.
+PDF_EXPORT_PROCESSES = 2
+
+# Cached invoice table fragments, see invoices/fragments.py. A backend shared
+# by all web workers sees every change at once; with locmem, which is private
+# to each worker, fragments are kept for FRAGMENT_CACHE_LOCAL_TIMEOUT at most.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": BASE_DIR / "fragment_cache",
+    }
+}
+FRAGMENT_CACHE_TIMEOUT = 60 * 60  # seconds
+FRAGMENT_CACHE_LOCAL_TIMEOUT = 10  # seconds
+# Swaps CACHES for a locmem cache while the tests run
+TEST_RUNNER = "invoice_system.test_runner.TestRunner"
+
+# Invoice numbers each worker reserves at a time, see invoices/numbering.py
+INVOICE_NUMBER_BLOCK_SIZE = 10
+
+# `manage.py archive_invoices` moves invoices older than this into the
+# archive, see invoices/archive.py
+INVOICE_ARCHIVE_AFTER_DAYS = 2 * 365
+
+# Each line item on the invoice forms posts up to six fields, so
+# the default of 1,000 would turn away invoices of more than ~200 lines
+DATA_UPLOAD_MAX_NUMBER_FIELDS = 10_000
+
+# JSON API, see invoices/api.py. Batch request bodies bypass
+# DATA_UPLOAD_MAX_MEMORY_SIZE and are capped here instead.
+API_MAX_BODY_SIZE = 32 * 1024 * 1024  # bytes
+API_BATCH_MAX_RECORDS = 5000
+# Rows per INSERT/UPDATE statement when a batch is written
+API_BATCH_WRITE_SIZE = 500
+
+# Invoices emailed to clients, see invoices/outbox.py. `manage.py
+# send_invoice_emails` delivers them through EMAIL_BACKEND, Django's SMTP
+# backend on EMAIL_HOST:EMAIL_PORT unless configured otherwise.
+DEFAULT_FROM_EMAIL = "invoices@localhost"
+EMAIL_TIMEOUT = 30  # seconds, so a stalled server fails the send
+# Connections kept open to the server, each sending from its own thread
+EMAIL_OUTBOX_CONNECTIONS = 4
+EMAIL_OUTBOX_BATCH_SIZE = 100
+EMAIL_OUTBOX_MAX_ATTEMPTS = 5
+EMAIL_OUTBOX_RETRY_DELAY = 60  # seconds, doubled after every failed attempt
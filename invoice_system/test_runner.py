@@ -0,0 +1,28 @@
+"""
+Test runner that keeps the suite away from the deployment's caches.
+
+CACHES points at the on-disk fragment cache, which the tests would otherwise
+read stale fragments from and, through cache.clear(), wipe. Tests get a
+process-local cache instead.
+"""
+
+from django.test import override_settings
+from django.test.runner import DiscoverRunner
+
+TEST_CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "invoices-tests",
+    }
+}
+
+
+class TestRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.cache_override = override_settings(CACHES=TEST_CACHES)
+        self.cache_override.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.cache_override.disable()
+        super().teardown_test_environment(**kwargs)
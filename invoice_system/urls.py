@@ -14,17 +14,22 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+
 from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import include, path
 from django.views.generic.base import RedirectView
 
+from invoices.metrics import metrics_view
+
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("", include("invoices.urls")),
+    path("api/", include("invoices.api_urls")),
     path("accounts/", include("django.contrib.auth.urls")),
     path("accounts/", include("users.urls")),
+    path("metrics", metrics_view, name="metrics"),
     path("favicon.png", RedirectView.as_view(url=static("img/favicon.png"))),
 ]
 
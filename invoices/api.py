@@ -0,0 +1,409 @@
+"""
+JSON API for clients, invoices and their line items.
+
+Requests authenticate with HTTP Basic auth, or with the session cookie plus
+a CSRF token like the HTML forms. POST /api/invoices/batch/ creates and
+updates thousands of invoices per request: every record is validated first,
+then all of them are written with bulk queries in one transaction, so a
+batch is applied entirely or not at all.
+"""
+
+import base64
+import binascii
+import json
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.http import HttpResponse, JsonResponse
+from django.middleware.csrf import CsrfViewMiddleware
+from django.views.decorators.csrf import csrf_exempt
+
+from . import pdf_cache
+from .bulk import bulk_create_invoices
+from .models import Client, Invoice, InvoiceItem
+from .pagination import KeysetPage
+from .signals import schedule_refresh
+
+INVOICE_FIELDS = ("title", "invoice_terms")
+ITEM_FIELDS = ("item", "quantity", "rate", "tax")
+CLIENT_FIELDS = (
+    "first_name",
+    "last_name",
+    "email",
+    "company",
+    "address1",
+    "address2",
+    "country",
+    "phone_number",
+)
+PAGE_SIZE = 100
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=400, **extra):
+        super().__init__(message)
+        self.status = status
+        self.extra = extra
+
+    def response(self):
+        return JsonResponse({"error": str(self), **self.extra}, status=self.status)
+
+
+def _basic_auth_user(request):
+    header = request.META.get("HTTP_AUTHORIZATION", "")
+    scheme, _, credentials = header.partition(" ")
+    if scheme.lower() != "basic":
+        return None
+    try:
+        username, _, password = (
+            base64.b64decode(credentials).decode("utf-8").partition(":")
+        )
+    except (binascii.Error, UnicodeDecodeError):
+        raise ApiError("Malformed Authorization header", status=401)
+    user = authenticate(request, username=username, password=password)
+    if user is None or not user.is_active:
+        raise ApiError("Invalid username or password", status=401)
+    return user
+
+
+def _check_csrf(request):
+    # The session cookie is sent by the browser on its own, so cookie
+    # authenticated writes need the same CSRF token as the HTML forms
+    reason = CsrfViewMiddleware(lambda request: None).process_view(
+        request, None, (), {}
+    )
+    if reason is not None:
+        raise ApiError("CSRF check failed", status=403)
+
+
+def api_view(*methods):
+    """Authenticate the request and turn ApiErrors into JSON responses"""
+
+    def decorator(view_func):
+        @csrf_exempt
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            try:
+                if request.method not in methods:
+                    raise ApiError("Method not allowed", status=405)
+                user = _basic_auth_user(request)
+                if user is not None:
+                    request.user = user
+                elif not request.user.is_authenticated:
+                    raise ApiError("Authentication required", status=401)
+                elif request.method not in ("GET", "HEAD", "OPTIONS"):
+                    _check_csrf(request)
+                return view_func(request, *args, **kwargs)
+            except ApiError as exc:
+                response = exc.response()
+                if exc.status == 401:
+                    response["WWW-Authenticate"] = 'Basic realm="invoices"'
+                return response
+
+        return wrapper
+
+    return decorator
+
+
+def read_json(request):
+    """Decode the request body, which may be larger than Django's form limit"""
+    max_size = settings.API_MAX_BODY_SIZE
+    if int(request.META.get("CONTENT_LENGTH") or 0) > max_size:
+        raise ApiError("Request body too large", status=413)
+    body = request.read(max_size + 1)
+    if len(body) > max_size:
+        raise ApiError("Request body too large", status=413)
+    try:
+        return json.loads(body)
+    except (UnicodeDecodeError, ValueError):
+        raise ApiError("Request body is not valid JSON")
+
+
+def clean_fields(model, names, data, partial=False):
+    """Validate `data` against the model fields `names`
+
+    Returns (values, errors). Missing fields take their default, or are
+    left out when `partial`. Uses the model fields directly rather than a
+    ModelForm per record, which matters when a batch has thousands.
+    """
+    values = {}
+    errors = {}
+    if not isinstance(data, dict):
+        return values, {"__all__": ["Expected an object."]}
+    for name in names:
+        field = model._meta.get_field(name)
+        if name not in data:
+            if partial:
+                continue
+            if field.has_default():
+                values[name] = field.get_default()
+                continue
+            if field.blank:
+                values[name] = ""
+                continue
+            errors[name] = [str(field.error_messages["blank"])]
+            continue
+        try:
+            values[name] = field.clean(data[name], None)
+        except ValidationError as exc:
+            errors[name] = exc.messages
+    return values, errors
+
+
+def invoice_data(invoice, items=None):
+    data = {
+        "id": invoice.pk,
+        "number": invoice.number,
+        "title": invoice.title,
+        "client": invoice.client_id,
+        "invoice_terms": invoice.invoice_terms,
+        "create_date": invoice.create_date,
+        "invoice_total": invoice.invoice_total,
+        "item_count": invoice.item_count,
+    }
+    if items is not None:
+        data["items"] = [
+            {
+                "id": item.pk,
+                "item": item.item,
+                "quantity": item.quantity,
+                "rate": item.rate,
+                "tax": item.tax,
+                "subtotal": item.subtotal(),
+            }
+            for item in items
+        ]
+    return data
+
+
+def client_data(client):
+    data = {"id": client.pk}
+    data.update({name: str(getattr(client, name) or "") for name in CLIENT_FIELDS})
+    return data
+
+
+def page_response(page, serialize):
+    return JsonResponse(
+        {"results": [serialize(obj) for obj in page], "next": page.next_token()}
+    )
+
+
+class InvoiceBatch:
+    """Validates and then writes a list of invoice records for one user
+
+    A record with an "id" updates that invoice, replacing its line items
+    when "items" is given. Other records create invoices.
+    """
+
+    def __init__(self, user, records):
+        self.user = user
+        self.records = records
+        self.errors = []
+        self.new = []
+        self.changed = []
+
+    def validate(self):
+        client_ids = set(
+            Client.objects.filter(created_by=self.user).values_list("pk", flat=True)
+        )
+        ids = [
+            record["id"]
+            for record in self.records
+            if isinstance(record, dict) and isinstance(record.get("id"), int)
+        ]
+        existing = Invoice.objects.filter(user=self.user).in_bulk(ids)
+
+        updated_ids = set()
+        for index, record in enumerate(self.records):
+            invoice, items, errors = self.clean(record, client_ids, existing)
+            if invoice is not None and invoice.pk in updated_ids:
+                errors = {"id": ["Updated by an earlier record."]}
+            elif invoice is not None and invoice.pk is not None:
+                updated_ids.add(invoice.pk)
+            if errors:
+                self.errors.append({"index": index, "errors": errors})
+            elif invoice.pk is None:
+                self.new.append((index, invoice, items))
+            else:
+                self.changed.append((index, invoice, items))
+        return not self.errors
+
+    def clean(self, record, client_ids, existing):
+        if not isinstance(record, dict):
+            return None, None, {"__all__": ["Expected an object."]}
+        # Updates only change the fields they include
+        partial = "id" in record
+        if partial:
+            invoice = existing.get(record["id"])
+            if invoice is None:
+                return None, None, {"id": ["No such invoice."]}
+            # Remember the client whose rollups lose this invoice if it moves
+            invoice.previous_client_id = invoice.client_id
+        else:
+            invoice = Invoice(user=self.user)
+
+        values, errors = clean_fields(Invoice, INVOICE_FIELDS, record, partial)
+        if "client" in record or not partial:
+            if record.get("client") in client_ids:
+                values["client_id"] = record["client"]
+            else:
+                errors["client"] = ["Unknown client."]
+        items = None
+        if "items" in record or not partial:
+            items, item_errors = self.clean_items(record.get("items"))
+            if item_errors:
+                errors["items"] = item_errors
+        if errors:
+            return None, None, errors
+
+        for name, value in values.items():
+            setattr(invoice, name, value)
+        return invoice, items, {}
+
+    def clean_items(self, records):
+        if not isinstance(records, list):
+            return None, ["Expected a list of items."]
+        items = []
+        errors = {}
+        for index, data in enumerate(records):
+            values, item_errors = clean_fields(InvoiceItem, ITEM_FIELDS, data)
+            if item_errors:
+                errors[index] = item_errors
+            else:
+                items.append(InvoiceItem(**values))
+        return items, errors
+
+    @transaction.atomic
+    def save(self):
+        batch_size = settings.API_BATCH_WRITE_SIZE
+        bulk_create_invoices(
+            [(invoice, items) for _, invoice, items in self.new], batch_size
+        )
+
+        if self.changed:
+            invoices = [invoice for _, invoice, _ in self.changed]
+            Invoice.objects.bulk_update(
+                invoices, [*INVOICE_FIELDS, "client"], batch_size=batch_size
+            )
+            replaced = [
+                (invoice, items)
+                for _, invoice, items in self.changed
+                if items is not None
+            ]
+            InvoiceItem.objects.filter(
+                invoice__in=[invoice for invoice, _ in replaced]
+            ).delete_in_bulk()
+            new_items = []
+            for invoice, items in replaced:
+                for item in items:
+                    item.invoice = invoice
+                    new_items.append(item)
+            InvoiceItem.objects.bulk_create(new_items, batch_size=batch_size)
+            pdf_cache.invalidate(*[invoice.pk for invoice in invoices])
+
+        # Bulk queries skip the signals that refresh totals, rollups, the
+        # search index and cached fragments, schedule it for all at once
+        for _, invoice, _ in self.new:
+            schedule_refresh(invoice_id=invoice.pk)
+        for _, invoice, _ in self.changed:
+            schedule_refresh(invoice_id=invoice.pk)
+            if invoice.previous_client_id != invoice.client_id:
+                schedule_refresh(client_id=invoice.previous_client_id)
+
+    def results(self):
+        results = [
+            {"index": index, "id": invoice.pk, "status": "created"}
+            for index, invoice, _ in self.new
+        ]
+        results += [
+            {"index": index, "id": invoice.pk, "status": "updated"}
+            for index, invoice, _ in self.changed
+        ]
+        return sorted(results, key=lambda result: result["index"])
+
+
+def apply_batch(user, records):
+    if not isinstance(records, list):
+        raise ApiError('Expected {"invoices": [...]}')
+    if len(records) > settings.API_BATCH_MAX_RECORDS:
+        raise ApiError(
+            f"At most {settings.API_BATCH_MAX_RECORDS} invoices per batch",
+            status=413,
+        )
+    batch = InvoiceBatch(user, records)
+    if not batch.validate():
+        raise ApiError("Invalid records, nothing was saved", errors=batch.errors)
+    batch.save()
+    return batch.results()
+
+
+@api_view("GET", "POST")
+def invoices(request):
+    if request.method == "POST":
+        [result] = apply_batch(request.user, [read_json(request)])
+        invoice = Invoice.objects.get(pk=result["id"])
+        return JsonResponse(
+            invoice_data(invoice, invoice.items.order_by("pk")), status=201
+        )
+    page = KeysetPage(
+        Invoice.objects.filter(user=request.user),
+        ("-id",),
+        PAGE_SIZE,
+        request.GET.get("cursor"),
+    )
+    return page_response(page, invoice_data)
+
+
+@api_view("GET", "PATCH", "DELETE")
+def invoice_detail(request, pk):
+    try:
+        invoice = Invoice.objects.get(user=request.user, pk=pk)
+    except Invoice.DoesNotExist:
+        raise ApiError("No such invoice", status=404)
+    if request.method == "DELETE":
+        invoice.delete()
+        return HttpResponse(status=204)
+    if request.method == "PATCH":
+        record = read_json(request)
+        if not isinstance(record, dict):
+            raise ApiError("Expected an object")
+        apply_batch(request.user, [{**record, "id": invoice.pk}])
+        invoice.refresh_from_db()
+    return JsonResponse(invoice_data(invoice, invoice.items.order_by("pk")))
+
+
+@api_view("POST")
+def invoice_batch(request):
+    """Create and update many invoices at once, all or nothing"""
+    data = read_json(request)
+    records = data.get("invoices") if isinstance(data, dict) else None
+    return JsonResponse({"results": apply_batch(request.user, records)})
+
+
+@api_view("GET", "POST")
+def clients(request):
+    if request.method == "POST":
+        values, errors = clean_fields(Client, CLIENT_FIELDS, read_json(request))
+        if errors:
+            raise ApiError("Invalid client", errors=errors)
+        client = Client.objects.create(created_by=request.user, **values)
+        return JsonResponse(client_data(client), status=201)
+    page = KeysetPage(
+        Client.objects.filter(created_by=request.user),
+        ("-id",),
+        PAGE_SIZE,
+        request.GET.get("cursor"),
+    )
+    return page_response(page, client_data)
+
+
+@api_view("GET")
+def client_detail(request, pk):
+    try:
+        client = Client.objects.get(created_by=request.user, pk=pk)
+    except Client.DoesNotExist:
+        raise ApiError("No such client", status=404)
+    return JsonResponse(client_data(client))
@@ -0,0 +1,11 @@
+from django.urls import path
+
+from . import api
+
+urlpatterns = [
+    path("invoices/", api.invoices, name="api-invoices"),
+    path("invoices/batch/", api.invoice_batch, name="api-invoice-batch"),
+    path("invoices/<int:pk>/", api.invoice_detail, name="api-invoice-detail"),
+    path("clients/", api.clients, name="api-clients"),
+    path("clients/<int:pk>/", api.client_detail, name="api-client-detail"),
+]
@@ -1,4 +1,7 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+
+from invoice_system.database import configure_sqlite
 
 
 class InvoicesConfig(AppConfig):
@@ -6,4 +9,7 @@ class InvoicesConfig(AppConfig):
     name = "invoices"
 
     def ready(self):
+        import invoices.metrics  # noqa F401
         import invoices.signals  # noqa F401
+
+        connection_created.connect(configure_sqlite)
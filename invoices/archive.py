@@ -0,0 +1,144 @@
+"""
+Cold storage for old invoices.
+
+archive() moves invoices created before a given date, with their line items,
+out of the Invoice and InvoiceItem tables that every list, index and rollup
+refresh works through, into one ArchivedInvoice row each. The invoice's
+emails go with it, so its history is kept; invoices with emails still to
+send wait until they are sent. Deleting the invoices goes through the usual
+signals, so the search index, cached PDFs and rollups follow; rollups count
+archived invoices too.
+
+An archived invoice is loaded back as unsaved Invoice, InvoiceItem and
+OutboundEmail instances, which the invoice page and the PDF renderer take like
+any others.
+Archived invoices are read only.
+"""
+
+import datetime
+import json
+import zlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Prefetch
+
+from .models import ArchivedInvoice, Invoice, InvoiceItem, OutboundEmail
+
+BATCH_SIZE = 500
+
+
+class _Encoder(DjangoJSONEncoder):
+    def default(self, o):
+        # DjangoJSONEncoder drops microseconds, which updated_at needs to
+        # keep the invoice's ETag
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def _values(obj):
+    return {field.attname: getattr(obj, field.attname) for field in obj._meta.fields}
+
+
+def _instance(model, values):
+    return model(
+        **{
+            field.attname: field.to_python(values[field.attname])
+            for field in model._meta.fields
+            if field.attname in values
+        }
+    )
+
+
+def pack(invoice, invoice_items, emails=()):
+    data = {
+        "invoice": _values(invoice),
+        "items": [_values(item) for item in invoice_items],
+        "emails": [_values(email) for email in emails],
+    }
+    encoded = json.dumps(data, cls=_Encoder, separators=(",", ":"))
+    return zlib.compress(encoded.encode(), 9)
+
+
+def load(archived):
+    """The invoice in `archived`, with its client, user, archived_items and
+    archived_emails
+
+    `archived` should come with its client and user already loaded.
+    """
+    data = json.loads(zlib.decompress(archived.data))
+    invoice = _instance(Invoice, data["invoice"])
+    invoice.number = archived.number
+    invoice.updated_at = archived.updated_at
+    invoice.client = archived.client
+    invoice.user = archived.user
+    invoice.archived_items = [
+        _instance(InvoiceItem, values) for values in data["items"]
+    ]
+    # Archives made before emails were kept have none
+    invoice.archived_emails = [
+        _instance(OutboundEmail, values) for values in data.get("emails", [])
+    ]
+    for related in (*invoice.archived_items, *invoice.archived_emails):
+        related.invoice = invoice
+    return invoice
+
+
+async def aget_archived_invoice(pk, **filters):
+    """The archived invoice `pk` as an Invoice, or None"""
+    archived = (
+        await ArchivedInvoice.objects.filter(pk=pk, **filters)
+        .select_related("client", "user")
+        .afirst()
+    )
+    return load(archived) if archived else None
+
+
+def archive(before, batch_size=BATCH_SIZE, using=DEFAULT_DB_ALIAS):
+    """Archive every invoice created before the date `before`
+
+    Each batch is its own transaction, so derived data is refreshed and the
+    archived rows leave the hot tables as the run goes along. Returns the
+    number of invoices archived.
+    """
+    invoices = (
+        Invoice.objects.using(using)
+        .filter(create_date__lt=before)
+        # Left for the sender, who would otherwise lose them
+        .exclude(emails__status__in=[OutboundEmail.PENDING, OutboundEmail.SENDING])
+        .order_by("pk")
+        .prefetch_related(
+            Prefetch("items", queryset=InvoiceItem.objects.using(using).order_by("pk")),
+            Prefetch(
+                "emails", queryset=OutboundEmail.objects.using(using).order_by("pk")
+            ),
+        )
+    )
+    archived = 0
+    while True:
+        with transaction.atomic(using=using):
+            # Locked, so nothing is added to them on the way out
+            batch = list(invoices.select_for_update()[:batch_size])
+            if not batch:
+                return archived
+            ArchivedInvoice.objects.using(using).bulk_create(
+                ArchivedInvoice(
+                    id=invoice.pk,
+                    user_id=invoice.user_id,
+                    client_id=invoice.client_id,
+                    title=invoice.title,
+                    number=invoice.number,
+                    invoice_total=invoice.invoice_total,
+                    create_date=invoice.create_date,
+                    updated_at=invoice.updated_at,
+                    data=pack(invoice, invoice.items.all(), invoice.emails.all()),
+                )
+                for invoice in batch
+            )
+            ids = [invoice.pk for invoice in batch]
+            # The invoices' own signals refresh everything derived from their
+            # items, which needn't each send their own first
+            InvoiceItem.objects.using(using).filter(invoice_id__in=ids).delete_in_bulk()
+            Invoice.objects.using(using).filter(pk__in=ids).delete()
+        archived += len(batch)
@@ -0,0 +1,71 @@
+"""
+Helpers for async views on Django 4.2.
+
+Under ASGI, async views run on the event loop, where anything that queries
+the database synchronously raises SynchronousOnlyOperation. That includes
+the lazily loaded request.user, which login_required and LoginRequiredMixin
+read directly, so async views use the versions here instead.
+"""
+
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.contrib.auth.views import redirect_to_login
+from django.http import Http404
+
+
+async def aload_user(request):
+    """Load request.user from the session without blocking the event loop"""
+    await sync_to_async(lambda: request.user.is_authenticated)()
+    return request.user
+
+
+def async_login_required(view_func):
+    """login_required for coroutine function views"""
+
+    @wraps(view_func)
+    async def wrapper(request, *args, **kwargs):
+        user = await aload_user(request)
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        return await view_func(request, *args, **kwargs)
+
+    return wrapper
+
+
+class AsyncLoginRequiredMixin(LoginRequiredMixin):
+    """LoginRequiredMixin for class-based views with async handlers"""
+
+    async def dispatch(self, request, *args, **kwargs):
+        user = await aload_user(request)
+        if not user.is_authenticated:
+            return self.handle_no_permission()
+        # Skip LoginRequiredMixin.dispatch, the check is done
+        return await super(LoginRequiredMixin, self).dispatch(request, *args, **kwargs)
+
+
+async def aget_object_or_404(queryset, **kwargs):
+    try:
+        return await queryset.aget(**kwargs)
+    except queryset.model.DoesNotExist:
+        raise Http404(f"No {queryset.model._meta.object_name} matches the query.")
+
+
+class AsyncKeysetListMixin:
+    """Async GET for keyset paginated list views
+
+    The page is fetched with the async ORM before the template renders,
+    unless the template will serve it from the fragment cache instead.
+    """
+
+    async def get(self, request, *args, **kwargs):
+        await aload_user(request)
+        self.object_list = self.get_queryset()
+        context = self.get_context_data()
+        if not await self.is_fragment_cached(context):
+            await context["page_obj"].afetch()
+        return self.render_to_response(context)
+
+    async def is_fragment_cached(self, context):
+        return False
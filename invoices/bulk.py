@@ -0,0 +1,50 @@
+from collections import defaultdict
+
+from . import numbering
+from .models import Invoice, InvoiceItem
+
+
+def _number_invoices(invoices):
+    unnumbered = defaultdict(list)
+    for invoice in invoices:
+        if invoice.number is None:
+            unnumbered[invoice.user_id].append(invoice)
+    for user_id, user_invoices in unnumbered.items():
+        numbers = numbering.allocate(user_id, len(user_invoices))
+        for invoice, number in zip(user_invoices, numbers):
+            invoice.number = number
+
+
+def bulk_create_invoices(invoices, batch_size=500):
+    """Insert unsaved invoices and their line items without per-row signals
+
+    `invoices` is a list of (Invoice, [InvoiceItem, ...]) pairs. Numbers,
+    totals and item counts are set here in Python because the signal
+    handlers that normally keep them up to date don't run for bulk inserts.
+    """
+    _number_invoices(invoice for invoice, _ in invoices)
+    create_dates = []
+    for invoice, invoice_items in invoices:
+        invoice.invoice_total = sum(item.subtotal() for item in invoice_items)
+        invoice.item_count = len(invoice_items)
+        create_dates.append(invoice.create_date)
+
+    # create_date is auto_now_add, so bulk_create overwrites it with today
+    saved = Invoice.objects.bulk_create(
+        [invoice for invoice, _ in invoices], batch_size=batch_size
+    )
+    backdated = []
+    for invoice, create_date in zip(saved, create_dates):
+        if create_date and create_date != invoice.create_date:
+            invoice.create_date = create_date
+            backdated.append(invoice)
+    if backdated:
+        Invoice.objects.bulk_update(backdated, ["create_date"], batch_size=batch_size)
+
+    all_items = []
+    for invoice, invoice_items in invoices:
+        for item in invoice_items:
+            item.invoice = invoice
+            all_items.append(item)
+    InvoiceItem.objects.bulk_create(all_items, batch_size=batch_size)
+    return saved
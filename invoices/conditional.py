@@ -0,0 +1,54 @@
+"""
+Conditional GET for pages and files generated from one invoice.
+
+Invoice.updated_at changes whenever anything printed on the invoice does, so
+it's enough to tell whether a browser's copy is current, before the items are
+fetched or anything is rendered. Django 4.2's condition() decorator can't
+wrap async views, hence these helpers.
+"""
+
+import hashlib
+
+from django.middleware.csrf import get_token
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+
+def invoice_etag(invoice, *variant):
+    """Strong ETag for one representation of `invoice`
+
+    `variant` holds whatever else the response depends on, such as the page
+    of items shown or the PDF renderer version.
+    """
+    parts = [invoice.pk, invoice.updated_at.isoformat(), *variant]
+    digest = hashlib.sha256(repr(parts).encode()).hexdigest()[:32]
+    return f'"{digest}"'
+
+
+def csrf_secret(request):
+    """The CSRF secret behind the tokens in a page, set up if the browser has none
+
+    Logging in rotates it, and a page revalidated with an older secret's token
+    in its forms would fail every POST, so pages with forms put it in their
+    ETag. Only its hash ever leaves the server.
+    """
+    get_token(request)
+    return request.META["CSRF_COOKIE"]
+
+
+def not_modified(request, etag, last_modified):
+    """The 304 (or 412) response if the client's copy is current, else None"""
+    response = get_conditional_response(
+        request, etag=etag, last_modified=int(last_modified.timestamp())
+    )
+    if response is not None and response.status_code == 304:
+        add_validators(response, etag, last_modified)
+    return response
+
+
+def add_validators(response, etag, last_modified):
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified.timestamp())
+    # Browsers may keep a copy, but must check it's current before use
+    response["Cache-Control"] = "private, no-cache"
+    return response
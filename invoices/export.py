@@ -0,0 +1,78 @@
+from concurrent.futures import FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+
+from .models import Invoice
+from .pdf import create_render_pool, pdf_filename
+from .pdf_cache import get_invoice_pdf
+
+_render_pool = None
+
+
+def get_render_pool():
+    # One pool per web worker, started on the first export it serves
+    global _render_pool
+    if _render_pool is None:
+        _render_pool = create_render_pool(settings.PDF_EXPORT_PROCESSES)
+    return _render_pool
+
+
+def discard_render_pool(pool):
+    """Forget a broken pool, so get_render_pool() starts a new one
+
+    A pool breaks for good when one of its processes dies, e.g. killed for
+    running out of memory, and fails every render after.
+    """
+    global _render_pool
+    if _render_pool is pool:
+        _render_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def render_pdf_by_id(invoice_id):
+    invoice = Invoice.objects.select_related("client", "user").get(pk=invoice_id)
+    return pdf_filename(invoice), get_invoice_pdf(invoice)
+
+
+def _render_in_pool(pool, invoice_ids, processes):
+    invoice_ids = iter(invoice_ids)
+    pending = set()
+    try:
+        for invoice_id in invoice_ids:
+            pending.add(pool.submit(render_pdf_by_id, invoice_id))
+            if len(pending) >= 2 * processes:
+                break
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+                invoice_id = next(invoice_ids, None)
+                if invoice_id is not None:
+                    pending.add(pool.submit(render_pdf_by_id, invoice_id))
+    finally:
+        # The client went away or a render failed, drop the queued work
+        for future in pending:
+            future.cancel()
+
+
+def render_invoice_pdfs(invoice_ids, processes=None):
+    """Yield (filename, pdf) pairs in the order the renders finish
+
+    At most two renders per process are queued at a time, so memory use does
+    not grow with the number of invoices. With `processes=0` the PDFs are
+    rendered one by one in the calling process.
+    """
+    if processes is None:
+        processes = settings.PDF_EXPORT_PROCESSES
+    if not processes:
+        for invoice_id in invoice_ids:
+            yield render_pdf_by_id(invoice_id)
+        return
+
+    pool = get_render_pool()
+    try:
+        yield from _render_in_pool(pool, invoice_ids, processes)
+    except BrokenProcessPool:
+        discard_render_pool(pool)
+        raise
@@ -1,7 +1,11 @@
 from django import forms
-from django.forms import ModelForm
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.forms import BaseInlineFormSet, ModelForm
 
+from . import pdf_cache
 from .models import Client, Invoice, InvoiceItem
+from .signals import schedule_refresh
 
 
 class InvoiceItemsForm(ModelForm):
@@ -10,6 +14,93 @@ class InvoiceItemsForm(ModelForm):
         fields = "__all__"
 
 
+class LoadedObjectField(forms.ModelChoiceField):
+    """Primary key field of a model formset's form that looks the object up
+    among those the formset already loaded, rather than with a query"""
+
+    def __init__(self, objects, *args, **kwargs):
+        self.objects = objects
+        super().__init__(*args, **kwargs)
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        try:
+            return self.objects[self.queryset.model._meta.pk.to_python(value)]
+        except (KeyError, ValidationError):
+            raise ValidationError(
+                self.error_messages["invalid_choice"], code="invalid_choice"
+            )
+
+
+class BaseInvoiceItemFormSet(BaseInlineFormSet):
+    """Saves an invoice's line items with a few bulk queries
+
+    The stock formset saves each form on its own, a query per item (plus the
+    lookup of its primary key while validating). Here the forms are diffed
+    against the invoice's items instead, and the new, changed and deleted
+    ones are written with one bulk_create, bulk_update and DELETE, so saving
+    a 500-line invoice takes a handful of queries instead of ~1,500.
+    """
+
+    def add_fields(self, form, index):
+        super().add_fields(form, index)
+        name = self._pk_field.name
+        field = form.fields[name]
+        if not hasattr(self, "_loaded_objects"):
+            self._loaded_objects = {obj.pk: obj for obj in self.get_queryset()}
+        form.fields[name] = LoadedObjectField(
+            self._loaded_objects,
+            field.queryset,
+            initial=field.initial,
+            required=False,
+            widget=field.widget,
+        )
+
+    def _diff(self):
+        """New, changed (with their changed fields) and deleted items"""
+        new, changed, deleted = [], [], []
+        for form in self.initial_forms:
+            if form.instance.pk is None:
+                continue
+            if self.can_delete and self._should_delete_form(form):
+                deleted.append(form.instance)
+            elif form.has_changed():
+                changed.append((form.save(commit=False), form.changed_data))
+        for form in self.extra_forms:
+            if not form.has_changed():
+                continue
+            if self.can_delete and self._should_delete_form(form):
+                continue
+            obj = form.save(commit=False)
+            setattr(obj, self.fk.name, self.instance)
+            new.append(obj)
+        return new, changed, deleted
+
+    def save(self, commit=True):
+        if not commit:
+            return super().save(commit=False)
+        new, changed, deleted = self._diff()
+        items = self.model._default_manager.using(self.instance._state.db)
+        fields = {name for _, changed_data in changed for name in changed_data}
+        fields = [f.name for f in self.model._meta.concrete_fields if f.name in fields]
+        with transaction.atomic(using=items.db):
+            items.bulk_create(new)
+            if fields:
+                items.bulk_update([obj for obj, _ in changed], fields)
+            if deleted:
+                items.filter(pk__in=[obj.pk for obj in deleted]).delete_in_bulk()
+            # The bulk writes and deletes skip the per-item signals, so the
+            # invoice's total and PDF are refreshed once here
+            schedule_refresh(items.db, invoice_id=self.instance.pk)
+            pdf_cache.invalidate(self.instance.pk)
+
+        self.new_objects = new
+        self.changed_objects = changed
+        self.deleted_objects = deleted
+        return new + [obj for obj, _ in changed]
+
+
 class InvoiceCreateForm(ModelForm):
     class Meta:
         model = Invoice
@@ -27,6 +118,27 @@ class InvoiceEditForm(ModelForm):
         fields = ["title", "client"]
 
 
+class InvoiceExportForm(forms.Form):
+    client = forms.ModelChoiceField(queryset=Client.objects.none(), required=False)
+    start_date = forms.DateField(required=False)
+    end_date = forms.DateField(required=False)
+
+    def __init__(self, *args, **kwargs):
+        self.user = kwargs.pop("user")
+        super(InvoiceExportForm, self).__init__(*args, **kwargs)
+        self.fields["client"].queryset = Client.objects.filter(created_by=self.user)
+
+    def get_invoices(self):
+        invoices = Invoice.objects.filter(user=self.user)
+        if self.cleaned_data["client"]:
+            invoices = invoices.filter(client=self.cleaned_data["client"])
+        if self.cleaned_data["start_date"]:
+            invoices = invoices.filter(create_date__gte=self.cleaned_data["start_date"])
+        if self.cleaned_data["end_date"]:
+            invoices = invoices.filter(create_date__lte=self.cleaned_data["end_date"])
+        return invoices.order_by("create_date", "pk")
+
+
 COUNTRIES = (
     ("", "Choose..."),
     ("Afghanistan", "Afghanistan"),
@@ -0,0 +1,49 @@
+"""
+Versioning for cached template fragments.
+
+Each user's cached invoice tables include a version token in their cache key.
+invoices.signals replaces the token whenever the user's invoices, items or
+clients change, which orphans every fragment cached under the old one.
+Tokens are random, so a token that was evicted and recreated can never match
+fragments cached before.
+
+A local-memory cache is private to each process, so a bump only reaches the
+worker that made it. With one, fragments are kept no longer than
+FRAGMENT_CACHE_LOCAL_TIMEOUT, which bounds how stale another worker's copy
+can get.
+"""
+
+import uuid
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+
+VERSION_KEY = "invoices:fragments:version:{}"
+
+
+def get_version(user_id):
+    key = VERSION_KEY.format(user_id)
+    version = cache.get(key)
+    if version is None:
+        version = uuid.uuid4().hex
+        cache.add(key, version, timeout=None)
+        # Another request may have created the token first
+        version = cache.get(key, version)
+    return version
+
+
+def get_timeout():
+    """Seconds a cached fragment is kept for"""
+    if isinstance(caches[DEFAULT_CACHE_ALIAS], LocMemCache):
+        return min(
+            settings.FRAGMENT_CACHE_TIMEOUT, settings.FRAGMENT_CACHE_LOCAL_TIMEOUT
+        )
+    return settings.FRAGMENT_CACHE_TIMEOUT
+
+
+def bump(*user_ids):
+    cache.set_many(
+        {VERSION_KEY.format(user_id): uuid.uuid4().hex for user_id in user_ids},
+        timeout=None,
+    )
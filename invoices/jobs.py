@@ -0,0 +1,94 @@
+"""
+Background PDF rendering.
+
+Web requests enqueue a ``PdfRenderJob`` row and return straight away. The
+``render_pdfs`` management command claims pending jobs and renders them in a
+process pool, storing the result in the PDF cache where the download endpoint
+picks it up.
+"""
+
+from django.db import DEFAULT_DB_ALIAS
+from django.utils import timezone
+
+from .models import Invoice, PdfRenderJob
+from .pdf_cache import get_invoice_pdf
+
+
+def enqueue_pdf_render(invoice):
+    """Queue a render of the invoice, reusing a job that is already queued"""
+    # Look on the primary even when the request reads from a replica, which
+    # may not have the job queued a moment ago yet
+    jobs = PdfRenderJob.objects.using(DEFAULT_DB_ALIAS)
+    job = (
+        jobs.filter(
+            invoice=invoice, status__in=[PdfRenderJob.PENDING, PdfRenderJob.RUNNING]
+        )
+        .order_by("-created_at")
+        .first()
+    )
+    if job is None:
+        job = jobs.create(invoice=invoice)
+    return job
+
+
+def requeue(job):
+    PdfRenderJob.objects.filter(pk=job.pk).update(
+        status=PdfRenderJob.PENDING, error="", started_at=None, finished_at=None
+    )
+    job.refresh_from_db()
+    return job
+
+
+def claim_jobs(limit):
+    """Mark up to `limit` pending jobs as running and return their ids
+
+    The conditional UPDATE makes claiming safe when several workers drain the
+    same table.
+    """
+    pending = PdfRenderJob.objects.filter(status=PdfRenderJob.PENDING).values_list(
+        "pk", flat=True
+    )[:limit]
+    claimed = []
+    for job_id in pending:
+        updated = PdfRenderJob.objects.filter(
+            pk=job_id, status=PdfRenderJob.PENDING
+        ).update(status=PdfRenderJob.RUNNING, started_at=timezone.now())
+        if updated:
+            claimed.append(job_id)
+    return claimed
+
+
+def release_jobs(job_ids):
+    """Put claimed jobs that haven't finished back in the queue, returning how
+    many"""
+    return PdfRenderJob.objects.filter(
+        pk__in=job_ids, status=PdfRenderJob.RUNNING
+    ).update(status=PdfRenderJob.PENDING, started_at=None)
+
+
+def requeue_stale_jobs(claimed_before):
+    """Put jobs claimed before `claimed_before` and still running back in the
+    queue, returning how many
+
+    Their worker died mid-render. Until they're requeued, nobody renders them
+    and enqueue_pdf_render() keeps handing them out.
+    """
+    return PdfRenderJob.objects.filter(
+        status=PdfRenderJob.RUNNING, started_at__lt=claimed_before
+    ).update(status=PdfRenderJob.PENDING, started_at=None)
+
+
+def run_job(job_id):
+    """Render the PDF for a claimed job, runs inside a pool worker"""
+    job = PdfRenderJob.objects.get(pk=job_id)
+    invoice = Invoice.objects.select_related("client", "user").get(pk=job.invoice_id)
+    try:
+        get_invoice_pdf(invoice)
+    except Exception as exc:
+        job.status = PdfRenderJob.FAILED
+        job.error = repr(exc)
+    else:
+        job.status = PdfRenderJob.DONE
+    job.finished_at = timezone.now()
+    job.save(update_fields=["status", "error", "finished_at"])
+    return job.status
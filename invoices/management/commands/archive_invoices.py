@@ -0,0 +1,32 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from invoices import archive
+
+
+class Command(BaseCommand):
+    help = "Move old invoices and their line items into the archive"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=settings.INVOICE_ARCHIVE_AFTER_DAYS,
+            help="Archive invoices created more than this many days ago",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=archive.BATCH_SIZE,
+            help="Invoices archived per transaction",
+        )
+
+    def handle(self, *args, **options):
+        if options["days"] < 0:
+            raise CommandError("--days can't be negative")
+        before = timezone.localdate() - datetime.timedelta(days=options["days"])
+        count = archive.archive(before, batch_size=options["batch_size"])
+        self.stdout.write(f"Archived {count} invoices created before {before}")
@@ -0,0 +1,339 @@
+import datetime
+import json
+import statistics
+import tempfile
+import time
+import tracemalloc
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client as TestClient
+from django.test.utils import (
+    CaptureQueriesContext,
+    override_settings,
+    setup_test_environment,
+    teardown_test_environment,
+)
+from django.urls import reverse
+
+from invoices import pdf_cache, rollups
+from invoices.bulk import bulk_create_invoices
+from invoices.models import Client, Invoice, InvoiceItem
+
+# Metrics compared against a baseline; a higher value is a regression
+COMPARED_METRICS = ("p50_ms", "p95_ms", "p99_ms", "queries", "peak_memory_kb")
+
+
+def seed(users, clients, invoices, items):
+    """Create `users` users, each with `clients` clients billed `invoices`
+    invoices of `items` line items, and return the users"""
+    User = get_user_model()
+    created = []
+    for n in range(users):
+        user = User(
+            username=f"benchmark{n}",
+            email=f"benchmark{n}@example.com",
+            first_name="Bench",
+            last_name=f"User {n}",
+        )
+        user.set_unusable_password()
+        created.append(user)
+    # Users have signals of their own, so they're saved one by one
+    for user in created:
+        user.save()
+
+    today = datetime.date.today()
+    for user in created:
+        user_clients = Client.objects.bulk_create(
+            Client(
+                first_name=f"Client {n}",
+                last_name=f"{n:05d}",
+                email=f"client{n}@example.com",
+                company="Benchmark Ltd",
+                address1="1234 Paradise Lane",
+                address2="Good Street",
+                country="Zimbabwe",
+                created_by=user,
+            )
+            for n in range(clients)
+        )
+        batch = []
+        for client in user_clients:
+            for n in range(invoices):
+                invoice = Invoice(
+                    title=f"Invoice {n}",
+                    user=user,
+                    client=client,
+                    create_date=today - datetime.timedelta(days=n),
+                )
+                invoice_items = [
+                    InvoiceItem(
+                        item=f"Line {m}", quantity=m % 5 + 1, rate=Decimal("19.99")
+                    )
+                    for m in range(items)
+                ]
+                batch.append((invoice, invoice_items))
+        bulk_create_invoices(batch)
+    rollups.rebuild()
+    return created
+
+
+def get_scenarios(user):
+    """(name, method, url, data) for every route worth measuring
+
+    Delete views, the upload form and the PDF job routes are left out, they
+    either destroy the dataset or need state that requests don't create.
+    """
+    invoice = Invoice.objects.filter(user=user).latest("create_date", "pk")
+    client = invoice.client
+    item = invoice.items.order_by("pk").first()
+    new_invoice = {
+        "title": "Benchmark invoice",
+        "client": client.pk,
+        "items-TOTAL_FORMS": 1,
+        "items-INITIAL_FORMS": 0,
+        "items-0-item": "Consulting",
+        "items-0-quantity": 2,
+        "items-0-rate": "50.00",
+    }
+    edit_invoice = {
+        "title": invoice.title,
+        "client": client.pk,
+        "items-TOTAL_FORMS": 1,
+        "items-INITIAL_FORMS": 1,
+        "items-0-id": item.pk if item else "",
+        "items-0-item": "Consulting",
+        "items-0-quantity": 3,
+        "items-0-rate": "50.00",
+    }
+    edit_client = {
+        "first_name": client.first_name,
+        "last_name": client.last_name,
+        "email": client.email,
+        "company": client.company,
+        "address1": client.address1,
+        "address2": client.address2,
+        "country": client.country,
+        "phone_number": "",
+    }
+    return [
+        ("home", "get", reverse("home"), None),
+        ("invoice-list", "get", reverse("invoice-list"), None),
+        ("invoice-detail", "get", reverse("invoice-detail", args=[invoice.pk]), None),
+        ("generate_pdf", "get", reverse("generate_pdf", args=[invoice.pk]), None),
+        (
+            "invoice-export",
+            "get",
+            reverse("invoice-export") + f"?client={client.pk}",
+            None,
+        ),
+        ("new-invoice", "get", reverse("new-invoice"), None),
+        ("new-invoice", "post", reverse("new-invoice"), new_invoice),
+        ("invoice-edit", "get", reverse("invoice-edit", args=[invoice.pk]), None),
+        (
+            "invoice-edit",
+            "post",
+            reverse("invoice-edit", args=[invoice.pk]),
+            edit_invoice,
+        ),
+        ("client-list", "get", reverse("client-list"), None),
+        ("client-detail", "get", reverse("client-detail", args=[client.pk]), None),
+        ("new-client", "get", reverse("new-client"), None),
+        ("client-edit", "get", reverse("client-edit", args=[client.pk]), None),
+        (
+            "client-edit",
+            "post",
+            reverse("client-edit", args=[client.pk]),
+            edit_client,
+        ),
+    ]
+
+
+def percentile(cut_points, p):
+    return round(cut_points[p - 1], 3)
+
+
+def measure(browser, method, url, data, requests, warmup=2, cold=False):
+    """Latency percentiles over `requests` requests, then the queries and
+    peak Python memory of one more"""
+
+    def send():
+        if cold:
+            cache.clear()
+            pdf_cache.evict(max_size=0)
+        response = getattr(browser, method)(url, data)
+        if response.streaming:
+            for _ in response.streaming_content:
+                pass
+        if response.status_code >= 400:
+            raise CommandError(f"{method.upper()} {url}: {response.status_code}")
+        return response
+
+    for _ in range(warmup):
+        send()
+
+    timings = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        response = send()
+        timings.append((time.perf_counter() - start) * 1000)
+
+    # Tracing allocations slows everything down, so it gets a run of its own
+    tracemalloc.start()
+    try:
+        with CaptureQueriesContext(connection) as queries:
+            send()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    cut_points = statistics.quantiles(timings, n=100, method="inclusive")
+    return {
+        "status": response.status_code,
+        "requests": requests,
+        "p50_ms": percentile(cut_points, 50),
+        "p95_ms": percentile(cut_points, 95),
+        "p99_ms": percentile(cut_points, 99),
+        "queries": len(queries),
+        "peak_memory_kb": round(peak / 1024, 1),
+    }
+
+
+def run_benchmark(user, requests, cold=False):
+    browser = TestClient()
+    browser.force_login(user)
+    results = {}
+    for name, method, url, data in get_scenarios(user):
+        results[f"{method.upper()} {name}"] = measure(
+            browser, method, url, data, requests, cold=cold
+        )
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Change of each metric relative to `baseline`, flagging regressions
+
+    Timings and memory regress when they grow by more than `threshold`
+    percent, query counts when they grow at all.
+    """
+    diff = {}
+    for route, metrics in results.items():
+        if route not in baseline:
+            continue
+        changes = {}
+        for metric in COMPARED_METRICS:
+            before, after = baseline[route].get(metric), metrics[metric]
+            if before is None:
+                continue
+            change = (after - before) / before * 100 if before else 0.0
+            limit = 0 if metric == "queries" else threshold
+            changes[metric] = {
+                "baseline": before,
+                "current": after,
+                "change_pct": round(change, 1),
+                "regression": after > before and change > limit,
+            }
+        diff[route] = changes
+    return diff
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the latency, query count and memory of every invoices route "
+        "against a synthetic dataset in a throwaway test database"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=2)
+        parser.add_argument("--clients", type=int, default=20, help="Per user")
+        parser.add_argument("--invoices", type=int, default=10, help="Per client")
+        parser.add_argument("--items", type=int, default=5, help="Per invoice")
+        parser.add_argument(
+            "--requests", type=int, default=30, help="Timed requests per route"
+        )
+        parser.add_argument(
+            "--cold",
+            action="store_true",
+            help="Clear the fragment and PDF caches before every request",
+        )
+        parser.add_argument("--output", help="Also write the results to this file")
+        parser.add_argument("--baseline", help="Results file to compare against")
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=10.0,
+            help="Percent slowdown reported as a regression",
+        )
+        parser.add_argument(
+            "--fail-on-regression",
+            action="store_true",
+            help="Exit with an error if anything regressed",
+        )
+
+    def handle(self, *args, **options):
+        if options["requests"] < 2:
+            raise CommandError("--requests must be at least 2")
+        if options["users"] < 1 or options["clients"] < 1 or options["invoices"] < 1:
+            raise CommandError("The dataset needs at least one invoice per user")
+        baseline = None
+        if options["baseline"]:
+            with open(options["baseline"]) as f:
+                baseline = json.load(f)
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with tempfile.TemporaryDirectory() as cache_dir, override_settings(
+                PDF_CACHE_DIR=cache_dir,
+                PDF_EXPORT_PROCESSES=0,
+                CACHES={
+                    "default": {
+                        "BACKEND": "django.core.cache.backends.locmem.LocMemCache"
+                    }
+                },
+            ):
+                users = seed(
+                    options["users"],
+                    options["clients"],
+                    options["invoices"],
+                    options["items"],
+                )
+                results = {
+                    "dataset": {
+                        key: options[key]
+                        for key in ("users", "clients", "invoices", "items")
+                    },
+                    "cold": options["cold"],
+                    "routes": run_benchmark(
+                        users[0], options["requests"], options["cold"]
+                    ),
+                }
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        regressions = []
+        if baseline is not None:
+            if any(baseline.get(key) != results[key] for key in ("dataset", "cold")):
+                self.stderr.write("The baseline was measured with other options")
+            diff = compare(results["routes"], baseline["routes"], options["threshold"])
+            results["baseline"] = diff
+            regressions = [
+                f"{route} {metric}"
+                for route, changes in diff.items()
+                for metric, change in changes.items()
+                if change["regression"]
+            ]
+            results["regressions"] = regressions
+
+        output = json.dumps(results, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output + "\n")
+        self.stdout.write(output)
+
+        if regressions and options["fail_on_regression"]:
+            raise CommandError("Regressed: " + ", ".join(regressions))
@@ -0,0 +1,191 @@
+import datetime
+import json
+import os
+import resource
+import statistics
+import sys
+import time
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from invoices.models import Client, Invoice, InvoiceItem
+from invoices.pdf import InvoiceRenderer, create_render_pool, get_renderer
+
+DEFAULT_SIZES = [1, 10, 100, 1000, 5000]
+
+
+def sample_invoice(item_count):
+    """Build an unsaved invoice with `item_count` line items"""
+    user = get_user_model()(
+        first_name="Jane",
+        last_name="Doe",
+        address1="1234 Paradise Lane",
+        address2="Good Street",
+        country="Zimbabwe",
+        phone_number="+263771811111",
+    )
+    client = Client(
+        first_name="Test",
+        last_name="Client",
+        company="Xcorp",
+        address1="1 Main Road",
+        address2="Suite 2",
+        country="Zimbabwe",
+    )
+    invoice = Invoice(
+        pk=1,
+        number=1,
+        title="Benchmark invoice",
+        user=user,
+        client=client,
+        create_date=datetime.date.today(),
+    )
+    invoice_items = [
+        InvoiceItem(
+            invoice=invoice,
+            item=f"Consulting, line {n}",
+            quantity=n % 8 + 1,
+            rate=Decimal("42.50"),
+        )
+        for n in range(item_count)
+    ]
+    invoice.invoice_total = sum(item.subtotal() for item in invoice_items)
+    return invoice, invoice_items
+
+
+def time_renders(runs, render):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        render()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def peak_rss_kb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+_samples = {}
+
+
+def render_sample(item_count, cold=False):
+    """Render a sample invoice once in a pool worker
+
+    Returns the render time in milliseconds and the worker's peak RSS. The
+    sample is built once per worker so only rendering is measured.
+    """
+    if item_count not in _samples:
+        _samples[item_count] = sample_invoice(item_count)
+    invoice, invoice_items = _samples[item_count]
+    renderer = InvoiceRenderer() if cold else get_renderer()
+    (timing,) = time_renders(1, lambda: renderer.render(invoice, invoice_items))
+    return timing, peak_rss_kb()
+
+
+def run_pool(item_count, processes, runs, cold=False):
+    """Render `runs` invoices of `item_count` items across fresh processes
+
+    Each size gets its own pool so peak RSS reflects that size alone.
+    """
+    with create_render_pool(processes) as pool:
+        # Start every worker (and its warm-up) before the clock does
+        list(pool.map(render_sample, [1] * processes))
+        start = time.perf_counter()
+        results = list(pool.map(render_sample, [item_count] * runs, [cold] * runs))
+        elapsed = time.perf_counter() - start
+
+    timings = [timing for timing, _ in results]
+    renders_per_sec = runs / elapsed
+    return {
+        "items": item_count,
+        "processes": processes,
+        "renderer": "cold" if cold else "warm",
+        "runs": runs,
+        "renders_per_sec": round(renders_per_sec, 2),
+        "renders_per_sec_per_core": round(renders_per_sec / processes, 2),
+        "median_ms": round(statistics.median(timings), 1),
+        "max_ms": round(max(timings), 1),
+        "peak_rss_kb": max(rss for _, rss in results),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure invoice PDF render latency, throughput and peak memory "
+        "across invoice sizes, serially and in parallel, and compare warm "
+        "renderers with cold ones"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--items",
+            type=int,
+            nargs="+",
+            default=DEFAULT_SIZES,
+            help="Line item counts to render",
+        )
+        parser.add_argument("--runs", type=int, default=10, help="Renders per size")
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=os.cpu_count() or 1,
+            help="Processes for the parallel pass, 1 skips it",
+        )
+        parser.add_argument(
+            "--no-cold",
+            action="store_false",
+            dest="cold",
+            help="Skip the serial cold renders, which set up a new renderer "
+            "for every render as before renderers were reused",
+        )
+        parser.add_argument("--json", action="store_true", help="Output JSON")
+
+    def handle(self, *args, **options):
+        if options["runs"] < 1 or options["processes"] < 1:
+            raise CommandError("--runs and --processes must be at least 1")
+        if min(options["items"]) < 0:
+            raise CommandError("--items can't be negative")
+
+        pools = [1]
+        if options["processes"] > 1:
+            pools.append(options["processes"])
+        results = []
+        for item_count in options["items"]:
+            for processes in pools:
+                runs = max(options["runs"], processes)
+                results.append(run_pool(item_count, processes, runs))
+                if processes == 1 and options["cold"]:
+                    # Cold renders are compared serially, where latency isn't
+                    # skewed by workers competing for cores
+                    warm = results[-1]
+                    cold = run_pool(item_count, processes, runs, cold=True)
+                    warm["cold_speedup"] = round(
+                        cold["median_ms"] / warm["median_ms"], 2
+                    )
+                    results.append(cold)
+                    if not options["json"]:
+                        self.write_row(cold)
+                        self.write_row(warm)
+                elif not options["json"]:
+                    self.write_row(results[-1])
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+
+    def write_row(self, result):
+        line = (
+            f"{result['items']:>6} items, {result['processes']:>2} processes, "
+            f"{result['renderer']}: "
+            f"{result['renders_per_sec']:.2f} renders/s "
+            f"({result['renders_per_sec_per_core']:.2f} per core), "
+            f"median {result['median_ms']:.1f} ms, max {result['max_ms']:.1f} ms, "
+            f"peak RSS {result['peak_rss_kb'] / 1024:.1f} MiB"
+        )
+        if "cold_speedup" in result:
+            line += f", {result['cold_speedup']:.2f}x faster than cold (median)"
+        self.stdout.write(line)
@@ -0,0 +1,96 @@
+import json
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (
+    override_settings,
+    setup_test_environment,
+    teardown_test_environment,
+)
+
+from invoices import search
+from invoices.management.commands.benchmark import seed
+
+# Every seeded invoice is titled "Invoice <n>" and every client works for
+# "Benchmark Ltd", so the first two queries match across all tenants
+QUERIES = ["invoice", "bench", "invoice 1", "client 00001"]
+LOCMEM_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+}
+
+
+def time_searches(user, query, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        hits = search.search(user, query)
+        timings.append((time.perf_counter() - start) * 1000)
+    cut_points = statistics.quantiles(timings, n=100, method="inclusive")
+    return {
+        "hits": len(hits),
+        "p50_ms": round(cut_points[49], 2),
+        "p95_ms": round(cut_points[94], 2),
+        "max_ms": round(max(timings), 2),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure full-text search latency for one user among many tenants "
+        "sharing the same words, in a throwaway test database"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=100)
+        parser.add_argument("--clients", type=int, default=20, help="Per user")
+        parser.add_argument("--invoices", type=int, default=50, help="Per client")
+        parser.add_argument("--runs", type=int, default=50, help="Searches per query")
+        parser.add_argument("--json", action="store_true", help="Output JSON")
+
+    def handle(self, *args, **options):
+        if options["runs"] < 2:
+            raise CommandError("--runs must be at least 2")
+        if options["users"] < 1 or options["clients"] < 1 or options["invoices"] < 1:
+            raise CommandError("The dataset needs at least one invoice per user")
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            # Users' signals bump fragment versions, keep them off the real cache
+            with override_settings(CACHES=LOCMEM_CACHES):
+                users = seed(
+                    options["users"], options["clients"], options["invoices"], items=0
+                )
+            start = time.perf_counter()
+            search.rebuild()
+            indexed_s = time.perf_counter() - start
+            # A user in the middle, whose documents are neither first nor last
+            user = users[len(users) // 2]
+            per_user = options["clients"] * (options["invoices"] + 1)
+            results = {
+                "documents": options["users"] * per_user,
+                "index_seconds": round(indexed_s, 1),
+                "queries": {
+                    query: time_searches(user, query, options["runs"])
+                    for query in QUERIES
+                },
+            }
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(
+            f"{results['documents']} documents across {options['users']} users, "
+            f"indexed in {results['index_seconds']:.1f} s"
+        )
+        for query, metrics in results["queries"].items():
+            self.stdout.write(
+                f"{query!r:>16}: {metrics['hits']:>3} hits, "
+                f"p50 {metrics['p50_ms']:.2f} ms, p95 {metrics['p95_ms']:.2f} ms, "
+                f"max {metrics['max_ms']:.2f} ms"
+            )
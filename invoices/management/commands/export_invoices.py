@@ -0,0 +1,60 @@
+import sys
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from invoices import tabular
+from invoices.models import Invoice
+
+
+class Command(BaseCommand):
+    help = "Export invoices and their line items as one flat CSV or XLSX file"
+
+    def add_arguments(self, parser):
+        parser.add_argument("output", help="File to write, - writes to stdout")
+        parser.add_argument(
+            "--format",
+            choices=sorted(tabular.FORMATS),
+            help="Output format, guessed from the file extension if omitted",
+        )
+        parser.add_argument("--user", help="Only export this user's invoices")
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=tabular.CHUNK_SIZE,
+            help="Rows fetched from the database at a time",
+        )
+
+    def handle(self, *args, **options):
+        output_format = options["format"]
+        if output_format is None:
+            output_format = "xlsx" if options["output"].endswith(".xlsx") else "csv"
+
+        invoices = Invoice.objects.all()
+        if options["user"]:
+            try:
+                user = get_user_model().objects.get(username=options["user"])
+            except get_user_model().DoesNotExist:
+                raise CommandError(f"No user named {options['user']!r}")
+            invoices = invoices.filter(user=user)
+
+        stream = tabular.FORMATS[output_format][0]
+        rows = tabular.export_rows(invoices, chunk_size=options["chunk_size"])
+        start = time.perf_counter()
+        if options["output"] == "-":
+            written = self.write(stream(rows), sys.stdout.buffer)
+        else:
+            with open(options["output"], "wb") as output:
+                written = self.write(stream(rows), output)
+            elapsed = time.perf_counter() - start
+            self.stdout.write(
+                f"Wrote {written} bytes to {options['output']} in {elapsed:.1f}s"
+            )
+
+    def write(self, chunks, output):
+        written = 0
+        for chunk in chunks:
+            output.write(chunk)
+            written += len(chunk)
+        return written
@@ -0,0 +1,185 @@
+import csv
+import datetime
+import itertools
+import json
+import sys
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from invoices import fragments, rollups, search
+from invoices.bulk import bulk_create_invoices
+from invoices.models import Client, Invoice, InvoiceItem
+
+CLIENT_FIELDS = (
+    "first_name",
+    "last_name",
+    "email",
+    "company",
+    "address1",
+    "address2",
+    "country",
+    "phone_number",
+)
+
+
+def read_csv(lines):
+    """Group CSV rows, one per line item, into invoices by `invoice_ref`
+
+    Rows of the same invoice must be next to each other.
+    """
+    rows = csv.DictReader(lines)
+    for _, group in itertools.groupby(rows, key=lambda row: row["invoice_ref"]):
+        group = list(group)
+        first = group[0]
+        yield {
+            "title": first["title"],
+            "create_date": first.get("create_date"),
+            "invoice_terms": first.get("invoice_terms"),
+            "client": {
+                field: first.get(f"client_{field}", "") for field in CLIENT_FIELDS
+            },
+            "items": [
+                {
+                    "item": row["item"],
+                    "quantity": row["quantity"],
+                    "rate": row["rate"],
+                    "tax": row.get("tax"),
+                }
+                for row in group
+            ],
+        }
+
+
+def read_jsonl(lines):
+    """One invoice per line, with nested `client` and `items`"""
+    for line in lines:
+        if line.strip():
+            yield json.loads(line)
+
+
+class ClientIndex:
+    """Maps client emails to ids for one user, creating missing clients"""
+
+    def __init__(self, user):
+        self.user = user
+        self.ids = {}
+        clients = Client.objects.filter(created_by=user).values_list("email", "pk")
+        for email, pk in clients.iterator():
+            self.ids.setdefault(email.lower(), pk)
+
+    def resolve(self, invoices):
+        """Set client_id on each (invoice, client data) pair
+
+        Unknown clients are inserted together, one INSERT per batch. Returns
+        the ids of the inserted clients.
+        """
+        new_clients = {}
+        for _, data in invoices:
+            key = data["email"].lower()
+            if key not in self.ids and key not in new_clients:
+                new_clients[key] = Client(created_by=self.user, **data)
+        for key, client in zip(
+            new_clients, Client.objects.bulk_create(new_clients.values())
+        ):
+            self.ids[key] = client.pk
+        for invoice, data in invoices:
+            invoice.client_id = self.ids[data["email"].lower()]
+        return [self.ids[key] for key in new_clients]
+
+
+class Command(BaseCommand):
+    help = "Import invoices from a CSV or JSON lines file in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="File to import, - reads stdin")
+        parser.add_argument(
+            "--user", required=True, help="Username the invoices belong to"
+        )
+        parser.add_argument(
+            "--format",
+            choices=["csv", "jsonl"],
+            help="Input format, guessed from the file extension if omitted",
+        )
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(username=options["user"])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f"No user named {options['user']!r}")
+
+        input_format = options["format"]
+        if input_format is None:
+            input_format = "jsonl" if options["path"].endswith(".jsonl") else "csv"
+        reader = read_jsonl if input_format == "jsonl" else read_csv
+
+        if options["path"] == "-":
+            self.import_invoices(reader(sys.stdin), user, options["batch_size"])
+        else:
+            with open(options["path"], newline="", encoding="utf-8") as lines:
+                self.import_invoices(reader(lines), user, options["batch_size"])
+
+    def import_invoices(self, records, user, batch_size):
+        start = time.perf_counter()
+        clients = ClientIndex(user)
+        invoice_count = item_count = 0
+        client_ids = set()
+        records = enumerate(records, start=1)
+        while True:
+            batch = [
+                self.build_invoice(number, record, user)
+                for number, record in itertools.islice(records, batch_size)
+            ]
+            if not batch:
+                break
+            with transaction.atomic():
+                new_client_ids = clients.resolve(
+                    [(invoice, data) for invoice, data, _ in batch]
+                )
+                saved = bulk_create_invoices(
+                    [(invoice, items) for invoice, _, items in batch], batch_size
+                )
+                # Bulk inserts skip the signals that index new rows
+                search.index_clients(new_client_ids, invoices=False)
+                search.index_invoices([invoice.pk for invoice in saved])
+            client_ids.update(invoice.client_id for invoice, _, _ in batch)
+            invoice_count += len(batch)
+            item_count += sum(len(items) for _, _, items in batch)
+            self.stdout.write(f"Imported {invoice_count} invoices", ending="\r")
+
+        # Bulk inserts skip the signals that keep the rollups and the cached
+        # invoice tables current
+        rollups.refresh(client_ids, [user.pk])
+        fragments.bump(user.pk)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f"Imported {invoice_count} invoices with {item_count} line items "
+            f"in {elapsed:.1f}s"
+        )
+
+    def build_invoice(self, number, record, user):
+        try:
+            invoice = Invoice(user=user, title=record["title"])
+            if record.get("create_date"):
+                invoice.create_date = datetime.date.fromisoformat(record["create_date"])
+            if record.get("invoice_terms"):
+                invoice.invoice_terms = record["invoice_terms"]
+            client = {
+                field: record["client"].get(field) or "" for field in CLIENT_FIELDS
+            }
+            items = [
+                InvoiceItem(
+                    item=item["item"],
+                    quantity=int(item["quantity"]),
+                    rate=Decimal(str(item["rate"])),
+                    tax=Decimal(str(item.get("tax") or 0)),
+                )
+                for item in record["items"]
+            ]
+        except (KeyError, TypeError, ValueError, InvalidOperation) as exc:
+            raise CommandError(f"Invoice {number}: invalid record ({exc!r})")
+        return invoice, client, items
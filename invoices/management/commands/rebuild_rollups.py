@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from invoices import rollups
+from invoices.models import RevenueRollup
+
+
+class Command(BaseCommand):
+    help = "Recompute the per-client and per-user revenue rollups from scratch"
+
+    def handle(self, *args, **options):
+        rollups.rebuild()
+        self.stdout.write(f"Rebuilt {RevenueRollup.objects.count()} rollup rows")
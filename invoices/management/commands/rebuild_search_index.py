@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from invoices import search
+
+
+class Command(BaseCommand):
+    help = "Reindex every invoice and client for full-text search"
+
+    def handle(self, *args, **options):
+        search.rebuild()
+        self.stdout.write("Rebuilt the search index")
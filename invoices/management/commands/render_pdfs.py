@@ -0,0 +1,99 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from invoices.jobs import claim_jobs, release_jobs, requeue_stale_jobs, run_job
+from invoices.pdf import create_render_pool
+
+
+class Command(BaseCommand):
+    help = "Render queued invoice PDFs in a pool of worker processes"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=settings.PDF_RENDER_PROCESSES,
+            help="Number of render processes",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=1.0,
+            help="Seconds to wait between checks for new jobs",
+        )
+        parser.add_argument(
+            "--stale-after",
+            type=int,
+            default=600,
+            help="Requeue running jobs that started more than this many seconds ago",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once the queue is empty instead of polling forever",
+        )
+
+    def requeue_stale(self, stale_after):
+        stale = timezone.now() - timedelta(seconds=stale_after)
+        requeued = requeue_stale_jobs(stale)
+        if requeued:
+            self.stdout.write(f"Requeued {requeued} stale job(s)")
+
+    def report(self, done, in_flight):
+        for future in done:
+            job_id = in_flight[future]
+            try:
+                status = future.result()
+            except BrokenProcessPool:
+                raise
+            except Exception as exc:
+                self.stderr.write(f"Job {job_id} crashed: {exc!r}")
+            else:
+                self.stdout.write(f"Job {job_id}: {status}")
+            del in_flight[future]
+
+    def handle(self, *args, **options):
+        processes = options["processes"]
+        in_flight = {}
+        pool = create_render_pool(processes)
+        try:
+            while True:
+                # Every pass, as another worker may die at any time
+                self.requeue_stale(options["stale_after"])
+                claimed = []
+                try:
+                    # Keep every process busy plus one job queued behind each
+                    free = 2 * processes - len(in_flight)
+                    if free > 0:
+                        claimed = claim_jobs(free)
+                        for job_id in claimed:
+                            in_flight[pool.submit(run_job, job_id)] = job_id
+
+                    if not in_flight:
+                        if options["once"]:
+                            break
+                        time.sleep(options["poll_interval"])
+                        continue
+
+                    done, _ = wait(
+                        in_flight,
+                        timeout=options["poll_interval"],
+                        return_when=FIRST_COMPLETED,
+                    )
+                    self.report(done, in_flight)
+                except BrokenProcessPool:
+                    # A render process died, e.g. killed for running out of
+                    # memory, and every job in the pool went with it
+                    released = release_jobs([*in_flight.values(), *claimed])
+                    self.stderr.write(f"Render pool broke, requeued {released} job(s)")
+                    in_flight.clear()
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    pool = create_render_pool(processes)
+        finally:
+            pool.shutdown()
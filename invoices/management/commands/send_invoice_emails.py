@@ -0,0 +1,81 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from invoices.outbox import ConnectionPool, requeue_stale_emails, send_due_emails
+
+
+def rate(count, seconds):
+    return count / seconds if seconds else 0.0
+
+
+class Command(BaseCommand):
+    help = "Send queued invoice emails over a pool of SMTP connections"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--connections",
+            type=int,
+            default=settings.EMAIL_OUTBOX_CONNECTIONS,
+            help="Number of connections to the mail server, sending in parallel",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=settings.EMAIL_OUTBOX_BATCH_SIZE,
+            help="Emails claimed from the outbox at a time",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=1.0,
+            help="Seconds to wait between checks for new emails",
+        )
+        parser.add_argument(
+            "--stale-after",
+            type=int,
+            default=600,
+            help="Requeue emails claimed more than this many seconds ago",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once no email is due instead of polling forever",
+        )
+
+    def requeue_stale(self, stale_after):
+        stale = timezone.now() - timedelta(seconds=stale_after)
+        requeued = requeue_stale_emails(stale)
+        if requeued:
+            self.stdout.write(f"Requeued {requeued} stale email(s)")
+
+    def handle(self, *args, **options):
+        sent = failed = 0
+        started = time.monotonic()
+        with ConnectionPool(options["connections"]) as pool:
+            while True:
+                # Every pass, as a peer sender may die at any time
+                self.requeue_stale(options["stale_after"])
+                batch_started = time.monotonic()
+                batch_sent, batch_failed = send_due_emails(pool, options["batch_size"])
+                if not batch_sent and not batch_failed:
+                    if options["once"]:
+                        break
+                    time.sleep(options["poll_interval"])
+                    continue
+                sent += batch_sent
+                failed += batch_failed
+                per_second = rate(batch_sent, time.monotonic() - batch_started)
+                self.stdout.write(
+                    f"Sent {batch_sent} email(s), {batch_failed} failed "
+                    f"({per_second:.1f} msgs/sec)"
+                )
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f"Sent {sent} email(s) in total, {failed} failed, in {elapsed:.2f}s "
+            f"({rate(sent, elapsed):.1f} msgs/sec)"
+        )
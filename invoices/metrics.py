@@ -0,0 +1,226 @@
+"""
+Per-request timing of SQL, template rendering and PDF layout.
+
+MetricsMiddleware reports where each request spent its time in a
+Server-Timing header, which browsers show in their network panel, and in
+Prometheus histograms labelled with the URL name, served at /metrics.
+
+Under gunicorn each worker has its own samples. With PROMETHEUS_MULTIPROC_DIR
+set (gunicorn.conf.py sets it) prometheus_client keeps them in files in that
+directory and /metrics adds up every worker's.
+"""
+
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import HttpResponse
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, float("inf"))
+
+REQUESTS = Counter(
+    "invoices_requests", "Requests handled", ["view", "method", "status"]
+)
+REQUEST_DURATION = Histogram(
+    "invoices_request_duration_seconds",
+    "Time taken to produce a response",
+    ["view", "method"],
+)
+DB_QUERIES = Histogram(
+    "invoices_request_db_queries",
+    "SQL queries run per request",
+    ["view"],
+    buckets=QUERY_COUNT_BUCKETS,
+)
+DB_DURATION = Histogram(
+    "invoices_request_db_duration_seconds", "Time spent in SQL per request", ["view"]
+)
+TEMPLATE_DURATION = Histogram(
+    "invoices_request_template_duration_seconds",
+    "Time spent rendering the response template, including the queries it runs",
+    ["view"],
+)
+PDF_DURATION = Histogram(
+    "invoices_pdf_duration_seconds",
+    "Time spent laying out and writing invoice PDFs",
+    ["phase"],
+)
+
+# Server-Timing entries, in the order they're reported
+TIMING_NAMES = {
+    "db": "SQL",
+    "template": "Templates",
+    "pdf-layout": "PDF layout",
+    "pdf-write": "PDF write",
+}
+
+_current = ContextVar("invoices_request_timings", default=None)
+
+
+class RequestTimings:
+    """Time spent per activity in one request"""
+
+    def __init__(self):
+        self.durations = {}
+        self.counts = {}
+
+    def add(self, name, seconds, count=1):
+        self.durations[name] = self.durations.get(name, 0) + seconds
+        self.counts[name] = self.counts.get(name, 0) + count
+
+    def merge(self, other):
+        for name, seconds in other.durations.items():
+            self.add(name, seconds, other.counts[name])
+
+    def header(self, total):
+        entries = []
+        for name, description in TIMING_NAMES.items():
+            if name not in self.durations:
+                continue
+            if name == "db":
+                description = f"{description} ({self.counts[name]} queries)"
+            duration = self.durations[name] * 1000
+            entries.append(f'{name};dur={duration:.1f};desc="{description}"')
+        entries.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(entries)
+
+
+@contextmanager
+def timed(name, histogram=None, **labels):
+    """Add the time spent in the block to the current request's `name`
+
+    The time is also observed in `histogram` if given, whether or not there
+    is a request, so renders in worker processes are counted too.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        timings = _current.get()
+        if timings is not None:
+            timings.add(name, elapsed)
+        if histogram is not None:
+            histogram.labels(**labels).observe(elapsed)
+
+
+def call_timed(func, *args, **kwargs):
+    """Call `func` and return its result with the time spent in timed() blocks
+
+    For work handed to an executor, which can't see the request's timings.
+    Pass the timings to add_timings() back in the request.
+    """
+    timings = RequestTimings()
+    token = _current.set(timings)
+    try:
+        return func(*args, **kwargs), timings
+    finally:
+        _current.reset(token)
+
+
+def add_timings(timings):
+    current = _current.get()
+    if current is not None:
+        current.merge(timings)
+
+
+def _time_query(execute, sql, params, many, context):
+    with timed("db"):
+        return execute(sql, params, many, context)
+
+
+@receiver(connection_created)
+def time_queries(sender, connection, **kwargs):
+    # Installed once per connection rather than per request, so queries the
+    # async ORM runs in its worker thread are timed as well
+    if _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _time_query)
+
+
+class MetricsMiddleware:
+    """Times SQL and template rendering for every request
+
+    Goes first in MIDDLEWARE so the total covers the other middleware. The
+    body of a streaming response is produced after this returns and isn't
+    included.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings = RequestTimings()
+        token = _current.set(timings)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timings, start)
+
+    async def __acall__(self, request):
+        timings = RequestTimings()
+        token = _current.set(timings)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timings, start)
+
+    def finish(self, request, response, timings, start):
+        total = time.perf_counter() - start
+        self.observe(request, response, timings, total)
+        response["Server-Timing"] = timings.header(total)
+        return response
+
+    def process_template_response(self, request, response):
+        start = time.perf_counter()
+
+        def rendered(response):
+            timings = _current.get()
+            if timings is not None:
+                timings.add("template", time.perf_counter() - start)
+
+        response.add_post_render_callback(rendered)
+        return response
+
+    def observe(self, request, response, timings, total):
+        match = request.resolver_match
+        view = match.url_name if match and match.url_name else "unresolved"
+        REQUESTS.labels(view, request.method, response.status_code).inc()
+        REQUEST_DURATION.labels(view, request.method).observe(total)
+        DB_QUERIES.labels(view).observe(timings.counts.get("db", 0))
+        DB_DURATION.labels(view).observe(timings.durations.get("db", 0))
+        if "template" in timings.durations:
+            TEMPLATE_DURATION.labels(view).observe(timings.durations["template"])
+
+
+def metrics_view(request):
+    """Prometheus metrics of every worker process"""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
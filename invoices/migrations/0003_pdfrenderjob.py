@@ -0,0 +1,73 @@
+# Generated by Django 4.2.30 on 2026-10-18 20:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("invoices", "0002_initial"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="invoice",
+            name="invoice_terms",
+            field=models.TextField(
+                blank=True,
+                default="NET 30 Days. Finance Charge of 1.5% will be         made on unpaid balances after 30 days.",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="invoice",
+            name="invoice_total",
+            field=models.DecimalField(
+                blank=True, decimal_places=2, default=0, editable=False, max_digits=6
+            ),
+        ),
+        migrations.CreateModel(
+            name="PdfRenderJob",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "Pending"),
+                            ("running", "Running"),
+                            ("done", "Done"),
+                            ("failed", "Failed"),
+                        ],
+                        db_index=True,
+                        default="pending",
+                        max_length=10,
+                    ),
+                ),
+                ("error", models.TextField(blank=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("started_at", models.DateTimeField(blank=True, null=True)),
+                ("finished_at", models.DateTimeField(blank=True, null=True)),
+                (
+                    "invoice",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="pdf_jobs",
+                        to="invoices.invoice",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["created_at"],
+            },
+        ),
+    ]
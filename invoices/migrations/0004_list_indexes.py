@@ -0,0 +1,31 @@
+# Generated by Django 4.2.30 on 2026-10-18 20:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("invoices", "0003_pdfrenderjob"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="client",
+            index=models.Index(
+                fields=["created_by", "last_name"], name="client_owner_name_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="invoice",
+            index=models.Index(
+                fields=["user", "-create_date"], name="invoice_user_date_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="invoice",
+            index=models.Index(
+                fields=["client", "-create_date"], name="invoice_client_date_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 4.2.30 on 2026-10-18 20:20
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("invoices", "0004_list_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RevenueRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("month", models.DateField(blank=True, null=True)),
+                ("invoice_count", models.PositiveIntegerField(default=0)),
+                (
+                    "revenue",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=14),
+                ),
+                ("first_invoice_date", models.DateField(blank=True, null=True)),
+                ("last_invoice_date", models.DateField(blank=True, null=True)),
+                (
+                    "client",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="revenue_rollups",
+                        to="invoices.client",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="revenue_rollups",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["user", "client", "month"], name="rollup_scope_idx"
+                    ),
+                    models.Index(fields=["client", "month"], name="rollup_client_idx"),
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,101 @@
+from django.db import NotSupportedError, migrations
+
+# The index as first created, see invoices/search.py for how it's used. The
+# SQL is spelled out here so later changes to search.py or the models can't
+# change what this migration does.
+
+
+def _tables(apps, schema_editor):
+    quote = schema_editor.quote_name
+    return {
+        "search": quote("invoices_search"),
+        "invoice": quote(apps.get_model("invoices", "Invoice")._meta.db_table),
+        "client": quote(apps.get_model("invoices", "Client")._meta.db_table),
+        "item": quote(apps.get_model("invoices", "InvoiceItem")._meta.db_table),
+    }
+
+
+def create_sqlite_index(schema_editor, t):
+    schema_editor.execute(
+        f"CREATE VIRTUAL TABLE {t['search']} USING fts5("
+        "user_id UNINDEXED, title, client, items, "
+        "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+    )
+    # Titles count most, then client details, then line items
+    schema_editor.execute(
+        f"INSERT INTO {t['search']} ({t['search']}, rank) "
+        "VALUES ('rank', 'bm25(0, 10.0, 5.0, 1.0)')"
+    )
+    # Rowids encode the kind of document, invoices even and clients odd
+    schema_editor.execute(
+        f"INSERT INTO {t['search']} (rowid, user_id, title, client, items) "
+        "SELECT i.id * 2, i.user_id, i.title, "
+        "c.first_name || ' ' || c.last_name || ' ' || c.company || ' ' "
+        "|| c.email, "
+        f"COALESCE((SELECT group_concat(item, ' ') FROM {t['item']} "
+        "WHERE invoice_id = i.id), '') "
+        f"FROM {t['invoice']} i JOIN {t['client']} c ON c.id = i.client_id"
+    )
+    schema_editor.execute(
+        f"INSERT INTO {t['search']} (rowid, user_id, title, client, items) "
+        "SELECT c.id * 2 + 1, c.created_by_id, "
+        "c.first_name || ' ' || c.last_name, c.company || ' ' || c.email, '' "
+        f"FROM {t['client']} c"
+    )
+
+
+def create_postgres_index(schema_editor, t):
+    schema_editor.execute(
+        f"CREATE TABLE {t['search']} ("
+        "kind varchar(10) NOT NULL, object_id bigint NOT NULL, "
+        "user_id bigint NOT NULL, document tsvector NOT NULL, "
+        "PRIMARY KEY (kind, object_id))"
+    )
+    schema_editor.execute(
+        f"CREATE INDEX invoices_search_document_idx ON {t['search']} "
+        "USING GIN (document)"
+    )
+    schema_editor.execute(
+        f"INSERT INTO {t['search']} (kind, object_id, user_id, document) "
+        "SELECT 'invoice', i.id, i.user_id, "
+        "setweight(to_tsvector('simple', i.title), 'A') || "
+        "setweight(to_tsvector('simple', concat_ws(' ', c.first_name, "
+        "c.last_name, c.company, c.email)), 'B') || "
+        "setweight(to_tsvector('simple', COALESCE((SELECT string_agg(item, ' ') "
+        f"FROM {t['item']} WHERE invoice_id = i.id), '')), 'C') "
+        f"FROM {t['invoice']} i JOIN {t['client']} c ON c.id = i.client_id"
+    )
+    schema_editor.execute(
+        f"INSERT INTO {t['search']} (kind, object_id, user_id, document) "
+        "SELECT 'client', c.id, c.created_by_id, "
+        "setweight(to_tsvector('simple', concat_ws(' ', c.first_name, "
+        "c.last_name)), 'A') || "
+        "setweight(to_tsvector('simple', concat_ws(' ', c.company, c.email)), "
+        f"'B') FROM {t['client']} c"
+    )
+
+
+CREATE = {"sqlite": create_sqlite_index, "postgresql": create_postgres_index}
+
+
+def create_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor not in CREATE:
+        raise NotSupportedError(f"No search index for {vendor}")
+    CREATE[vendor](schema_editor, _tables(apps, schema_editor))
+
+
+def drop_index(apps, schema_editor):
+    search = _tables(apps, schema_editor)["search"]
+    schema_editor.execute(f"DROP TABLE IF EXISTS {search}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("invoices", "0005_revenuerollup"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
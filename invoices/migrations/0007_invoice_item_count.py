@@ -0,0 +1,37 @@
+# Generated by Django 4.2.30 on 2026-10-18 20:46
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def count_items(apps, schema_editor):
+    Invoice = apps.get_model("invoices", "Invoice")
+    InvoiceItem = apps.get_model("invoices", "InvoiceItem")
+    items_count = (
+        InvoiceItem.objects.filter(invoice=OuterRef("pk"))
+        .values("invoice")
+        .annotate(count=Count("pk"))
+        .values("count")
+    )
+    Invoice.objects.update(item_count=Coalesce(Subquery(items_count), Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("invoices", "0006_search_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="invoice",
+            name="item_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name="invoiceitem",
+            index=models.Index(fields=["invoice", "id"], name="invoiceitem_page_idx"),
+        ),
+        migrations.RunPython(count_items, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 4.2.30 on 2026-10-18 20:59
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("invoices", "0008_invoice_updated_at"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ArchivedInvoice",
+            fields=[
+                ("id", models.BigIntegerField(primary_key=True, serialize=False)),
+                ("title", models.CharField(max_length=200)),
+                ("invoice_total", models.DecimalField(decimal_places=2, max_digits=6)),
+                ("create_date", models.DateField()),
+                ("archived_at", models.DateTimeField(auto_now_add=True)),
+                ("data", models.BinaryField()),
+                (
+                    "client",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="archived_invoices",
+                        to="invoices.client",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="archived_invoices",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["user", "-create_date"], name="archive_user_date_idx"
+                    ),
+                    models.Index(
+                        fields=["client", "-create_date"],
+                        name="archive_client_date_idx",
+                    ),
+                ],
+            },
+        ),
+    ]
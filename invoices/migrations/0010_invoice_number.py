@@ -0,0 +1,75 @@
+# Generated by Django 4.2.30 on 2026-10-18 21:20
+
+from collections import Counter
+from itertools import chain
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def number_invoices(apps, schema_editor):
+    Invoice = apps.get_model("invoices", "Invoice")
+    ArchivedInvoice = apps.get_model("invoices", "ArchivedInvoice")
+    InvoiceSequence = apps.get_model("invoices", "InvoiceSequence")
+    fields = ("user_id", "create_date", "pk")
+    # Each user's invoices, archived ones included, numbered by date
+    rows = sorted(
+        chain(
+            ((*row, Invoice) for row in Invoice.objects.values_list(*fields)),
+            (
+                (*row, ArchivedInvoice)
+                for row in ArchivedInvoice.objects.values_list(*fields)
+            ),
+        ),
+        key=lambda row: row[:3],
+    )
+    counts = Counter()
+    numbered = {Invoice: [], ArchivedInvoice: []}
+    for user_id, _, pk, model in rows:
+        counts[user_id] += 1
+        numbered[model].append(model(pk=pk, number=counts[user_id]))
+    for model, invoices in numbered.items():
+        model.objects.bulk_update(invoices, ["number"], batch_size=1000)
+    InvoiceSequence.objects.bulk_create(
+        InvoiceSequence(user_id=user_id, next_number=count + 1)
+        for user_id, count in counts.items()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("invoices", "0009_archivedinvoice"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="invoice",
+            name="number",
+            field=models.PositiveIntegerField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="archivedinvoice",
+            name="number",
+            field=models.PositiveIntegerField(null=True),
+        ),
+        migrations.CreateModel(
+            name="InvoiceSequence",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="invoice_sequence",
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                ("next_number", models.PositiveIntegerField(default=1)),
+            ],
+        ),
+        migrations.RunPython(number_invoices, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-18 21:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("invoices", "0010_invoice_number"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="invoice",
+            name="number",
+            field=models.PositiveIntegerField(editable=False),
+        ),
+        migrations.AlterField(
+            model_name="archivedinvoice",
+            name="number",
+            field=models.PositiveIntegerField(),
+        ),
+        migrations.AddConstraint(
+            model_name="invoice",
+            constraint=models.UniqueConstraint(
+                fields=("user", "number"), name="invoice_user_number_uniq"
+            ),
+        ),
+    ]
@@ -0,0 +1,117 @@
+import importlib
+import re
+
+from django.db import NotSupportedError, migrations
+
+# Puts the user into the search index, see invoices/search.py. On SQLite the
+# index is rebuilt with every word prefixed by its owner, on PostgreSQL the GIN
+# index covers the user id as well as the document.
+
+WORD = re.compile(r"[^\W_]+")
+BATCH_SIZE = 500
+
+initial = importlib.import_module("invoices.migrations.0006_search_index")
+
+
+def tag_words(user_id, text):
+    return " ".join(f"u{user_id}x{word}" for word in WORD.findall(text))
+
+
+def _copy_documents(schema_editor, search, sql):
+    connection = schema_editor.connection
+    with connection.cursor() as rows, connection.cursor() as cursor:
+        rows.execute(sql)
+        while batch := rows.fetchmany(BATCH_SIZE):
+            cursor.executemany(
+                f"INSERT INTO {search} (rowid, title, client, items) "
+                "VALUES (%s, %s, %s, %s)",
+                [
+                    (rowid, *(tag_words(user_id, text) for text in texts))
+                    for rowid, user_id, *texts in batch
+                ],
+            )
+
+
+def sqlite_per_user(apps, schema_editor):
+    t = initial._tables(apps, schema_editor)
+    schema_editor.execute(f"DROP TABLE IF EXISTS {t['search']}")
+    schema_editor.execute(
+        f"CREATE VIRTUAL TABLE {t['search']} USING fts5("
+        "title, client, items, tokenize = 'unicode61 remove_diacritics 2')"
+    )
+    # Titles count most, then client details, then line items
+    schema_editor.execute(
+        f"INSERT INTO {t['search']} ({t['search']}, rank) "
+        "VALUES ('rank', 'bm25(10.0, 5.0, 1.0)')"
+    )
+    _copy_documents(
+        schema_editor,
+        t["search"],
+        "SELECT i.id * 2, i.user_id, i.title, "
+        "c.first_name || ' ' || c.last_name || ' ' || c.company || ' ' "
+        "|| c.email, "
+        f"COALESCE((SELECT group_concat(item, ' ') FROM {t['item']} "
+        "WHERE invoice_id = i.id), '') "
+        f"FROM {t['invoice']} i JOIN {t['client']} c ON c.id = i.client_id",
+    )
+    _copy_documents(
+        schema_editor,
+        t["search"],
+        "SELECT c.id * 2 + 1, c.created_by_id, "
+        "c.first_name || ' ' || c.last_name, c.company || ' ' || c.email, '' "
+        f"FROM {t['client']} c",
+    )
+
+
+def sqlite_shared(apps, schema_editor):
+    initial.drop_index(apps, schema_editor)
+    initial.create_index(apps, schema_editor)
+
+
+def postgres_per_user(apps, schema_editor):
+    search = initial._tables(apps, schema_editor)["search"]
+    # Lets a GIN index hold the bigint user id next to the tsvector
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS btree_gin")
+    schema_editor.execute("DROP INDEX IF EXISTS invoices_search_document_idx")
+    schema_editor.execute(
+        f"CREATE INDEX invoices_search_user_document_idx ON {search} "
+        "USING GIN (user_id, document)"
+    )
+
+
+def postgres_shared(apps, schema_editor):
+    search = initial._tables(apps, schema_editor)["search"]
+    schema_editor.execute("DROP INDEX IF EXISTS invoices_search_user_document_idx")
+    schema_editor.execute(
+        f"CREATE INDEX invoices_search_document_idx ON {search} USING GIN (document)"
+    )
+
+
+FORWARDS = {"sqlite": sqlite_per_user, "postgresql": postgres_per_user}
+BACKWARDS = {"sqlite": sqlite_shared, "postgresql": postgres_shared}
+
+
+def _run(operations, apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor not in operations:
+        raise NotSupportedError(f"No search index for {vendor}")
+    operations[vendor](apps, schema_editor)
+
+
+def forwards(apps, schema_editor):
+    _run(FORWARDS, apps, schema_editor)
+
+
+def backwards(apps, schema_editor):
+    _run(BACKWARDS, apps, schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("invoices", "0012_outboundemail"),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, backwards),
+    ]
@@ -0,0 +1,17 @@
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("invoices", "0013_search_index_per_user"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="archivedinvoice",
+            name="updated_at",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -1,7 +1,11 @@
+import uuid
+
 from django.contrib.auth import get_user_model
 from django.db import models
-from django.db.models import Sum, F
+from django.db.models import Count, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
 from django.urls import reverse
+from django.utils import timezone
 from phonenumber_field.modelfields import PhoneNumberField
 
 
@@ -20,6 +24,13 @@ class Client(models.Model):
         on_delete=models.CASCADE,
     )
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["created_by", "last_name"], name="client_owner_name_idx"
+            ),
+        ]
+
     def get_absolute_url(self):
         return reverse("client-detail", kwargs={"pk": self.pk})
 
@@ -30,6 +41,28 @@ class Client(models.Model):
         return f"Client: {self.first_name} {self.last_name}"
 
 
+class InvoiceQuerySet(models.QuerySet):
+    def update_totals(self):
+        """Recompute invoice_total and item_count from the line items in a
+        single UPDATE, which counts as a change to the invoices"""
+        items = InvoiceItem.objects.filter(invoice=OuterRef("pk")).values("invoice")
+        items_total = items.annotate(total=Sum(F("quantity") * F("rate")))
+        items_count = items.annotate(count=Count("pk"))
+        return self.update(
+            updated_at=timezone.now(),
+            invoice_total=Coalesce(
+                Subquery(items_total.values("total")),
+                Value(0),
+                output_field=models.DecimalField(max_digits=6, decimal_places=2),
+            ),
+            item_count=Coalesce(Subquery(items_count.values("count")), Value(0)),
+        )
+
+    def touch(self):
+        """Mark the invoices as changed, e.g. when their client is edited"""
+        return self.update(updated_at=timezone.now())
+
+
 class Invoice(models.Model):
     title = models.CharField(max_length=200)
     user = models.ForeignKey(
@@ -40,16 +73,40 @@ class Invoice(models.Model):
     invoice_total = models.DecimalField(
         max_digits=6, decimal_places=2, blank=True, editable=False, default=0
     )
+    # Kept up to date with invoice_total, see InvoiceQuerySet.update_totals()
+    item_count = models.PositiveIntegerField(default=0, editable=False)
+    # Sequential per user, handed out by invoices.numbering when first saved
+    number = models.PositiveIntegerField(editable=False)
     create_date = models.DateField(auto_now_add=True)
+    # Changes whenever anything printed on the invoice does, see
+    # InvoiceQuerySet.update_totals() and touch()
+    updated_at = models.DateTimeField(auto_now=True)
     invoice_terms = models.TextField(
         blank=True,
         default="NET 30 Days. Finance Charge of 1.5% will be \
         made on unpaid balances after 30 days.",
     )
 
+    objects = InvoiceQuerySet.as_manager()
+
+    # Line items of an invoice loaded from the archive, see invoices.archive.
+    # Such invoices aren't in this table and can't be saved.
+    archived_items = None
+
     class Meta:
         verbose_name: "Invoice"
         verbose_name_plural: "Invoices"  # noqa F821
+        indexes = [
+            models.Index(fields=["user", "-create_date"], name="invoice_user_date_idx"),
+            models.Index(
+                fields=["client", "-create_date"], name="invoice_client_date_idx"
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "number"], name="invoice_user_number_uniq"
+            ),
+        ]
 
     def get_absolute_url(self):
         return reverse("invoice-detail", kwargs={"pk": self.pk})
@@ -69,6 +126,17 @@ class Invoice(models.Model):
         return f"<Invoice: {self.client} - {self.title}>"
 
 
+class InvoiceItemQuerySet(models.QuerySet):
+    def delete_in_bulk(self):
+        """Delete the items with a single DELETE and no post_delete signals
+
+        A plain delete() loads every item to send their signals, each of which
+        refreshes the invoice and drops its cached PDF. Callers do both once
+        for the whole batch instead.
+        """
+        return self._raw_delete(self.db)
+
+
 class InvoiceItem(models.Model):
     # Invoice Line Items
     # https://stackoverflow.com/questions/16252035/django-assigning-a-foreign-key-of-class-that-hasnt-been-created-yet
@@ -81,9 +149,15 @@ class InvoiceItem(models.Model):
     rate = models.DecimalField(max_digits=6, decimal_places=2)
     tax = models.DecimalField(max_digits=6, decimal_places=2, default=0)
 
+    objects = InvoiceItemQuerySet.as_manager()
+
     class Meta:
         verbose_name: "Invoice Item"
         verbose_name_plural: "Invoice Items"
+        indexes = [
+            # Keyset pagination of an invoice's items
+            models.Index(fields=["invoice", "id"], name="invoiceitem_page_idx"),
+        ]
 
     def __str__(self):
         return f"{self.item} - {self.subtotal()}"
@@ -98,3 +172,176 @@ class InvoiceItem(models.Model):
         if self.invoice.pk is None:
             self.invoice.save()
         super().save(*args, **kwargs)
+
+
+class ArchivedInvoiceQuerySet(models.QuerySet):
+    def touch(self):
+        """Mark the archived invoices as changed, e.g. when their client is
+        edited"""
+        return self.update(updated_at=timezone.now())
+
+
+class ArchivedInvoice(models.Model):
+    # An old invoice and its line items, moved out of the Invoice and
+    # InvoiceItem tables by invoices.archive and kept under the invoice's id.
+    # The columns are what lists and rollups need, everything else is in
+    # `data` as zlib compressed JSON.
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(
+        get_user_model(), related_name="archived_invoices", on_delete=models.CASCADE
+    )
+    client = models.ForeignKey(
+        Client, related_name="archived_invoices", on_delete=models.CASCADE
+    )
+    title = models.CharField(max_length=200)
+    number = models.PositiveIntegerField()
+    invoice_total = models.DecimalField(max_digits=6, decimal_places=2)
+    create_date = models.DateField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+    # The invoice's updated_at, moved on when its client or user changes,
+    # since archived invoices are printed with their current details
+    updated_at = models.DateTimeField(default=timezone.now)
+    data = models.BinaryField()
+
+    objects = ArchivedInvoiceQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "-create_date"], name="archive_user_date_idx"),
+            models.Index(
+                fields=["client", "-create_date"], name="archive_client_date_idx"
+            ),
+        ]
+
+    def get_absolute_url(self):
+        return reverse("invoice-detail", kwargs={"pk": self.pk})
+
+    def __str__(self):
+        return f"{self.title}"
+
+    def __repr__(self):
+        return f"<Archived Invoice: {self.pk} - {self.title}>"
+
+
+class InvoiceSequence(models.Model):
+    # The lowest invoice number not yet reserved for a user, see
+    # invoices.numbering
+    user = models.OneToOneField(
+        get_user_model(),
+        primary_key=True,
+        related_name="invoice_sequence",
+        on_delete=models.CASCADE,
+    )
+    next_number = models.PositiveIntegerField(default=1)
+
+    def __str__(self):
+        return f"{self.user_id}: {self.next_number}"
+
+
+class PdfRenderJob(models.Model):
+    # A queued PDF render, drained by `manage.py render_pdfs`
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    invoice = models.ForeignKey(
+        "Invoice", related_name="pdf_jobs", on_delete=models.CASCADE
+    )
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default=PENDING, db_index=True
+    )
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["created_at"]
+
+    def __str__(self):
+        return f"{self.invoice_id} - {self.status}"
+
+    def __repr__(self):
+        return f"<PDF Render Job: {self.pk} - {self.status}>"
+
+    def get_absolute_url(self):
+        return reverse("pdf-job-status", kwargs={"job_id": self.pk})
+
+
+class OutboundEmail(models.Model):
+    # An invoice emailed to its client, delivered by
+    # `manage.py send_invoice_emails`, see invoices/outbox.py
+    PENDING = "pending"
+    SENDING = "sending"
+    SENT = "sent"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (SENDING, "Sending"),
+        (SENT, "Sent"),
+        (FAILED, "Failed"),
+    ]
+
+    invoice = models.ForeignKey(
+        "Invoice", related_name="emails", on_delete=models.CASCADE
+    )
+    to = models.EmailField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    # When a pending email is next due to be sent, pushed back after failures
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["created_at"]
+        indexes = [
+            # Claiming the emails that are due
+            models.Index(fields=["status", "next_attempt_at"], name="outbox_due_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.invoice_id} to {self.to} - {self.status}"
+
+    def __repr__(self):
+        return f"<Outbound Email: {self.pk} - {self.status}>"
+
+
+class RevenueRollup(models.Model):
+    # Invoice statistics for a user, or one of their clients when `client` is
+    # set, over a calendar month, or all time when `month` is empty.
+    # Maintained by invoices.rollups, never edit these rows by hand.
+    user = models.ForeignKey(
+        get_user_model(), related_name="revenue_rollups", on_delete=models.CASCADE
+    )
+    client = models.ForeignKey(
+        Client,
+        related_name="revenue_rollups",
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+    )
+    month = models.DateField(null=True, blank=True)
+    invoice_count = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    first_invoice_date = models.DateField(null=True, blank=True)
+    last_invoice_date = models.DateField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "client", "month"], name="rollup_scope_idx"),
+            models.Index(fields=["client", "month"], name="rollup_client_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} - {self.client_id} - {self.month}: {self.revenue}"
@@ -0,0 +1,80 @@
+"""
+Per-user sequential invoice numbers.
+
+Each user's next free number is kept in an InvoiceSequence row. Taking numbers
+from it one at a time would have every new invoice lock that row until its
+transaction commits, so concurrent saves for a user would queue up behind
+each other. Instead a process reserves INVOICE_NUMBER_BLOCK_SIZE numbers with
+one UPDATE and hands the rest out from memory, touching the row again only
+when they run out.
+
+A reserved block joins the process's pool only once the transaction that
+reserved it commits; if it rolls back, so does the reservation, and the
+numbers may be handed out again elsewhere. Numbers are unique per user, and
+the (user, number) constraint on Invoice makes sure of it, but with several
+workers they aren't given out in order and numbers left in a worker's pool
+when it exits are never used.
+"""
+
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, transaction
+from django.db.models import F
+
+from .models import InvoiceSequence
+
+_lock = threading.Lock()
+# (database alias, user id) -> reserved numbers, lowest last
+_pools = defaultdict(list)
+
+
+def _reserve(user_id, size, using):
+    """Reserve `size` numbers for the user and return the first"""
+    sequences = InvoiceSequence.objects.using(using)
+    sequence = sequences.filter(user_id=user_id)
+    with transaction.atomic(using=using):
+        # Write first, so the row lock (or SQLite's write lock) is taken
+        # before anything is read
+        if sequence.update(next_number=F("next_number") + size):
+            next_number = sequence.values_list("next_number", flat=True).get()
+            return next_number - size
+        try:
+            with transaction.atomic(using=using):
+                sequences.create(user_id=user_id, next_number=1 + size)
+            return 1
+        except IntegrityError:
+            # Another worker created it first
+            return _reserve(user_id, size, using)
+
+
+def _add_to_pool(key, numbers):
+    with _lock:
+        pool = _pools[key]
+        pool.extend(numbers)
+        pool.sort(reverse=True)
+
+
+def allocate(user_id, count=1, using=DEFAULT_DB_ALIAS):
+    """`count` unused invoice numbers for the user, in ascending order"""
+    key = (using, user_id)
+    with _lock:
+        pool = _pools[key]
+        numbers = [pool.pop() for _ in range(min(count, len(pool)))]
+    missing = count - len(numbers)
+    if missing:
+        size = max(missing, settings.INVOICE_NUMBER_BLOCK_SIZE)
+        start = _reserve(user_id, size, using)
+        numbers.extend(range(start, start + missing))
+        spare = range(start + missing, start + size)
+        if spare:
+            transaction.on_commit(lambda: _add_to_pool(key, spare), using=using)
+    return numbers
+
+
+def forget(user_id):
+    """Drop the user's pooled numbers, for a primary key that was reused"""
+    with _lock:
+        for key in [key for key in _pools if key[1] == user_id]:
+            del _pools[key]
@@ -0,0 +1,195 @@
+"""
+Emailing invoices to clients.
+
+Sending over SMTP from a view would hold a web worker for seconds, so views
+queue an ``OutboundEmail`` row instead and the ``send_invoice_emails``
+management command delivers them. It claims due emails in batches, attaches
+each invoice's PDF from the PDF cache (rendering it on a miss, like the
+download view) and sends the batch over a pool of email backend connections
+that stay open from one batch to the next. A failed send is retried after
+EMAIL_OUTBOX_RETRY_DELAY seconds, doubling with every attempt, until
+EMAIL_OUTBOX_MAX_ATTEMPTS is reached.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from smtplib import SMTPServerDisconnected
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from .models import OutboundEmail
+from .pdf import pdf_filename
+from .pdf_cache import get_invoice_pdf
+
+
+def enqueue_invoice_email(invoice):
+    """Queue the invoice for its client, reusing an email not yet sent"""
+    email = (
+        OutboundEmail.objects.filter(
+            invoice=invoice,
+            to=invoice.client.email,
+            status__in=[OutboundEmail.PENDING, OutboundEmail.SENDING],
+        )
+        .order_by("-created_at")
+        .first()
+    )
+    if email is None:
+        email = OutboundEmail.objects.create(invoice=invoice, to=invoice.client.email)
+    return email
+
+
+def claim_emails(limit):
+    """Mark up to `limit` due emails as sending and return their ids
+
+    As with PDF render jobs, the conditional UPDATE makes claiming safe when
+    several senders drain the same table.
+    """
+    due = (
+        OutboundEmail.objects.filter(
+            status=OutboundEmail.PENDING, next_attempt_at__lte=timezone.now()
+        )
+        .order_by("next_attempt_at", "pk")
+        .values_list("pk", flat=True)[:limit]
+    )
+    claimed = []
+    for email_id in due:
+        updated = OutboundEmail.objects.filter(
+            pk=email_id, status=OutboundEmail.PENDING
+        ).update(status=OutboundEmail.SENDING, started_at=timezone.now())
+        if updated:
+            claimed.append(email_id)
+    return claimed
+
+
+def requeue_stale_emails(claimed_before):
+    """Put emails claimed before `claimed_before` and never finished back in
+    the queue, returning how many
+
+    Their sender died mid-batch. Until they're requeued, nobody sends them and
+    enqueue_invoice_email() keeps handing them out.
+    """
+    return OutboundEmail.objects.filter(
+        status=OutboundEmail.SENDING, started_at__lt=claimed_before
+    ).update(status=OutboundEmail.PENDING, started_at=None)
+
+
+def build_message(email):
+    """The EmailMessage for an outbox row, with the invoice PDF attached"""
+    invoice = email.invoice
+    context = {"invoice": invoice, "client": invoice.client, "user": invoice.user}
+    message = EmailMessage(
+        subject=render_to_string("email/invoice_subject.txt", context).strip(),
+        body=render_to_string("email/invoice_body.txt", context),
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=[email.to],
+        reply_to=[invoice.user.email] if invoice.user.email else None,
+    )
+    message.attach(pdf_filename(invoice), get_invoice_pdf(invoice), "application/pdf")
+    return message
+
+
+class ConnectionPool:
+    """Sends messages from a few threads, each with its own backend connection
+
+    A connection is opened on a thread's first send and kept open for the
+    ones after it, so a batch doesn't pay for an SMTP handshake (and TLS and
+    login) per message. One that fails is closed and reopened on next use,
+    except that one the server dropped while idle is reopened straight away.
+    """
+
+    def __init__(self, size):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+        self._executor = ThreadPoolExecutor(size, thread_name_prefix="outbox")
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = get_connection()
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    def _send(self, message):
+        """None once sent, or the error"""
+        connection = self._connection()
+        try:
+            # Opened here, send_messages() leaves the connection open after
+            reused = not connection.open()
+            try:
+                sent = connection.send_messages([message])
+            except SMTPServerDisconnected:
+                if not reused:
+                    raise
+                # Servers hang up on idle connections, which says nothing
+                # about the message, so it isn't an attempt used up
+                connection.close()
+                connection.open()
+                sent = connection.send_messages([message])
+            if not sent:
+                return "The message has no recipients"
+        except Exception as exc:
+            connection.close()
+            return repr(exc)
+        return None
+
+    def send(self, messages):
+        """Send the messages, returning their errors in the same order"""
+        return list(self._executor.map(self._send, messages))
+
+    def close(self):
+        self._executor.shutdown()
+        for connection in self._connections:
+            connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _record(emails, errors):
+    now = timezone.now()
+    for email, error in zip(emails, errors):
+        email.attempts += 1
+        if error is None:
+            email.status, email.error, email.sent_at = OutboundEmail.SENT, "", now
+            continue
+        email.error = error
+        if email.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+            email.status = OutboundEmail.FAILED
+        else:
+            email.status = OutboundEmail.PENDING
+            delay = settings.EMAIL_OUTBOX_RETRY_DELAY * 2 ** (email.attempts - 1)
+            email.next_attempt_at = now + timedelta(seconds=delay)
+    OutboundEmail.objects.bulk_update(
+        emails, ["status", "attempts", "error", "next_attempt_at", "sent_at"]
+    )
+
+
+def send_due_emails(pool, limit):
+    """Claim and send up to `limit` due emails, returning how many were sent
+    and how many failed"""
+    emails = list(
+        OutboundEmail.objects.filter(pk__in=claim_emails(limit))
+        .select_related("invoice__client", "invoice__user")
+        .order_by("pk")
+    )
+    errors, built = {}, []
+    for email in emails:
+        try:
+            built.append((email, build_message(email)))
+        except Exception as exc:
+            errors[email.pk] = repr(exc)
+    results = pool.send([message for _, message in built])
+    for (email, _), error in zip(built, results):
+        errors[email.pk] = error
+    _record(emails, [errors[email.pk] for email in emails])
+    failed = sum(1 for error in errors.values() if error is not None)
+    return len(emails) - failed, failed
@@ -0,0 +1,146 @@
+"""
+Keyset (cursor) pagination.
+
+Pages are selected with a WHERE clause on the ordering columns of the last row
+seen instead of OFFSET, and nothing is counted, so every page costs the same
+however deep into a user's history it is. Cursors are signed so they are
+opaque to clients and can't be tampered with.
+"""
+
+from django.core import signing
+from django.db.models import Q
+from django.http import Http404
+from django.utils.functional import cached_property
+
+CURSOR_SALT = "invoices.pagination"
+
+
+class KeysetPage:
+    """One page of `queryset` in `ordering` order, starting after `cursor`
+
+    `ordering` must end in a unique column (e.g. "-id") so rows with equal
+    sort values are never skipped or repeated. The page is only fetched when
+    it's first used.
+    """
+
+    def __init__(self, queryset, ordering, page_size, cursor=None):
+        self.queryset = queryset
+        self.ordering = ordering
+        self.page_size = page_size
+        self.values, self.direction = self.decode(cursor)
+
+    def decode(self, cursor):
+        if not cursor:
+            return None, "next"
+        try:
+            data = signing.loads(cursor, salt=CURSOR_SALT)
+            direction = data["direction"]
+            values = [
+                self._field(name).to_python(value)
+                for name, value in zip(self.ordering, data["values"], strict=True)
+            ]
+        except (signing.BadSignature, KeyError, TypeError, ValueError) as exc:
+            raise Http404("Invalid page cursor") from exc
+        if direction not in ("next", "previous"):
+            raise Http404("Invalid page cursor")
+        return values, direction
+
+    def encode(self, row, direction):
+        values = [str(self._value(row, name)) for name in self.ordering]
+        return signing.dumps(
+            {"values": values, "direction": direction}, salt=CURSOR_SALT
+        )
+
+    def _field(self, name):
+        name = name.lstrip("-")
+        if name == "pk":
+            return self.queryset.model._meta.pk
+        return self.queryset.model._meta.get_field(name)
+
+    def _value(self, row, name):
+        return getattr(row, self._field(name).attname)
+
+    def _after(self, values, ordering):
+        """Q matching rows that come after `values` when sorted by `ordering`"""
+        condition = Q()
+        equal = Q()
+        for name, value in zip(ordering, values):
+            column = name.lstrip("-")
+            lookup = "lt" if name.startswith("-") else "gt"
+            condition |= equal & Q(**{f"{column}__{lookup}": value})
+            equal &= Q(**{column: value})
+        return condition
+
+    def _page_queryset(self):
+        ordering = self.ordering
+        if self.direction == "previous":
+            # Walk backwards from the cursor, then put the rows back in order
+            ordering = [
+                name[1:] if name.startswith("-") else f"-{name}" for name in ordering
+            ]
+        queryset = self.queryset.order_by(*ordering)
+        if self.values is not None:
+            queryset = queryset.filter(self._after(self.values, ordering))
+        return queryset[: self.page_size + 1]
+
+    def _split(self, rows):
+        has_more = len(rows) > self.page_size
+        rows = rows[: self.page_size]
+        if self.direction == "previous":
+            rows.reverse()
+        return rows, has_more
+
+    @cached_property
+    def _rows(self):
+        return self._split(list(self._page_queryset()))
+
+    async def afetch(self):
+        """Fetch the page with the async ORM, for async views"""
+        rows = [row async for row in self._page_queryset()]
+        self.__dict__["_rows"] = self._split(rows)
+
+    @property
+    def object_list(self):
+        return self._rows[0]
+
+    def has_next(self):
+        if self.direction == "previous":
+            return True
+        return self._rows[1]
+
+    def has_previous(self):
+        if self.direction == "previous":
+            return self._rows[1]
+        return self.values is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    def next_token(self):
+        if self.object_list and self.has_next():
+            return self.encode(self.object_list[-1], "next")
+
+    def previous_token(self):
+        if self.object_list and self.has_previous():
+            return self.encode(self.object_list[0], "previous")
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+
+class KeysetPaginationMixin:
+    """Replaces a ListView's OFFSET paginator with keyset pagination"""
+
+    keyset_ordering = ("-create_date", "-id")
+    cursor_kwarg = "cursor"
+
+    def paginate_queryset(self, queryset, page_size):
+        cursor = self.request.GET.get(self.cursor_kwarg)
+        page = KeysetPage(queryset, self.keyset_ordering, page_size, cursor)
+        return (None, page, page, True)
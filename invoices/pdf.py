@@ -0,0 +1,106 @@
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import django
+from django.conf import settings
+from django.template.loader import get_template
+from weasyprint import CSS, HTML
+from weasyprint.text.fonts import FontConfiguration
+
+from . import metrics
+
+PDF_TEMPLATE = "pdf/html-invoice.html"
+PDF_STYLESHEET = Path(settings.BASE_DIR) / "templates" / "pdf" / "html-invoice.css"
+
+
+def get_pdf_context(invoice, invoice_items=None):
+    if invoice_items is None:
+        invoice_items = invoice.items.all()
+    return {
+        "invoice": invoice,
+        "client": invoice.client,
+        "user": invoice.user,
+        "invoice_items": invoice_items,
+    }
+
+
+def pdf_filename(invoice):
+    return f"invoice_{invoice.pk}.pdf"
+
+
+class InvoiceRenderer:
+    """Renders invoice PDFs, reusing everything that doesn't vary per invoice
+
+    Building one parses the invoice stylesheet, sets up font discovery and
+    compiles the template. A renderer is meant to live as long as the process
+    so that each render only lays out the invoice itself.
+    """
+
+    def __init__(self, stylesheet=PDF_STYLESHEET, template_name=PDF_TEMPLATE):
+        self.template = get_template(template_name)
+        css_source = Path(stylesheet).read_text()
+        self.font_config = FontConfiguration()
+        self.stylesheet = CSS(string=css_source, font_config=self.font_config)
+        # Identifies the layout inputs, the PDF cache keys on it
+        self.version = hashlib.sha256(
+            (self.template.template.source + css_source).encode()
+        ).hexdigest()
+
+    def render_html(self, invoice, invoice_items=None):
+        return self.template.render(get_pdf_context(invoice, invoice_items))
+
+    def render(self, invoice, invoice_items=None, base_url=None):
+        html = HTML(string=self.render_html(invoice, invoice_items), base_url=base_url)
+        with metrics.timed("pdf-layout", metrics.PDF_DURATION, phase="layout"):
+            document = html.render(
+                stylesheets=[self.stylesheet], font_config=self.font_config
+            )
+        with metrics.timed("pdf-write", metrics.PDF_DURATION, phase="write"):
+            return document.write_pdf()
+
+    def warm_up(self):
+        # The first layout initialises Pango and fontconfig, pay for it up front
+        HTML(string="<p>Invoice</p>").write_pdf(
+            stylesheets=[self.stylesheet], font_config=self.font_config
+        )
+
+
+_renderer = None
+
+
+def get_renderer():
+    global _renderer
+    if _renderer is None:
+        _renderer = InvoiceRenderer()
+    return _renderer
+
+
+def warm_up():
+    """Build this process's renderer ahead of the first request"""
+    get_renderer().warm_up()
+
+
+def render_invoice_pdf(invoice, invoice_items=None, base_url=None):
+    """Render an invoice to PDF bytes with WeasyPrint"""
+    return get_renderer().render(invoice, invoice_items, base_url=base_url)
+
+
+def init_render_process():
+    django.setup()
+    warm_up()
+
+
+def create_render_pool(processes=None):
+    """Process pool for rendering PDFs outside of the calling process
+
+    Workers are spawned rather than forked so they never share database
+    connections with the parent, and set up Django and a warm renderer on
+    start.
+    """
+    return ProcessPoolExecutor(
+        max_workers=processes or settings.PDF_RENDER_PROCESSES,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_render_process,
+    )
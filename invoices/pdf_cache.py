@@ -0,0 +1,182 @@
+"""
+On-disk cache of rendered invoice PDFs.
+
+Entries are stored as ``<PDF_CACHE_DIR>/<invoice id>/<key>.pdf`` where the key
+is a hash of everything that ends up on the page: the invoice, its line items,
+the client, the issuing user's profile and the PDF template and stylesheet.
+The cache is kept under ``PDF_CACHE_MAX_SIZE`` bytes by evicting the least
+recently used files, and ``invoices.signals`` drops an invoice's entries
+whenever any of its inputs change.
+"""
+
+import asyncio
+import functools
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+from contextlib import suppress
+from pathlib import Path
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from . import metrics
+from .pdf import get_renderer, render_invoice_pdf
+
+logger = logging.getLogger(__name__)
+
+# CustomUser fields that are printed on the invoice. Other fields (last_login,
+# password, ...) change often and must not bust the cache.
+USER_PROFILE_FIELDS = (
+    "first_name",
+    "last_name",
+    "email",
+    "company",
+    "address1",
+    "address2",
+    "country",
+    "company_logo",
+    "phone_number",
+)
+
+
+def _field_values(obj, fields=None):
+    if fields is None:
+        fields = [field.attname for field in obj._meta.concrete_fields]
+    return {name: str(getattr(obj, name)) for name in fields}
+
+
+def cache_key(invoice, invoice_items):
+    payload = {
+        "renderer": get_renderer().version,
+        "invoice": _field_values(invoice),
+        "items": [_field_values(item) for item in invoice_items],
+        "client": _field_values(invoice.client),
+        "user": _field_values(invoice.user, USER_PROFILE_FIELDS),
+    }
+    encoded = json.dumps(payload, sort_keys=True).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def _invoice_dir(invoice_id):
+    return Path(settings.PDF_CACHE_DIR) / str(invoice_id)
+
+
+def _store(path, pdf):
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Only the newest rendering of an invoice can ever be requested again
+        for stale in path.parent.glob("*.pdf"):
+            with suppress(FileNotFoundError):
+                stale.unlink()
+        with tempfile.NamedTemporaryFile(dir=path.parent, delete=False) as tmp:
+            tmp.write(pdf)
+        os.replace(tmp.name, path)
+    except OSError:
+        # The cache is best effort, a failed write must not fail the download
+        logger.warning("Could not cache invoice PDF at %s", path, exc_info=True)
+
+
+def _save(path, pdf):
+    _store(path, pdf)
+    evict()
+
+
+def _cache_path(invoice, invoice_items):
+    return _invoice_dir(invoice.pk) / f"{cache_key(invoice, invoice_items)}.pdf"
+
+
+def _read(path):
+    pdf = path.read_bytes()
+    # Bump the modification time so LRU eviction sees this entry as fresh
+    with suppress(FileNotFoundError):
+        os.utime(path)
+    return pdf
+
+
+def _invoice_items(invoice):
+    if invoice.archived_items is not None:
+        return invoice.archived_items
+    return list(invoice.items.order_by("pk"))
+
+
+def get_cached_pdf(invoice):
+    """Return the cached PDF for an invoice, or None if it isn't rendered yet"""
+    path = _cache_path(invoice, _invoice_items(invoice))
+    try:
+        return _read(path)
+    except FileNotFoundError:
+        return None
+
+
+def get_invoice_pdf(invoice, base_url=None):
+    """Return the PDF for an invoice, rendering it only on a cache miss"""
+    invoice_items = _invoice_items(invoice)
+    path = _cache_path(invoice, invoice_items)
+    try:
+        return _read(path)
+    except FileNotFoundError:
+        pdf = render_invoice_pdf(invoice, invoice_items, base_url=base_url)
+        _save(path, pdf)
+        return pdf
+
+
+async def aget_invoice_pdf(invoice, base_url=None, executor=None):
+    """get_invoice_pdf() for async views
+
+    A cache miss is rendered in `executor`, or the event loop's default
+    thread pool, so the loop keeps serving other requests meanwhile. The
+    invoice must come with its client and user already loaded.
+    """
+    if invoice.archived_items is not None:
+        invoice_items = invoice.archived_items
+    else:
+        invoice_items = [item async for item in invoice.items.order_by("pk")]
+    path = _cache_path(invoice, invoice_items)
+    try:
+        return _read(path)
+    except FileNotFoundError:
+        pass
+    render = functools.partial(
+        metrics.call_timed,
+        render_invoice_pdf,
+        invoice,
+        invoice_items,
+        base_url=base_url,
+    )
+    pdf, timings = await asyncio.get_running_loop().run_in_executor(executor, render)
+    metrics.add_timings(timings)
+    await sync_to_async(_save, thread_sensitive=False)(path, pdf)
+    return pdf
+
+
+def evict(max_size=None):
+    """Delete least recently used entries until the cache fits in max_size"""
+    if max_size is None:
+        max_size = settings.PDF_CACHE_MAX_SIZE
+    entries = []
+    total_size = 0
+    for path in Path(settings.PDF_CACHE_DIR).glob("*/*.pdf"):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+        total_size += stat.st_size
+
+    entries.sort()
+    for _, size, path in entries:
+        if total_size <= max_size:
+            break
+        with suppress(FileNotFoundError):
+            path.unlink()
+        total_size -= size
+
+
+def invalidate(*invoice_ids):
+    """Drop cached PDFs for the given invoices"""
+    for invoice_id in invoice_ids:
+        shutil.rmtree(_invoice_dir(invoice_id), ignore_errors=True)
@@ -0,0 +1,114 @@
+"""
+Serving reads from the replicas in settings.DATABASE_REPLICAS.
+
+Views marked with replica_reads() read invoices, clients and rollups from a
+replica, picked once per request. Everything else, every write, and users
+and sessions, which a login mustn't wait on replication for, use the primary.
+
+Replicas lag a little behind the primary. So that users never see totals
+older than their own changes, ReplicaMiddleware keeps a browser on the
+primary for DATABASE_REPLICA_PIN_SECONDS after any POST, PUT, PATCH or DELETE
+it makes, with a cookie.
+"""
+
+import random
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+PIN_COOKIE = "read_primary"
+REPLICATED_APPS = {"invoices"}
+SAFE_METHODS = {"GET", "HEAD", "OPTIONS", "TRACE"}
+
+
+class _Reads:
+    """Replica alias for the current request's reads, None for the primary"""
+
+    alias = None
+
+
+_current = ContextVar("replica_reads", default=None)
+
+
+def replica_reads(view):
+    """Mark `view` as happy to read from a replica"""
+    view.replica_reads = True
+    return view
+
+
+def read_alias():
+    """The replica this request is reading from, None for the primary"""
+    reads = _current.get()
+    return reads.alias if reads else None
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        alias = read_alias()
+        if alias and model._meta.app_label in REPLICATED_APPS:
+            return alias
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        # Including objects that were read from a replica
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, **hints):
+        # Replicas get their tables from the primary
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+
+class ReplicaMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = _current.set(_Reads())
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.pin(request, response)
+
+    async def __acall__(self, request):
+        token = _current.set(_Reads())
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.pin(request, response)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not getattr(view_func, "replica_reads", False):
+            return
+        if request.method in SAFE_METHODS and PIN_COOKIE not in request.COOKIES:
+            replicas = settings.DATABASE_REPLICAS
+            _current.get().alias = random.choice(replicas) if replicas else None
+
+    def pin(self, request, response):
+        if settings.DATABASE_REPLICAS and request.method not in SAFE_METHODS:
+            response.set_cookie(
+                PIN_COOKIE,
+                "1",
+                max_age=settings.DATABASE_REPLICA_PIN_SECONDS,
+                httponly=True,
+                samesite="Lax",
+            )
+        return response
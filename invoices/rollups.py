@@ -0,0 +1,133 @@
+"""
+Maintenance of the RevenueRollup summary table.
+
+Client rows are recomputed from that client's invoices, and user rows are
+summed from the user's client rows, so refreshing after a change only reads
+the invoices of the clients involved. Archived invoices count like any
+other. invoices.signals calls refresh() once per transaction with everything
+that changed.
+"""
+
+from itertools import chain
+
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Count, DecimalField, Max, Min, Sum, Value
+from django.db.models.functions import Coalesce, TruncMonth
+
+from .models import ArchivedInvoice, Client, Invoice, RevenueRollup
+
+INVOICE_STATS = {
+    "invoice_count": Count("pk"),
+    "revenue": Coalesce(
+        Sum("invoice_total"),
+        Value(0),
+        output_field=DecimalField(max_digits=14, decimal_places=2),
+    ),
+    "first_invoice_date": Min("create_date"),
+    "last_invoice_date": Max("create_date"),
+}
+
+ROLLUP_STATS = {
+    "invoice_count": Sum("invoice_count"),
+    "revenue": Sum("revenue"),
+    "first_invoice_date": Min("first_invoice_date"),
+    "last_invoice_date": Max("last_invoice_date"),
+}
+
+
+def _merge(row, other):
+    if row is None:
+        return other
+    return {
+        **row,
+        "invoice_count": row["invoice_count"] + other["invoice_count"],
+        "revenue": row["revenue"] + other["revenue"],
+        "first_invoice_date": min(
+            row["first_invoice_date"], other["first_invoice_date"]
+        ),
+        "last_invoice_date": max(row["last_invoice_date"], other["last_invoice_date"]),
+    }
+
+
+def _client_rollups(*querysets):
+    """Rollups per (user, client) and per (user, client, month) over the
+    invoices in `querysets`, archived ones included"""
+    rows = {}
+    for invoices in querysets:
+        totals = (
+            invoices.order_by().values("user_id", "client_id").annotate(**INVOICE_STATS)
+        )
+        monthly = (
+            invoices.order_by()
+            .annotate(month=TruncMonth("create_date"))
+            .values("user_id", "client_id", "month")
+            .annotate(**INVOICE_STATS)
+        )
+        for row in chain(totals.iterator(), monthly.iterator()):
+            key = (row["user_id"], row["client_id"], row.get("month"))
+            rows[key] = _merge(rows.get(key), row)
+    for row in rows.values():
+        yield RevenueRollup(**row)
+
+
+def _user_rollups(client_rollups):
+    # Grouping by month also yields the all-time rows, where month is NULL
+    rows = client_rollups.order_by().values("user_id", "month").annotate(**ROLLUP_STATS)
+    for row in rows.iterator():
+        yield RevenueRollup(client=None, **row)
+
+
+def refresh(client_ids=(), user_ids=(), using=DEFAULT_DB_ALIAS):
+    """Recompute the rollups of the given clients and users"""
+    client_ids = sorted(set(client_ids))
+    user_ids = set(user_ids)
+    rollups = RevenueRollup.objects.using(using)
+    with transaction.atomic(using=using):
+        if client_ids:
+            # Lock the clients so concurrent refreshes don't both insert rows
+            list(
+                Client.objects.using(using)
+                .select_for_update()
+                .filter(pk__in=client_ids)
+                .order_by("pk")
+                .values_list("pk")
+            )
+            rollups.filter(client_id__in=client_ids).delete()
+            rows = list(
+                _client_rollups(
+                    Invoice.objects.using(using).filter(client_id__in=client_ids),
+                    ArchivedInvoice.objects.using(using).filter(
+                        client_id__in=client_ids
+                    ),
+                )
+            )
+            rollups.bulk_create(rows, batch_size=1000)
+            user_ids.update(row.user_id for row in rows)
+
+        if user_ids:
+            list(
+                get_user_model()
+                .objects.using(using)
+                .select_for_update()
+                .filter(pk__in=user_ids)
+                .order_by("pk")
+                .values_list("pk")
+            )
+            rollups.filter(user_id__in=user_ids, client__isnull=True).delete()
+            client_rows = rollups.filter(user_id__in=user_ids, client__isnull=False)
+            rollups.bulk_create(_user_rollups(client_rows), batch_size=1000)
+
+
+def rebuild(using=DEFAULT_DB_ALIAS):
+    """Recompute every rollup from scratch"""
+    rollups = RevenueRollup.objects.using(using)
+    with transaction.atomic(using=using):
+        rollups.all().delete()
+        rows = _client_rollups(
+            Invoice.objects.using(using).all(),
+            ArchivedInvoice.objects.using(using).all(),
+        )
+        rollups.bulk_create(rows, batch_size=1000)
+        client_rows = rollups.filter(client__isnull=False)
+        rollups.bulk_create(_user_rollups(client_rows), batch_size=1000)
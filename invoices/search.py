@@ -0,0 +1,242 @@
+"""
+Full-text search over invoices and clients.
+
+Every invoice and client has a document in the `invoices_search` table. An
+invoice's document holds its title, its client's name, company and email and
+the text of its line items, weighted in that order. A client's holds the
+client details alone.
+
+On SQLite the table is an FTS5 index ranked with bm25, with rowids that encode
+the kind and id of the object. Every word is stored prefixed with its owner,
+e.g. "u12xwebsite", so each user's words form their own range of terms. On
+PostgreSQL it's a tsvector column with a GIN index over the user id and the
+document (btree_gin), ranked with ts_rank. Either way the user is part of the
+index, and a search only reads that user's postings however many other users
+share its terms. The tables are created by migrations. Documents are built
+from the source tables in SQL, so indexing doesn't load any models.
+invoices.signals reindexes whatever a transaction changed when it commits.
+"""
+
+import re
+from collections import namedtuple
+
+from django.db import DEFAULT_DB_ALIAS, NotSupportedError, connections, transaction
+
+from .models import Client, Invoice, InvoiceItem
+
+TABLE = "invoices_search"
+KINDS = ("invoice", "client")
+# Ids are sent to the database in batches of this size
+BATCH_SIZE = 500
+# Words as the SQLite tokenizer splits them, which treats "_" as a separator
+WORD = re.compile(r"[^\W_]+")
+
+SearchHit = namedtuple("SearchHit", ["kind", "object_id"])
+
+
+def _tables(connection):
+    quote = connection.ops.quote_name
+    return {
+        "search": quote(TABLE),
+        "invoice": quote(Invoice._meta.db_table),
+        "client": quote(Client._meta.db_table),
+        "item": quote(InvoiceItem._meta.db_table),
+    }
+
+
+def _batches(ids):
+    ids = sorted(set(ids))
+    for start in range(0, len(ids), BATCH_SIZE):
+        yield ids[start : start + BATCH_SIZE]
+
+
+def _placeholders(values):
+    return ", ".join(["%s"] * len(values))
+
+
+def _terms(query):
+    return WORD.findall(query.lower())
+
+
+def tag_words(user_id, text):
+    """`text` with each word prefixed by its owner, as stored in SQLite"""
+    return " ".join(f"u{user_id}x{word}" for word in WORD.findall(text))
+
+
+class _Index:
+    def __init__(self, connection):
+        self.connection = connection
+        self.tables = _tables(connection)
+
+    def _execute(self, sql, params=()):
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall() if cursor.description else None
+
+
+class SqliteIndex(_Index):
+    def _rowid(self, kind, column):
+        # Each kind gets every len(KINDS)th rowid, so documents are found by
+        # rowid alone
+        return f"{column} * {len(KINDS)} + {KINDS.index(kind)}"
+
+    def delete(self, kind, object_ids):
+        self._execute(
+            f"DELETE FROM {self.tables['search']} "
+            f"WHERE rowid IN ({_placeholders(object_ids)})",
+            [pk * len(KINDS) + KINDS.index(kind) for pk in object_ids],
+        )
+
+    def _insert(self, sql, params):
+        # Rows of (rowid, user id, title, client, items) from `sql`, written
+        # with every word tagged with its owner
+        search = self.tables["search"]
+        with self.connection.cursor() as rows, self.connection.cursor() as cursor:
+            rows.execute(sql, params)
+            while batch := rows.fetchmany(BATCH_SIZE):
+                cursor.executemany(
+                    f"INSERT INTO {search} (rowid, title, client, items) "
+                    "VALUES (%s, %s, %s, %s)",
+                    [
+                        (rowid, *(tag_words(user_id, text) for text in texts))
+                        for rowid, user_id, *texts in batch
+                    ],
+                )
+
+    def index_invoices(self, where, params):
+        t = self.tables
+        self._insert(
+            f"SELECT {self._rowid('invoice', 'i.id')}, i.user_id, i.title, "
+            "c.first_name || ' ' || c.last_name || ' ' || c.company || ' ' "
+            "|| c.email, "
+            f"COALESCE((SELECT group_concat(item, ' ') FROM {t['item']} "
+            "WHERE invoice_id = i.id), '') "
+            f"FROM {t['invoice']} i JOIN {t['client']} c ON c.id = i.client_id "
+            f"WHERE {where}",
+            params,
+        )
+
+    def index_clients(self, where, params):
+        self._insert(
+            f"SELECT {self._rowid('client', 'c.id')}, c.created_by_id, "
+            "c.first_name || ' ' || c.last_name, c.company || ' ' || c.email, '' "
+            f"FROM {self.tables['client']} c WHERE {where}",
+            params,
+        )
+
+    def clear(self):
+        self._execute(f"DELETE FROM {self.tables['search']}")
+
+    def search(self, user_id, terms, limit):
+        search = self.tables["search"]
+        rows = self._execute(
+            f"SELECT rowid FROM {search} WHERE {search} MATCH %s "
+            "ORDER BY rank LIMIT %s",
+            [" ".join(f'"{tag_words(user_id, term)}"*' for term in terms), limit],
+        )
+        return [
+            SearchHit(KINDS[rowid % len(KINDS)], rowid // len(KINDS))
+            for (rowid,) in rows
+        ]
+
+
+class PostgresIndex(_Index):
+    def delete(self, kind, object_ids):
+        self._execute(
+            f"DELETE FROM {self.tables['search']} "
+            "WHERE kind = %s AND object_id = ANY(%s)",
+            [kind, list(object_ids)],
+        )
+
+    def index_invoices(self, where, params):
+        t = self.tables
+        # Titles count most, then client details, then line items
+        self._execute(
+            f"INSERT INTO {t['search']} (kind, object_id, user_id, document) "
+            "SELECT 'invoice', i.id, i.user_id, "
+            "setweight(to_tsvector('simple', i.title), 'A') || "
+            "setweight(to_tsvector('simple', concat_ws(' ', c.first_name, "
+            "c.last_name, c.company, c.email)), 'B') || "
+            "setweight(to_tsvector('simple', COALESCE((SELECT string_agg(item, ' ') "
+            f"FROM {t['item']} WHERE invoice_id = i.id), '')), 'C') "
+            f"FROM {t['invoice']} i JOIN {t['client']} c ON c.id = i.client_id "
+            f"WHERE {where}",
+            params,
+        )
+
+    def index_clients(self, where, params):
+        self._execute(
+            f"INSERT INTO {self.tables['search']} "
+            "(kind, object_id, user_id, document) "
+            "SELECT 'client', c.id, c.created_by_id, "
+            "setweight(to_tsvector('simple', concat_ws(' ', c.first_name, "
+            "c.last_name)), 'A') || "
+            "setweight(to_tsvector('simple', concat_ws(' ', c.company, c.email)), "
+            f"'B') FROM {self.tables['client']} c WHERE {where}",
+            params,
+        )
+
+    def clear(self):
+        self._execute(f"TRUNCATE {self.tables['search']}")
+
+    def search(self, user_id, terms, limit):
+        rows = self._execute(
+            f"SELECT kind, object_id FROM {self.tables['search']}, "
+            "to_tsquery('simple', %s) query "
+            "WHERE document @@ query AND user_id = %s "
+            "ORDER BY ts_rank(document, query) DESC LIMIT %s",
+            [" & ".join(f"{term}:*" for term in terms), user_id, limit],
+        )
+        return [SearchHit(*row) for row in rows]
+
+
+BACKENDS = {"sqlite": SqliteIndex, "postgresql": PostgresIndex}
+
+
+def get_index(connection):
+    try:
+        return BACKENDS[connection.vendor](connection)
+    except KeyError:
+        raise NotSupportedError(f"No search index for {connection.vendor}")
+
+
+def index_invoices(invoice_ids, using=DEFAULT_DB_ALIAS):
+    """(Re)index the given invoices, dropping those that no longer exist"""
+    index = get_index(connections[using])
+    with transaction.atomic(using=using):
+        for batch in _batches(invoice_ids):
+            index.delete("invoice", batch)
+            index.index_invoices(f"i.id IN ({_placeholders(batch)})", batch)
+
+
+def index_clients(client_ids, using=DEFAULT_DB_ALIAS, invoices=True):
+    """(Re)index the given clients and, unless `invoices` is false, their invoices"""
+    index = get_index(connections[using])
+    with transaction.atomic(using=using):
+        for batch in _batches(client_ids):
+            index.delete("client", batch)
+            index.index_clients(f"c.id IN ({_placeholders(batch)})", batch)
+            if invoices:
+                # Client details are part of their invoices' documents too
+                invoice_ids = Invoice.objects.using(using).filter(client_id__in=batch)
+                index_invoices(invoice_ids.values_list("pk", flat=True), using)
+
+
+def rebuild(using=DEFAULT_DB_ALIAS):
+    """Reindex every invoice and client"""
+    index = get_index(connections[using])
+    with transaction.atomic(using=using):
+        index.clear()
+        index.index_invoices("1 = 1", [])
+        index.index_clients("1 = 1", [])
+
+
+def search(user, query, limit=50, using=DEFAULT_DB_ALIAS):
+    """Best matches first for the user's invoices and clients
+
+    Every word of `query` must match the start of a word in the document.
+    """
+    terms = _terms(query)
+    if not terms:
+        return []
+    return get_index(connections[using]).search(user.pk, terms, limit)
@@ -1,24 +1,162 @@
-from django.db.models import F, Sum
-from django.db.models.signals import post_save
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
 from django.dispatch import receiver
 
-from .models import Invoice, InvoiceItem
+from . import fragments, numbering, pdf_cache, rollups, search
+from .models import ArchivedInvoice, Client, Invoice, InvoiceItem
+
+
+class _PendingChanges:
+    """Invoices, clients and users touched by the current transaction
+
+    Derived data (invoice totals, revenue rollups, the search index) is
+    refreshed for all of them at once when the transaction commits, so saving
+    a formset of N items costs one aggregate UPDATE instead of N of them.
+    """
+
+    def __init__(self, using):
+        self.using = using
+        self.invoice_ids = set()
+        self.client_ids = set()
+        self.user_ids = set()
+        self.flushed = False
+
+    def add(self, invoice_id=None, client_id=None, user_id=None):
+        for ids, pk in (
+            (self.invoice_ids, invoice_id),
+            (self.client_ids, client_id),
+            (self.user_ids, user_id),
+        ):
+            if pk is not None:
+                ids.add(pk)
+
+    def __call__(self):
+        # Registered once per change, so every callback after the first is a
+        # no-op
+        if self.flushed:
+            return
+        self.flushed = True
+        connection = transaction.get_connection(self.using)
+        if getattr(connection, "pending_invoice_changes", None) is self:
+            del connection.pending_invoice_changes
+        invoices = Invoice.objects.using(self.using).filter(pk__in=self.invoice_ids)
+        if self.invoice_ids:
+            invoices.update_totals()
+            for client_id, user_id in invoices.values_list("client_id", "user_id"):
+                self.add(client_id=client_id, user_id=user_id)
+            search.index_invoices(self.invoice_ids, using=self.using)
+        if self.client_ids or self.user_ids:
+            rollups.refresh(self.client_ids, self.user_ids, using=self.using)
+        fragments.bump(*self.user_ids)
+
+
+def schedule_refresh(using=DEFAULT_DB_ALIAS, **changed):
+    """Refresh data derived from the changed rows once the transaction commits
+
+    Outside of a transaction the refresh happens straight away.
+    """
+    connection = transaction.get_connection(using)
+    pending = getattr(connection, "pending_invoice_changes", None)
+    if pending is None or pending.flushed:
+        pending = connection.pending_invoice_changes = _PendingChanges(using)
+    pending.add(**changed)
+    # Rolling back a savepoint or the whole transaction discards the callbacks
+    # registered inside it, so each change registers the batch again: whichever
+    # registrations survive flush everything collected. Ids left over from a
+    # rolled back transaction are flushed with the next batch, which is
+    # harmless since the derived data is recomputed from scratch.
+    transaction.on_commit(pending, using=using)
+
+
+@receiver(pre_save, sender=Invoice)
+def assign_invoice_number(sender, instance, using, raw=False, **kwargs):
+    if instance.number is None and instance.user_id is not None and not raw:
+        (instance.number,) = numbering.allocate(instance.user_id, using=using)
 
 
 @receiver(post_save, sender=InvoiceItem)
-def set_invoice_total(sender, instance, **kwargs):
-    total = instance.invoice.items.aggregate(
-        invoice_total=Sum(F("quantity") * F("rate"))
-    ).get("invoice_total", 0)
-    if total:
-        Invoice.objects.filter(pk=instance.invoice.pk).update(invoice_total=total)
+@receiver(post_delete, sender=InvoiceItem)
+def set_invoice_total(sender, instance, using, **kwargs):
+    schedule_refresh(using, invoice_id=instance.invoice_id)
+
+
+@receiver(post_init, sender=Invoice)
+def remember_invoice_client(sender, instance, **kwargs):
+    # Read from __dict__ so a deferred client_id doesn't trigger a query
+    instance._loaded_client_id = instance.__dict__.get("client_id")
 
 
 @receiver(post_save, sender=Invoice)
-def set_invoiceitem_total(sender, instance, **kwargs):
-    if len(instance.items.all()) > 0:
-        total = instance.items.aggregate(
-            invoice_total=Sum(F("quantity") * F("rate"))
-        ).get("invoice_total", 0)
-        if total:
-            Invoice.objects.filter(pk=instance.pk).update(invoice_total=total)
+def set_invoiceitem_total(sender, instance, created, using, **kwargs):
+    # Saving an invoice writes back whatever total the instance was loaded
+    # with, which may be stale by now, and changes its client's rollups
+    schedule_refresh(using, invoice_id=instance.pk)
+    loaded_client_id = getattr(instance, "_loaded_client_id", None)
+    if loaded_client_id not in (None, instance.client_id):
+        # Moved to another client, whose rollups lose this invoice
+        schedule_refresh(using, client_id=loaded_client_id)
+    instance._loaded_client_id = instance.client_id
+
+
+@receiver(post_delete, sender=Invoice)
+def update_rollups_on_delete(sender, instance, using, **kwargs):
+    schedule_refresh(
+        using,
+        invoice_id=instance.pk,
+        client_id=instance.client_id,
+        user_id=instance.user_id,
+    )
+
+
+@receiver(post_save, sender=Client)
+@receiver(post_delete, sender=Client)
+def invalidate_client_fragments(sender, instance, using, **kwargs):
+    # Client names appear in the invoice tables and search documents,
+    # rollups are unaffected
+    client_id, user_id = instance.pk, instance.created_by_id
+
+    def refresh():
+        search.index_clients([client_id], using=using)
+        fragments.bump(user_id)
+
+    transaction.on_commit(refresh, using=using)
+
+
+@receiver(post_save, sender=Invoice)
+@receiver(post_delete, sender=Invoice)
+def invalidate_invoice_pdf(sender, instance, **kwargs):
+    pdf_cache.invalidate(instance.pk)
+
+
+@receiver(post_save, sender=InvoiceItem)
+@receiver(post_delete, sender=InvoiceItem)
+def invalidate_invoiceitem_pdf(sender, instance, **kwargs):
+    pdf_cache.invalidate(instance.invoice_id)
+
+
+@receiver(post_save, sender=Client)
+def invalidate_client_pdfs(sender, instance, created, **kwargs):
+    if not created:
+        invoices = Invoice.objects.filter(client=instance)
+        pdf_cache.invalidate(*invoices.values_list("pk", flat=True))
+        # Client details are printed on the invoice, so its ETag changes too
+        invoices.touch()
+        ArchivedInvoice.objects.filter(client=instance).touch()
+
+
+@receiver(post_save, sender=get_user_model())
+def invalidate_user_pdfs(sender, instance, created, update_fields=None, **kwargs):
+    if created:
+        # A reused primary key mustn't pick up a deleted user's fragments, or
+        # invoice numbers
+        fragments.bump(instance.pk)
+        numbering.forget(instance.pk)
+        return
+    # Logging in saves last_login only, which never appears on an invoice
+    if update_fields and not set(update_fields) & set(pdf_cache.USER_PROFILE_FIELDS):
+        return
+    invoices = Invoice.objects.filter(user=instance)
+    pdf_cache.invalidate(*invoices.values_list("pk", flat=True))
+    invoices.touch()
+    ArchivedInvoice.objects.filter(user=instance).touch()
@@ -0,0 +1,77 @@
+import zipfile
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+
+_END = object()
+
+
+class _StreamBuffer:
+    """Write-only file object that collects bytes until they are popped
+
+    It can tell() but not seek(), so zipfile writes data descriptors after
+    each member instead of rewinding to patch local headers.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def zip_stream(members, compression=zipfile.ZIP_DEFLATED):
+    """Yield a ZIP archive chunk by chunk
+
+    `members` is an iterable of (name, chunks) pairs where chunks is an
+    iterable of bytes. Nothing but the chunk being written is held in memory,
+    so the archive can be sent while its members are still being produced.
+    """
+    buffer = _StreamBuffer()
+    with zipfile.ZipFile(buffer, mode="w", compression=compression) as archive:
+        for name, chunks in members:
+            with archive.open(name, mode="w", force_zip64=True) as member:
+                for chunk in chunks:
+                    member.write(chunk)
+                    data = buffer.pop()
+                    if data:
+                        yield data
+            yield buffer.pop()
+    yield buffer.pop()
+
+
+async def _aiterate(chunks):
+    # Each chunk is produced in Django's sync thread, where the iterator's
+    # database cursor lives
+    chunks = iter(chunks)
+    while True:
+        chunk = await sync_to_async(next)(chunks, _END)
+        if chunk is _END:
+            break
+        yield chunk
+
+
+def streaming_response(request, chunks, **kwargs):
+    """StreamingHttpResponse that streams under both WSGI and ASGI
+
+    Under ASGI Django reads a synchronous iterator into memory in full
+    before sending any of it, so it's wrapped in an asynchronous one there.
+    """
+    if isinstance(request, ASGIRequest):
+        chunks = _aiterate(chunks)
+    return StreamingHttpResponse(chunks, **kwargs)
@@ -0,0 +1,246 @@
+"""
+Flat CSV and XLSX exports of invoices and their line items.
+
+Rows are read with a cursor in chunks and written out as they arrive, so an
+export holds one chunk of rows and one buffer of output in memory however
+many line items it covers, and the first bytes go out straight away.
+"""
+
+import csv
+import datetime
+import io
+import itertools
+import re
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+from .models import Invoice
+from .streaming import zip_stream
+
+# (header, Invoice.values_list() lookup) for each column. Reading values
+# instead of models joins the client the way select_related would, without
+# building two model instances per row.
+EXPORT_COLUMNS = (
+    ("invoice_id", "pk"),
+    ("invoice_title", "title"),
+    ("invoice_date", "create_date"),
+    ("invoice_total", "invoice_total"),
+    ("client_first_name", "client__first_name"),
+    ("client_last_name", "client__last_name"),
+    ("client_company", "client__company"),
+    ("client_email", "client__email"),
+    ("client_country", "client__country"),
+    ("item_id", "items__pk"),
+    ("item", "items__item"),
+    ("quantity", "items__quantity"),
+    ("rate", "items__rate"),
+    ("tax", "items__tax"),
+)
+HEADERS = [header for header, _ in EXPORT_COLUMNS] + ["subtotal"]
+
+CHUNK_SIZE = 2000
+# Output is sent in pieces of about this many bytes
+BUFFER_SIZE = 64 * 1024
+
+
+def export_rows(invoices=None, chunk_size=CHUNK_SIZE):
+    """Yield one tuple per line item, in HEADERS order
+
+    Invoices without items get a single row with empty item columns.
+    """
+    if invoices is None:
+        invoices = Invoice.objects.all()
+    rows = (
+        invoices.order_by("pk", "items__pk")
+        .values_list(*[lookup for _, lookup in EXPORT_COLUMNS])
+        .iterator(chunk_size=chunk_size)
+    )
+    for row in rows:
+        quantity, rate = row[-3], row[-2]
+        subtotal = quantity * rate if quantity is not None else None
+        yield row + (subtotal,)
+
+
+def csv_stream(rows):
+    """Yield CSV encoded `rows`, headers first, in BUFFER_SIZE pieces"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(HEADERS)
+    # Flush the headers at once so the download starts before the query ends
+    yield buffer.getvalue().encode()
+    buffer.seek(0)
+    buffer.truncate()
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= BUFFER_SIZE:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode()
+
+
+# Minimal SpreadsheetML package. Strings are written inline rather than to a
+# shared strings table, which would need every string before the sheet. A
+# sheet holds at most XLSX_MAX_ROWS rows, so longer exports go on as many
+# sheets as they need, and the parts listing the sheets are written last.
+XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+SPREADSHEETML = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+PACKAGE = "http://schemas.openxmlformats.org/package/2006"
+RELATIONSHIPS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml"
+# Excel's limit, headers included
+XLSX_MAX_ROWS = 1_048_576
+
+
+def _xlsx_content_types(sheets):
+    sheet_types = "".join(
+        f'<Override PartName="/xl/worksheets/sheet{n}.xml" '
+        f'ContentType="{CONTENT_TYPE}.worksheet+xml"/>'
+        for n in range(1, sheets + 1)
+    )
+    return (
+        XML_DECLARATION + f'<Types xmlns="{PACKAGE}/content-types">'
+        '<Default Extension="rels" '
+        'ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        f'ContentType="{CONTENT_TYPE}.sheet.main+xml"/>'
+        f"{sheet_types}"
+        '<Override PartName="/xl/styles.xml" '
+        f'ContentType="{CONTENT_TYPE}.styles+xml"/>'
+        "</Types>"
+    )
+
+
+XLSX_ROOT_RELS = (
+    XML_DECLARATION + f'<Relationships xmlns="{PACKAGE}/relationships">'
+    f'<Relationship Id="rId1" Type="{RELATIONSHIPS}/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    "</Relationships>"
+)
+
+
+def _xlsx_sheet_name(n):
+    return "Invoices" if n == 1 else f"Invoices {n}"
+
+
+def _xlsx_workbook(sheets):
+    sheet_list = "".join(
+        f'<sheet name="{_xlsx_sheet_name(n)}" sheetId="{n}" r:id="rId{n}"/>'
+        for n in range(1, sheets + 1)
+    )
+    workbook = f'<workbook xmlns="{SPREADSHEETML}" xmlns:r="{RELATIONSHIPS}">'
+    return f"{XML_DECLARATION}{workbook}<sheets>{sheet_list}</sheets></workbook>"
+
+
+def _xlsx_workbook_rels(sheets):
+    # Sheet n is rId<n>, the styles come after them
+    sheet_rels = "".join(
+        f'<Relationship Id="rId{n}" Type="{RELATIONSHIPS}/worksheet" '
+        f'Target="worksheets/sheet{n}.xml"/>'
+        for n in range(1, sheets + 1)
+    )
+    return (
+        XML_DECLARATION + f'<Relationships xmlns="{PACKAGE}/relationships">'
+        f"{sheet_rels}"
+        f'<Relationship Id="rId{sheets + 1}" Type="{RELATIONSHIPS}/styles" '
+        'Target="styles.xml"/>'
+        "</Relationships>"
+    )
+
+
+# Cell style 1 shows date serial numbers as dates
+XLSX_STYLES = (
+    XML_DECLARATION + f'<styleSheet xmlns="{SPREADSHEETML}">'
+    '<fonts count="1"><font/></fonts>'
+    '<fills count="1"><fill/></fills>'
+    '<borders count="1"><border/></borders>'
+    '<cellStyleXfs count="1"><xf/></cellStyleXfs>'
+    '<cellXfs count="2"><xf/><xf numFmtId="14" applyNumberFormat="1"/></cellXfs>'
+    "</styleSheet>"
+)
+
+XLSX_SHEET_START = XML_DECLARATION + f'<worksheet xmlns="{SPREADSHEETML}"><sheetData>'
+XLSX_SHEET_END = "</sheetData></worksheet>"
+
+EXCEL_EPOCH = datetime.date(1899, 12, 30)
+# Characters XML 1.0 can't represent at all
+_ILLEGAL_XML = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+def _xlsx_cell(value):
+    if value is None:
+        return "<c/>"
+    if isinstance(value, datetime.date):
+        return f'<c s="1"><v>{(value - EXCEL_EPOCH).days}</v></c>'
+    if isinstance(value, (int, float, Decimal)) and not isinstance(value, bool):
+        return f"<c><v>{value}</v></c>"
+    text = escape(_ILLEGAL_XML.sub("", str(value)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _xlsx_sheet(rows):
+    yield (XLSX_SHEET_START + _xlsx_row(HEADERS)).encode()
+    pending = []
+    size = 0
+    for row in rows:
+        line = _xlsx_row(row)
+        pending.append(line)
+        size += len(line)
+        if size >= BUFFER_SIZE:
+            yield "".join(pending).encode()
+            pending.clear()
+            size = 0
+    pending.append(XLSX_SHEET_END)
+    yield "".join(pending).encode()
+
+
+def _xlsx_row(values):
+    return "<row>" + "".join(_xlsx_cell(value) for value in values) + "</row>"
+
+
+def _xlsx_sheets(rows, max_rows):
+    rows = iter(rows)
+    sheet = 1
+    while True:
+        yield f"xl/worksheets/sheet{sheet}.xml", _xlsx_sheet(
+            itertools.islice(rows, max_rows - 1)
+        )
+        # zip_stream() has written the sheet out by the time it asks for the
+        # next one, so whatever is left goes on a new sheet
+        row = next(rows, None)
+        if row is None:
+            return
+        rows = itertools.chain([row], rows)
+        sheet += 1
+
+
+def xlsx_stream(rows, max_rows=XLSX_MAX_ROWS):
+    """Yield an XLSX workbook of `rows`, headers first, as it's written
+
+    Every sheet starts with the headers and holds up to `max_rows` rows.
+    """
+
+    def members():
+        sheets = 0
+        for member in _xlsx_sheets(rows, max_rows):
+            sheets += 1
+            yield member
+        yield "[Content_Types].xml", [_xlsx_content_types(sheets).encode()]
+        yield "_rels/.rels", [XLSX_ROOT_RELS.encode()]
+        yield "xl/workbook.xml", [_xlsx_workbook(sheets).encode()]
+        yield "xl/_rels/workbook.xml.rels", [_xlsx_workbook_rels(sheets).encode()]
+        yield "xl/styles.xml", [XLSX_STYLES.encode()]
+
+    return zip_stream(members())
+
+
+# format: (stream, content type, file extension)
+FORMATS = {
+    "csv": (csv_stream, "text/csv", "csv"),
+    "xlsx": (
+        xlsx_stream,
+        f"{CONTENT_TYPE}.sheet",
+        "xlsx",
+    ),
+}
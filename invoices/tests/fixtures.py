@@ -0,0 +1,45 @@
+import shutil
+import tempfile
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import override_settings
+
+from invoices.models import Client
+
+
+def create_user(username="testuser", **extra):
+    extra.setdefault("email", "test@email.com")
+    extra.setdefault("password", "secretpassword")
+    return get_user_model().objects.create_user(username=username, **extra)
+
+
+def create_client(user, **extra):
+    fields = {
+        "first_name": "Test",
+        "last_name": "Client",
+        "email": "test@example.com",
+        "company": "Xcorp",
+        "address1": "1234 Paradise Lane",
+        "address2": "Good Street",
+        "country": "Zimbabwe",
+    }
+    fields.update(extra)
+    return Client.objects.create(created_by=user, **fields)
+
+
+class PdfCacheMixin:
+    """Give every test its own PDF_CACHE_DIR so cached PDFs never leak."""
+
+    def setUp(self):
+        super().setUp()
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir, ignore_errors=True)
+        settings_override = override_settings(PDF_CACHE_DIR=self.cache_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def patch_render(self, **kwargs):
+        render_patch = mock.patch("invoices.pdf_cache.render_invoice_pdf", **kwargs)
+        self.addCleanup(render_patch.stop)
+        return render_patch.start()
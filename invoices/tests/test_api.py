@@ -0,0 +1,195 @@
+import base64
+import json
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.models.signals import post_delete
+from django.test import Client as HttpClient
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from invoices import search
+from invoices.models import Client, Invoice, InvoiceItem, RevenueRollup
+from invoices.tests.fixtures import create_client, create_user
+
+
+class ApiTests(TestCase):
+    def setUp(self):
+        self.user = create_user()
+        credentials = base64.b64encode(b"testuser:secretpassword").decode()
+        self.auth = {"HTTP_AUTHORIZATION": f"Basic {credentials}"}
+        self.customer = create_client(self.user)
+
+    def post(self, url, data, **extra):
+        return self.client.post(
+            url, json.dumps(data), content_type="application/json", **extra
+        )
+
+    def record(self, n, **fields):
+        return {
+            "title": f"Invoice {n}",
+            "client": self.customer.pk,
+            "items": [
+                {"item": "Design", "quantity": 2, "rate": "10.00"},
+                {"item": "Hosting", "quantity": 1, "rate": "5.50", "tax": "1.00"},
+            ],
+            **fields,
+        }
+
+    def batch(self, records):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.post(
+                reverse("api-invoice-batch"), {"invoices": records}, **self.auth
+            )
+
+    def test_batch_creates_invoices_with_bulk_queries(self):
+        with CaptureQueriesContext(connection) as few:
+            self.batch([self.record(n) for n in range(5)])
+        with CaptureQueriesContext(connection) as many:
+            response = self.batch([self.record(n) for n in range(200)])
+
+        self.assertEqual(response.status_code, 200)
+        results = response.json()["results"]
+        self.assertEqual([result["index"] for result in results], list(range(200)))
+        self.assertEqual({result["status"] for result in results}, {"created"})
+        invoice = Invoice.objects.get(pk=results[0]["id"])
+        self.assertEqual(invoice.invoice_total, 25.5)
+        self.assertEqual(invoice.item_count, 2)
+        self.assertEqual(Invoice.objects.count(), 205)
+        self.assertEqual(
+            RevenueRollup.objects.get(client=self.customer, month=None).invoice_count,
+            205,
+        )
+        self.assertEqual(len(search.search(self.user, "hosting", limit=1000)), 205)
+        # 40x the rows only adds INSERT statements, each of a hundred or more
+        self.assertLess(len(many), len(few) + 5)
+
+    def test_invalid_records_save_nothing(self):
+        other_user = get_user_model().objects.create_user(username="other")
+        other_client = Client.objects.create(
+            first_name="Other", last_name="Client", created_by=other_user
+        )
+        response = self.batch(
+            [
+                self.record(0),
+                self.record(1, client=other_client.pk),
+                self.record(2, items=[{"item": "Bad", "quantity": "x", "rate": 1}]),
+                {"id": 999999},
+            ]
+        )
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()["errors"]
+        self.assertEqual([error["index"] for error in errors], [1, 2, 3])
+        self.assertIn("client", errors[0]["errors"])
+        self.assertIn("quantity", errors[1]["errors"]["items"]["0"])
+        self.assertFalse(Invoice.objects.exists())
+
+    def test_batch_updates_invoices(self):
+        created = self.batch([self.record(0), self.record(1)]).json()["results"]
+        response = self.batch(
+            [
+                {"id": created[0]["id"], "title": "Renamed"},
+                {
+                    "id": created[1]["id"],
+                    "items": [{"item": "Audit", "quantity": 3, "rate": "100"}],
+                },
+                self.record(2),
+            ]
+        )
+        self.assertEqual(
+            [result["status"] for result in response.json()["results"]],
+            ["updated", "updated", "created"],
+        )
+        renamed = Invoice.objects.get(pk=created[0]["id"])
+        self.assertEqual(renamed.title, "Renamed")
+        self.assertEqual(renamed.items.count(), 2)
+        replaced = Invoice.objects.get(pk=created[1]["id"])
+        self.assertEqual(list(replaced.items.values_list("item", flat=True)), ["Audit"])
+        self.assertEqual(replaced.invoice_total, 300)
+        self.assertEqual(search.search(self.user, "audit"), [("invoice", replaced.pk)])
+
+    def test_replacing_items_sends_no_signals(self):
+        items = [{"item": f"Line {n}", "quantity": 1, "rate": "1"} for n in range(20)]
+        (created,) = self.batch([self.record(0, items=items)]).json()["results"]
+
+        deleted = []
+
+        def count_deletes(sender, instance, **kwargs):
+            deleted.append(instance)
+
+        post_delete.connect(count_deletes, sender=InvoiceItem)
+        self.addCleanup(post_delete.disconnect, count_deletes, sender=InvoiceItem)
+        with mock.patch("invoices.pdf_cache.invalidate") as invalidate:
+            response = self.batch([{"id": created["id"], "items": items[:1]}])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(deleted, [])
+        invalidate.assert_called_once_with(created["id"])
+        self.assertEqual(Invoice.objects.get(pk=created["id"]).invoice_total, 1)
+
+    def test_single_invoice_endpoints(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.post(reverse("api-invoices"), self.record(0), **self.auth)
+        self.assertEqual(response.status_code, 201)
+        invoice = response.json()
+        self.assertEqual(invoice["invoice_total"], "25.50")
+        self.assertEqual(len(invoice["items"]), 2)
+
+        url = reverse("api-invoice-detail", args=[invoice["id"]])
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(
+                url, {"title": "Patched"}, content_type="application/json", **self.auth
+            )
+        self.assertEqual(response.json()["title"], "Patched")
+
+        listed = self.client.get(reverse("api-invoices"), **self.auth).json()
+        self.assertEqual([row["id"] for row in listed["results"]], [invoice["id"]])
+        self.assertIsNone(listed["next"])
+
+        response = self.client.delete(url, **self.auth)
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(Invoice.objects.exists())
+
+    def test_clients(self):
+        response = self.post(
+            reverse("api-clients"),
+            {
+                "first_name": "New",
+                "last_name": "Client",
+                "email": "new@example.com",
+                "company": "Ycorp",
+                "address1": "1 Main Street",
+                "address2": "Suite 2",
+                "country": "Kenya",
+            },
+            **self.auth,
+        )
+        self.assertEqual(response.status_code, 201)
+        client = Client.objects.get(pk=response.json()["id"])
+        self.assertEqual(client.created_by, self.user)
+        response = self.post(reverse("api-clients"), {"email": "nope"}, **self.auth)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("email", response.json()["errors"])
+
+    def test_authentication(self):
+        response = self.client.get(reverse("api-invoices"))
+        self.assertEqual(response.status_code, 401)
+        self.assertIn("Basic", response["WWW-Authenticate"])
+        bad = base64.b64encode(b"testuser:wrong").decode()
+        response = self.client.get(
+            reverse("api-invoices"), HTTP_AUTHORIZATION=f"Basic {bad}"
+        )
+        self.assertEqual(response.status_code, 401)
+
+    def test_session_writes_need_csrf_token(self):
+        browser = HttpClient(enforce_csrf_checks=True)
+        browser.force_login(self.user)
+        self.assertEqual(browser.get(reverse("api-invoices")).status_code, 200)
+        response = browser.post(
+            reverse("api-invoice-batch"),
+            json.dumps({"invoices": [self.record(0)]}),
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(Invoice.objects.exists())
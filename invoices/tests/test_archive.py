@@ -0,0 +1,184 @@
+import datetime
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db.models.signals import post_delete
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from invoices import archive, search
+from invoices.models import (
+    ArchivedInvoice,
+    Invoice,
+    InvoiceItem,
+    OutboundEmail,
+    RevenueRollup,
+)
+from invoices.tests.fixtures import PdfCacheMixin, create_client, create_user
+
+
+@override_settings(PDF_EXPORT_PROCESSES=0)
+class ArchiveTests(PdfCacheMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_user()
+        self.client.force_login(self.user)
+        self.customer = create_client(self.user)
+        self.today = timezone.localdate()
+        self.old = self.create_invoice(
+            "Old invoice", datetime.date(2020, 3, 14), ("Design", 10), ("Audit", 5)
+        )
+        self.recent = self.create_invoice("Recent invoice", self.today, ("Hosting", 7))
+
+    def create_invoice(self, title, date, *items):
+        with self.captureOnCommitCallbacks(execute=True):
+            invoice = Invoice.objects.create(
+                title=title, user=self.user, client=self.customer
+            )
+            Invoice.objects.filter(pk=invoice.pk).update(create_date=date)
+            for item, rate in items:
+                InvoiceItem.objects.create(
+                    invoice=invoice, item=item, quantity=2, rate=rate, tax=1
+                )
+        return Invoice.objects.get(pk=invoice.pk)
+
+    def archive(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return archive.archive(self.today - datetime.timedelta(days=365))
+
+    def rollups(self):
+        return sorted(
+            RevenueRollup.objects.values_list(
+                "client_id", "month", "invoice_count", "revenue", "first_invoice_date"
+            ),
+            key=str,
+        )
+
+    def test_old_invoices_leave_the_hot_tables(self):
+        rollups = self.rollups()
+        self.assertEqual(self.archive(), 1)
+
+        self.assertEqual(list(Invoice.objects.all()), [self.recent])
+        self.assertEqual(InvoiceItem.objects.count(), 1)
+        archived = ArchivedInvoice.objects.get()
+        self.assertEqual(archived.pk, self.old.pk)
+        self.assertEqual(archived.invoice_total, 30)
+        self.assertEqual(archived.create_date, datetime.date(2020, 3, 14))
+        # Still counted
+        self.assertEqual(self.rollups(), rollups)
+        self.assertEqual(search.search(self.user, "design"), [])
+        self.assertEqual(self.archive(), 0)
+
+    def test_archived_invoice_loads_as_it_was(self):
+        self.archive()
+        invoice = archive.load(ArchivedInvoice.objects.get())
+        self.assertEqual(invoice.pk, self.old.pk)
+        self.assertEqual(invoice.title, "Old invoice")
+        self.assertEqual(invoice.updated_at, self.old.updated_at)
+        self.assertEqual(invoice.client, self.customer)
+        self.assertEqual(
+            [(item.item, item.subtotal(), item.tax) for item in invoice.archived_items],
+            [("Design", 20, 1), ("Audit", 10, 1)],
+        )
+        self.assertIs(invoice.archived_items[0].invoice, invoice)
+
+    def test_email_history_is_kept(self):
+        OutboundEmail.objects.create(
+            invoice=self.old,
+            to="test@example.com",
+            status=OutboundEmail.SENT,
+            attempts=1,
+            sent_at=timezone.now(),
+        )
+        unsent = self.create_invoice("Unsent invoice", datetime.date(2020, 4, 1))
+        OutboundEmail.objects.create(
+            invoice=unsent, to="test@example.com", status=OutboundEmail.SENDING
+        )
+        self.assertEqual(self.archive(), 1)
+
+        (email,) = archive.load(ArchivedInvoice.objects.get()).archived_emails
+        self.assertEqual(
+            (email.to, email.status, email.attempts),
+            ("test@example.com", OutboundEmail.SENT, 1),
+        )
+        # Still with the sender, until it is done with it
+        self.assertTrue(Invoice.objects.filter(pk=unsent.pk).exists())
+        self.assertEqual(OutboundEmail.objects.get().invoice_id, unsent.pk)
+
+    def test_items_leave_without_their_signals(self):
+        deleted = []
+
+        def count_deletes(sender, instance, **kwargs):
+            deleted.append(instance)
+
+        post_delete.connect(count_deletes, sender=InvoiceItem)
+        self.addCleanup(post_delete.disconnect, count_deletes, sender=InvoiceItem)
+        with mock.patch("invoices.pdf_cache.invalidate") as invalidate:
+            self.archive()
+        self.assertEqual(deleted, [])
+        invalidate.assert_called_once_with(self.old.pk)
+
+    def test_archived_invoices_stay_viewable(self):
+        self.archive()
+        url = reverse("invoice-detail", args=[self.old.pk])
+        response = self.client.get(url)
+        self.assertContains(response, "Old invoice")
+        self.assertContains(response, "Audit")
+        self.assertContains(response, "Archived")
+        self.assertNotContains(response, reverse("invoice-edit", args=[self.old.pk]))
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304
+        )
+
+        with mock.patch(
+            "invoices.pdf_cache.render_invoice_pdf", return_value=b"%PDF archived"
+        ) as render:
+            response = self.client.get(reverse("generate_pdf", args=[self.old.pk]))
+        self.assertEqual(response.content, b"%PDF archived")
+        invoice, invoice_items = render.call_args.args
+        self.assertEqual([item.item for item in invoice_items], ["Design", "Audit"])
+
+        response = self.client.get(reverse("invoice-archive"))
+        self.assertContains(response, url)
+        self.assertNotContains(
+            response, reverse("invoice-detail", args=[self.recent.pk])
+        )
+
+        other_user = get_user_model().objects.create_user(username="other")
+        self.client.force_login(other_user)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_client_and_profile_edits_change_archived_etags(self):
+        self.archive()
+        urls = [
+            reverse("invoice-detail", args=[self.old.pk]),
+            reverse("generate_pdf", args=[self.old.pk]),
+        ]
+        self.patch_render(return_value=b"%PDF archived")
+        etags = [self.client.get(url)["ETag"] for url in urls]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.customer.company = "Renamed corp"
+            self.customer.save()
+        responses = [
+            self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            for url, etag in zip(urls, etags)
+        ]
+        self.assertEqual([response.status_code for response in responses], [200] * 2)
+        self.assertContains(responses[0], "Renamed corp")
+        etags = [response["ETag"] for response in responses]
+
+        self.user.company = "Renamed issuer"
+        self.user.save()
+        for url, etag in zip(urls, etags):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+
+    def test_command(self):
+        out = StringIO()
+        call_command("archive_invoices", days=30, stdout=out)
+        self.assertIn("Archived 1 invoices", out.getvalue())
+        self.assertTrue(ArchivedInvoice.objects.filter(pk=self.old.pk).exists())
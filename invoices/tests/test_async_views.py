@@ -0,0 +1,70 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import AsyncClient, TestCase, override_settings
+from django.urls import reverse
+
+from invoices.models import Invoice, InvoiceItem
+from invoices.tests.fixtures import PdfCacheMixin, create_client, create_user
+
+
+@override_settings(PDF_EXPORT_PROCESSES=0)
+class AsyncViewTests(PdfCacheMixin, TestCase):
+    """The list and detail views served through the ASGI handler, where any
+    synchronous query on the event loop raises SynchronousOnlyOperation"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = create_user()
+        self.client1 = create_client(self.user)
+        self.invoice = Invoice.objects.create(
+            title="Async invoice", user=self.user, client=self.client1
+        )
+        InvoiceItem.objects.create(
+            invoice=self.invoice, item="Line", quantity=2, rate=10
+        )
+        self.async_client = AsyncClient()
+        self.async_client.force_login(self.user)
+
+    async def test_pages(self):
+        urls = [
+            reverse("home"),
+            reverse("invoice-list"),
+            reverse("invoice-detail", args=[self.invoice.pk]),
+            reverse("client-list"),
+            reverse("client-detail", args=[self.client1.pk]),
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                response = await self.async_client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertContains(response, "Client")
+
+    async def test_login_required(self):
+        response = await AsyncClient().get(reverse("invoice-list"))
+        self.assertRedirects(
+            response,
+            reverse("login") + "?next=" + reverse("invoice-list"),
+            fetch_redirect_response=False,
+        )
+
+    async def test_other_users_invoices_are_not_found(self):
+        other = await get_user_model().objects.acreate(username="other")
+        invoice = await Invoice.objects.acreate(
+            title="Not yours", user=other, client=self.client1
+        )
+        response = await self.async_client.get(
+            reverse("invoice-detail", args=[invoice.pk])
+        )
+        self.assertEqual(response.status_code, 404)
+
+    async def test_pdf_is_rendered_off_the_event_loop(self):
+        with mock.patch(
+            "invoices.pdf_cache.render_invoice_pdf", return_value=b"%PDF async"
+        ) as render:
+            url = reverse("generate_pdf", args=[self.invoice.pk])
+            response = await self.async_client.get(url)
+            self.assertEqual(response.content, b"%PDF async")
+            response = await self.async_client.get(url)
+        self.assertEqual(response.content, b"%PDF async")
+        render.assert_called_once()
@@ -0,0 +1,146 @@
+import datetime
+import io
+import json
+import tempfile
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from invoices import fragments, search
+from invoices.management.commands import benchmark, benchmark_search
+from invoices.models import Client, Invoice, InvoiceItem
+from invoices.tests.fixtures import PdfCacheMixin, create_client, create_user
+
+CSV_IMPORT = """invoice_ref,title,create_date,client_email,client_first_name,\
+client_last_name,client_company,item,quantity,rate
+1,Website,2018-03-01,test@example.com,Test,Client,Xcorp,Design,10,50.00
+1,Website,2018-03-01,test@example.com,Test,Client,Xcorp,Hosting,1,20.00
+2,Logo,2018-04-01,new@example.com,New,Client,Ycorp,Logo,2,100.00
+3,Support,,new@example.com,New,Client,Ycorp,Support,3,25.50
+"""
+
+
+class ImportInvoicesTests(TestCase):
+    def setUp(self):
+        self.user = create_user()
+        self.client1 = create_client(self.user)
+
+    def import_file(self, content, suffix):
+        with tempfile.NamedTemporaryFile("w", suffix=suffix) as f:
+            f.write(content)
+            f.flush()
+            call_command(
+                "import_invoices",
+                f.name,
+                user="testuser",
+                batch_size=2,
+                stdout=io.StringIO(),
+            )
+
+    def test_import_csv(self):
+        self.import_file(CSV_IMPORT, ".csv")
+
+        website = Invoice.objects.get(title="Website")
+        self.assertEqual(website.client, self.client1)
+        self.assertEqual(website.create_date, datetime.date(2018, 3, 1))
+        self.assertEqual(website.invoice_total, 520)
+        self.assertEqual(website.items.count(), 2)
+
+        new_client = Client.objects.get(email="new@example.com")
+        self.assertEqual(new_client.created_by, self.user)
+        self.assertEqual(
+            set(new_client.invoice_set.values_list("title", flat=True)),
+            {"Logo", "Support"},
+        )
+        self.assertEqual(Invoice.objects.get(title="Support").invoice_total, 76.5)
+        self.assertEqual(Client.objects.count(), 2)
+        self.assertIn(("client", new_client.pk), search.search(self.user, "ycorp"))
+        self.assertEqual(search.search(self.user, "hosting"), [("invoice", website.pk)])
+
+    def test_import_replaces_cached_tables(self):
+        version = fragments.get_version(self.user.pk)
+        self.import_file(CSV_IMPORT, ".csv")
+        self.assertNotEqual(fragments.get_version(self.user.pk), version)
+
+    def test_import_jsonl(self):
+        record = {
+            "title": "Consulting",
+            "create_date": "2017-06-30",
+            "client": {"email": "test@example.com"},
+            "items": [{"item": "Hours", "quantity": 4, "rate": "90.00"}],
+        }
+        self.import_file(json.dumps(record) + "\n", ".jsonl")
+
+        invoice = Invoice.objects.get(title="Consulting")
+        self.assertEqual(invoice.client, self.client1)
+        self.assertEqual(invoice.invoice_total, 360)
+        self.assertEqual(InvoiceItem.objects.filter(invoice=invoice).count(), 1)
+
+
+@override_settings(PDF_EXPORT_PROCESSES=0)
+class BenchmarkTests(PdfCacheMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.patch_render(return_value=b"%PDF")
+
+    def test_seed(self):
+        users = benchmark.seed(users=2, clients=3, invoices=2, items=4)
+        self.assertEqual(len(users), 2)
+        invoices = Invoice.objects.filter(user=users[0])
+        self.assertEqual(invoices.count(), 6)
+        self.assertEqual(InvoiceItem.objects.filter(invoice__in=invoices).count(), 24)
+
+    def test_every_route_is_measured(self):
+        (user,) = benchmark.seed(users=1, clients=1, invoices=2, items=1)
+        results = benchmark.run_benchmark(user, requests=2)
+        self.assertIn("GET generate_pdf", results)
+        self.assertIn("POST invoice-edit", results)
+        for route, metrics in results.items():
+            with self.subTest(route=route):
+                self.assertLess(metrics["status"], 400)
+                self.assertLessEqual(metrics["p50_ms"], metrics["p99_ms"])
+                self.assertGreater(metrics["queries"], 0)
+
+    def test_search_timings_only_count_own_documents(self):
+        users = benchmark.seed(users=3, clients=2, invoices=3, items=0)
+        search.rebuild()
+        metrics = benchmark_search.time_searches(users[1], "invoice", runs=2)
+        self.assertEqual(metrics["hits"], 6)
+        self.assertLessEqual(metrics["p50_ms"], metrics["max_ms"])
+
+    def test_pdf_benchmark_compares_warm_and_cold_renders(self):
+        out = io.StringIO()
+        call_command(
+            "benchmark_pdf", items=[1], runs=1, processes=1, json=True, stdout=out
+        )
+        warm, cold = json.loads(out.getvalue())
+        self.assertEqual((warm["renderer"], cold["renderer"]), ("warm", "cold"))
+        self.assertEqual((warm["items"], warm["processes"], warm["runs"]), (1, 1, 1))
+        self.assertGreater(warm["cold_speedup"], 0)
+        self.assertGreater(cold["peak_rss_kb"], 0)
+
+    def test_compare_flags_regressions(self):
+        baseline = {"GET home": {"p50_ms": 10.0, "queries": 3}}
+        results = {
+            "GET home": {
+                "p50_ms": 10.5,
+                "p95_ms": 20.0,
+                "p99_ms": 30.0,
+                "queries": 4,
+                "peak_memory_kb": 50.0,
+            }
+        }
+        diff = benchmark.compare(results, baseline, threshold=10)
+        self.assertEqual(set(diff["GET home"]), {"p50_ms", "queries"})
+        self.assertFalse(diff["GET home"]["p50_ms"]["regression"])
+        self.assertTrue(diff["GET home"]["queries"]["regression"])
+
+
+class ExportInvoicesTests(TestCase):
+    def test_export_csv(self):
+        benchmark.seed(users=1, clients=2, invoices=2, items=3)
+        with tempfile.NamedTemporaryFile(suffix=".csv") as f:
+            call_command("export_invoices", f.name, stdout=io.StringIO())
+            lines = f.read().decode().splitlines()
+        self.assertEqual(lines[0].split(",")[:2], ["invoice_id", "invoice_title"])
+        self.assertEqual(len(lines), 1 + 2 * 2 * 3)
@@ -0,0 +1,108 @@
+from unittest import mock
+
+from django.conf import settings
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils.crypto import get_random_string
+
+from invoices import views
+from invoices.models import Invoice, InvoiceItem
+from invoices.tests.fixtures import PdfCacheMixin, create_client, create_user
+
+
+@override_settings(PDF_EXPORT_PROCESSES=0)
+class ConditionalGetTests(PdfCacheMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_user()
+        self.client.force_login(self.user)
+        self.customer = create_client(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.invoice = Invoice.objects.create(
+                title="Cached invoice", user=self.user, client=self.customer
+            )
+            InvoiceItem.objects.create(
+                invoice=self.invoice, item="Line", quantity=1, rate=10
+            )
+        self.detail_url = reverse("invoice-detail", args=[self.invoice.pk])
+        self.pdf_url = reverse("generate_pdf", args=[self.invoice.pk])
+
+    def revalidate(self, url, response):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+
+    def test_unchanged_invoice_is_not_modified(self):
+        response = self.client.get(self.detail_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["ETag"].startswith('"'))
+        self.assertIn("no-cache", response["Cache-Control"])
+
+        with self.assertNumQueries(3):
+            # Session, user and invoice, but no line items
+            response = self.revalidate(self.detail_url, response)
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(
+            self.detail_url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"]
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_changes_to_printed_details_change_the_etag(self):
+        first = self.client.get(self.detail_url)
+        with self.captureOnCommitCallbacks(execute=True):
+            InvoiceItem.objects.create(
+                invoice=self.invoice, item="More", quantity=1, rate=5
+            )
+        second = self.revalidate(self.detail_url, first)
+        self.assertEqual(second.status_code, 200)
+        self.assertContains(second, "More")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.customer.company = "Renamed corp"
+            self.customer.save()
+        third = self.revalidate(self.detail_url, second)
+        self.assertEqual(third.status_code, 200)
+        self.assertNotEqual(third["ETag"], second["ETag"])
+
+    def test_a_new_csrf_secret_changes_the_etag(self):
+        first = self.client.get(self.detail_url)
+        self.assertIn(settings.CSRF_COOKIE_NAME, self.client.cookies)
+        self.assertEqual(self.revalidate(self.detail_url, first).status_code, 304)
+
+        # As logging in again does, leaving the page's form with a stale token
+        self.client.cookies[settings.CSRF_COOKIE_NAME] = get_random_string(32)
+        second = self.revalidate(self.detail_url, first)
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(second["ETag"], first["ETag"])
+        self.assertEqual(self.revalidate(self.detail_url, second).status_code, 304)
+
+    def test_each_representation_has_its_own_etag(self):
+        InvoiceItem.objects.bulk_create(
+            InvoiceItem(invoice=self.invoice, item="Line", quantity=1, rate=1)
+            for _ in range(views.ITEM_PAGE_SIZE)
+        )
+        first_page = self.client.get(self.detail_url)
+        cursor = first_page.context["page_obj"].next_token()
+        second_page = self.client.get(self.detail_url, {"cursor": cursor})
+        with mock.patch(
+            "invoices.pdf_cache.render_invoice_pdf", return_value=b"%PDF etag"
+        ):
+            pdf = self.client.get(self.pdf_url)
+        etags = {first_page["ETag"], second_page["ETag"], pdf["ETag"]}
+        self.assertEqual(len(etags), 3)
+
+    def test_unchanged_pdf_is_not_rendered_again(self):
+        with mock.patch(
+            "invoices.pdf_cache.render_invoice_pdf", return_value=b"%PDF etag"
+        ) as render:
+            response = self.client.get(self.pdf_url)
+            self.assertEqual(response.content, b"%PDF etag")
+            response = self.revalidate(self.pdf_url, response)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.content, b"")
+
+            self.invoice.title = "Renamed"
+            with self.captureOnCommitCallbacks(execute=True):
+                self.invoice.save()
+            response = self.revalidate(self.pdf_url, response)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(render.call_count, 2)
@@ -0,0 +1,169 @@
+import csv
+import datetime
+import io
+import zipfile
+from concurrent.futures.process import BrokenProcessPool
+from unittest import mock
+from xml.etree import ElementTree
+
+from django.contrib.auth import get_user_model
+from django.test import AsyncClient, TestCase, override_settings
+from django.urls import reverse
+
+from invoices import export, tabular
+from invoices.models import Invoice, InvoiceItem
+from invoices.streaming import zip_stream
+from invoices.tabular import HEADERS
+from invoices.tests.fixtures import PdfCacheMixin, create_client, create_user
+
+
+class ZipStreamTests(TestCase):
+    def test_members_are_written_from_chunks(self):
+        members = [("a.txt", [b"hello ", b"world"]), ("b.txt", [b"second"])]
+        archive = zipfile.ZipFile(io.BytesIO(b"".join(zip_stream(members))))
+        self.assertEqual(archive.namelist(), ["a.txt", "b.txt"])
+        self.assertEqual(archive.read("a.txt"), b"hello world")
+        self.assertIsNone(archive.testzip())
+
+
+class RenderPoolTests(TestCase):
+    def test_broken_pool_is_replaced(self):
+        self.addCleanup(setattr, export, "_render_pool", export._render_pool)
+        export._render_pool = None
+        broken = mock.Mock()
+        broken.submit.side_effect = BrokenProcessPool("A process died")
+        with mock.patch(
+            "invoices.export.create_render_pool",
+            side_effect=[broken, mock.sentinel.new_pool],
+        ):
+            with self.assertRaises(BrokenProcessPool):
+                list(export.render_invoice_pdfs([1], processes=1))
+            broken.shutdown.assert_called_once_with(wait=False, cancel_futures=True)
+            self.assertIs(export.get_render_pool(), mock.sentinel.new_pool)
+
+
+@override_settings(PDF_EXPORT_PROCESSES=0)
+class InvoiceExportTests(PdfCacheMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.patch_render(
+            side_effect=lambda invoice, *args, **kwargs: f"%PDF {invoice.pk}".encode(),
+        )
+        self.user = create_user()
+        self.client1, self.client2 = [
+            create_client(self.user, first_name=name) for name in ("First", "Second")
+        ]
+        self.invoices = [
+            Invoice.objects.create(title=f"Invoice {i}", user=self.user, client=client)
+            for i, client in enumerate([self.client1, self.client1, self.client2])
+        ]
+        Invoice.objects.filter(pk=self.invoices[0].pk).update(
+            create_date=datetime.date(2019, 1, 1)
+        )
+        self.client.login(username="testuser", password="secretpassword")
+
+    def export(self, **params):
+        response = self.client.get(reverse("invoice-export"), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/zip")
+        content = b"".join(response.streaming_content)
+        return zipfile.ZipFile(io.BytesIO(content))
+
+    def test_export_client_invoices(self):
+        archive = self.export(client=self.client1.pk)
+        expected = [f"invoice_{invoice.pk}.pdf" for invoice in self.invoices[:2]]
+        self.assertEqual(sorted(archive.namelist()), sorted(expected))
+        pk = self.invoices[0].pk
+        self.assertEqual(archive.read(f"invoice_{pk}.pdf"), f"%PDF {pk}".encode())
+
+    def test_export_date_range(self):
+        archive = self.export(start_date="2019-01-01", end_date="2019-12-31")
+        self.assertEqual(archive.namelist(), [f"invoice_{self.invoices[0].pk}.pdf"])
+
+    def test_export_rejects_other_users_clients(self):
+        other = get_user_model().objects.create_user(username="other", password="x")
+        self.client.force_login(other)
+        response = self.client.get(
+            reverse("invoice-export"), {"client": self.client1.pk}
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class InvoiceRowsExportTests(TestCase):
+    def setUp(self):
+        self.user = create_user()
+        customer = create_client(self.user, company="Xcorp & Sons")
+        self.invoice = Invoice.objects.create(
+            title="Website", user=self.user, client=customer
+        )
+        for item, quantity, rate in (("Design", 10, 50), ("Hosting", 1, 20)):
+            InvoiceItem.objects.create(
+                invoice=self.invoice, item=item, quantity=quantity, rate=rate
+            )
+        self.empty = Invoice.objects.create(
+            title="Empty", user=self.user, client=customer
+        )
+        self.client.force_login(self.user)
+        self.async_client = AsyncClient()
+        self.async_client.force_login(self.user)
+
+    def export(self, file_format, **params):
+        url = reverse("invoice-rows-export", args=[file_format])
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b"".join(response.streaming_content)
+
+    def test_csv(self):
+        rows = list(csv.DictReader(io.StringIO(self.export("csv").decode())))
+        self.assertEqual(
+            [(row["invoice_title"], row["item"], row["subtotal"]) for row in rows],
+            [
+                ("Website", "Design", "500.00"),
+                ("Website", "Hosting", "20.00"),
+                ("Empty", "", ""),
+            ],
+        )
+        self.assertEqual(rows[0]["client_company"], "Xcorp & Sons")
+
+    def test_xlsx(self):
+        archive = zipfile.ZipFile(io.BytesIO(self.export("xlsx")))
+        self.assertIsNone(archive.testzip())
+        ns = {"s": "http://schemas.openxmlformats.org/spreadsheetml/2006/main"}
+        sheet = ElementTree.fromstring(archive.read("xl/worksheets/sheet1.xml"))
+        rows = sheet.findall("s:sheetData/s:row", ns)
+        self.assertEqual(len(rows), 4)
+        header = [cell.findtext("s:is/s:t", namespaces=ns) for cell in rows[0]]
+        self.assertEqual(header, HEADERS)
+        self.assertEqual(rows[1][6].findtext("s:is/s:t", namespaces=ns), "Xcorp & Sons")
+        self.assertEqual(rows[1][-1].findtext("s:v", namespaces=ns), "500.00")
+        for name in ("[Content_Types].xml", "xl/workbook.xml", "xl/styles.xml"):
+            ElementTree.fromstring(archive.read(name))
+
+    def test_xlsx_rows_beyond_a_sheet_go_on_the_next(self):
+        content = b"".join(tabular.xlsx_stream(tabular.export_rows(), max_rows=3))
+        archive = zipfile.ZipFile(io.BytesIO(content))
+        ns = {"s": "http://schemas.openxmlformats.org/spreadsheetml/2006/main"}
+        sheets = []
+        for n in (1, 2):
+            sheet = ElementTree.fromstring(archive.read(f"xl/worksheets/sheet{n}.xml"))
+            rows = sheet.findall("s:sheetData/s:row", ns)
+            sheets.append([row[10].findtext("s:is/s:t", namespaces=ns) for row in rows])
+        self.assertEqual(sheets, [["item", "Design", "Hosting"], ["item", None]])
+        workbook = ElementTree.fromstring(archive.read("xl/workbook.xml"))
+        self.assertEqual(
+            [sheet.get("name") for sheet in workbook.iterfind("s:sheets/s:sheet", ns)],
+            ["Invoices", "Invoices 2"],
+        )
+
+    def test_unknown_format(self):
+        response = self.client.get(reverse("invoice-rows-export", args=["pdf"]))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_streams_under_asgi(self):
+        url = reverse("invoice-rows-export", args=["csv"])
+        response = await self.async_client.get(url)
+        # A sync iterator would be read into memory before sending
+        self.assertTrue(response.is_async)
+        content = b"".join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(len(content.decode().splitlines()), 4)
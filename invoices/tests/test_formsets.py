@@ -0,0 +1,123 @@
+from decimal import Decimal
+from unittest import mock
+
+from django.db import connection
+from django.db.models.signals import post_delete
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from invoices.models import Invoice, InvoiceItem
+from invoices.tests.fixtures import create_client, create_user
+
+
+class InvoiceItemFormSetTests(TestCase):
+    def setUp(self):
+        self.user = create_user()
+        self.client.force_login(self.user)
+        self.customer = create_client(self.user)
+
+    def formset_data(self, lines, initial=0):
+        data = {
+            "items-TOTAL_FORMS": len(lines),
+            "items-INITIAL_FORMS": initial,
+            "items-MIN_NUM_FORMS": 0,
+            "items-MAX_NUM_FORMS": 1000,
+        }
+        for i, line in enumerate(lines):
+            for name, value in line.items():
+                data[f"items-{i}-{name}"] = value
+        return data
+
+    def post(self, url, data):
+        with self.captureOnCommitCallbacks(execute=True):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 302)
+        return len(queries)
+
+    def create(self, count):
+        lines = [
+            {"item": f"Line {i}", "quantity": 2, "rate": "1.50"} for i in range(count)
+        ]
+        data = {"title": "Big invoice", "client": self.customer.pk}
+        data.update(self.formset_data(lines))
+        queries = self.post(reverse("new-invoice"), data)
+        return Invoice.objects.latest("pk"), queries
+
+    def test_create_takes_a_fixed_number_of_queries(self):
+        small, few = self.create(2)
+        invoice, many = self.create(500)
+        # SQLite splits the INSERT to stay under its parameter limit
+        self.assertLessEqual(many, few + 3)
+        self.assertEqual(invoice.item_count, 500)
+        self.assertEqual(invoice.invoice_total, Decimal("1500.00"))
+
+    def test_edit_diffs_against_existing_items(self):
+        invoice, _ = self.create(500)
+        items = list(invoice.items.order_by("pk"))
+        lines = [
+            {"id": item.pk, "item": item.item, "quantity": 2, "rate": "1.50"}
+            for item in items
+        ]
+        lines[0]["quantity"] = 10
+        lines[1]["DELETE"] = "on"
+        lines.append({"item": "Extra", "quantity": 1, "rate": "5.00"})
+        data = {"title": "Big invoice", "client": self.customer.pk}
+        data.update(self.formset_data(lines, initial=len(items)))
+
+        queries = self.post(reverse("invoice-edit", args=[invoice.pk]), data)
+        self.assertLess(queries, 25)
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.item_count, 500)
+        self.assertEqual(invoice.invoice_total, Decimal("1500.00") + 12 - 3 + 5)
+        self.assertEqual(InvoiceItem.objects.get(pk=items[0].pk).quantity, 10)
+        self.assertFalse(InvoiceItem.objects.filter(pk=items[1].pk).exists())
+        self.assertTrue(invoice.items.filter(item="Extra").exists())
+
+    def delete_items(self, invoice, count):
+        lines = [
+            {"id": item.pk, "item": item.item, "quantity": 2, "rate": "1.50"}
+            for item in invoice.items.order_by("pk")
+        ]
+        for line in lines[:count]:
+            line["DELETE"] = "on"
+        data = {"title": "Big invoice", "client": self.customer.pk}
+        data.update(self.formset_data(lines, initial=len(lines)))
+        with mock.patch("invoices.pdf_cache.invalidate") as invalidate:
+            queries = self.post(reverse("invoice-edit", args=[invoice.pk]), data)
+        self.assertEqual(invoice.items.count(), len(lines) - count)
+        return queries, invalidate.call_count
+
+    def test_deletes_take_a_fixed_number_of_queries_and_no_signals(self):
+        deleted = []
+
+        def count_deletes(sender, instance, **kwargs):
+            deleted.append(instance)
+
+        post_delete.connect(count_deletes, sender=InvoiceItem)
+        self.addCleanup(post_delete.disconnect, count_deletes, sender=InvoiceItem)
+        small, _ = self.create(200)
+        big, _ = self.create(200)
+        few = self.delete_items(small, 1)
+        many = self.delete_items(big, 150)
+        self.assertEqual(deleted, [])
+        # The same queries and PDF invalidations, however many items go
+        self.assertEqual(many, few)
+        big.refresh_from_db()
+        self.assertEqual(big.item_count, 50)
+        self.assertEqual(big.invoice_total, Decimal("150.00"))
+
+    def test_unknown_item_ids_are_rejected(self):
+        invoice, _ = self.create(1)
+        other, _ = self.create(1)
+        stranger = other.items.get()
+        data = {"title": "Big invoice", "client": self.customer.pk}
+        data.update(
+            self.formset_data(
+                [{"id": stranger.pk, "item": "Hijack", "quantity": 1, "rate": "1"}],
+                initial=1,
+            )
+        )
+        self.client.post(reverse("invoice-edit", args=[invoice.pk]), data)
+        self.assertEqual(InvoiceItem.objects.get(pk=stranger.pk).item, "Line 0")
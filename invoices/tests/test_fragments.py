@@ -0,0 +1,73 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from invoices import fragments
+from invoices.models import Invoice, InvoiceItem
+from invoices.tests.fixtures import create_client, create_user
+
+
+class FragmentCacheTests(TestCase):
+    def setUp(self):
+        self.user = create_user()
+        self.client.force_login(self.user)
+        self.customer = create_client(self.user, first_name="Cached")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.invoice = Invoice.objects.create(
+                title="Cached invoice", user=self.user, client=self.customer
+            )
+            InvoiceItem.objects.create(
+                invoice=self.invoice, item="Line", quantity=1, rate=10
+            )
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_cached_tables_skip_invoice_queries(self):
+        for url in (reverse("home"), reverse("invoice-list")):
+            with self.subTest(url=url):
+                _, cold = self.count_queries(url)
+                _, warm = self.count_queries(url)
+                self.assertLess(warm, cold)
+
+    def test_invoice_changes_replace_cached_tables(self):
+        self.client.get(reverse("invoice-list"))
+        with self.captureOnCommitCallbacks(execute=True):
+            InvoiceItem.objects.create(
+                invoice=self.invoice, item="More", quantity=1, rate=5
+            )
+        response = self.client.get(reverse("invoice-list"))
+        self.assertContains(response, "15.00")
+
+    def test_client_changes_replace_cached_tables(self):
+        self.client.get(reverse("invoice-list"))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.customer.first_name = "Renamed"
+            self.customer.save()
+        response = self.client.get(reverse("invoice-list"))
+        self.assertContains(response, "Renamed")
+
+    def test_cache_is_per_user(self):
+        self.client.get(reverse("invoice-list"))
+        other = get_user_model().objects.create_user(
+            username="other", email="other@email.com", password="secretpassword"
+        )
+        self.client.force_login(other)
+        response = self.client.get(reverse("invoice-list"))
+        self.assertNotContains(response, "Cached Client")
+
+    def test_local_memory_caches_keep_fragments_briefly(self):
+        # Other workers never see this one's bumps
+        response = self.client.get(reverse("invoice-list"))
+        self.assertEqual(
+            response.context["fragment_timeout"], settings.FRAGMENT_CACHE_LOCAL_TIMEOUT
+        )
+        shared = {"default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}}
+        with override_settings(CACHES=shared):
+            self.assertEqual(fragments.get_timeout(), settings.FRAGMENT_CACHE_TIMEOUT)
@@ -0,0 +1,46 @@
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from invoices.models import Invoice, InvoiceItem
+from invoices.tests.fixtures import PdfCacheMixin, create_client, create_user
+
+
+@override_settings(PDF_EXPORT_PROCESSES=0)
+class MetricsTests(PdfCacheMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_user()
+        self.client.force_login(self.user)
+        customer = create_client(self.user)
+        self.invoice = Invoice.objects.create(
+            title="Timed invoice", user=self.user, client=customer
+        )
+        InvoiceItem.objects.create(
+            invoice=self.invoice, item="Line", quantity=1, rate=10
+        )
+
+    def timings(self, response):
+        return {
+            entry.split(";")[0].strip()
+            for entry in response["Server-Timing"].split(",")
+        }
+
+    def test_server_timing_splits_sql_and_templates(self):
+        response = self.client.get(reverse("invoice-detail", args=[self.invoice.pk]))
+        self.assertEqual(self.timings(response), {"db", "template", "total"})
+        self.assertRegex(response["Server-Timing"], r'desc="SQL \(\d+ queries\)"')
+
+    def test_server_timing_includes_pdf_phases(self):
+        response = self.client.get(reverse("generate_pdf", args=[self.invoice.pk]))
+        self.assertTrue({"pdf-layout", "pdf-write"} <= self.timings(response))
+
+    def test_metrics_are_labelled_by_url_name(self):
+        self.client.get(reverse("invoice-list"))
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(
+            response,
+            'invoices_request_duration_seconds_count{method="GET",'
+            'view="invoice-list"}',
+        )
+        self.assertContains(response, 'invoices_request_db_queries_bucket{le="1.0"')
@@ -0,0 +1,168 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+from contextlib import closing
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, connections, transaction
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+
+from invoices import numbering
+from invoices.bulk import bulk_create_invoices
+from invoices.models import Invoice, InvoiceSequence
+from invoices.tests.fixtures import create_client, create_user
+
+STRESS_DB = "numbering_stress"
+
+
+class InvoiceNumberTests(TestCase):
+    def setUp(self):
+        self.user = create_user()
+        self.customer = create_client(self.user)
+
+    def create_invoice(self, user=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Invoice.objects.create(
+                title="Invoice", user=user or self.user, client=self.customer
+            )
+
+    def test_numbers_are_sequential_per_user(self):
+        numbers = [self.create_invoice().number for _ in range(3)]
+        self.assertEqual(numbers, [1, 2, 3])
+        other_user = get_user_model().objects.create_user(username="other")
+        self.assertEqual(self.create_invoice(other_user).number, 1)
+
+        bulk_create_invoices(
+            [
+                (Invoice(title="Bulk", user=self.user, client=self.customer), [])
+                for _ in range(2)
+            ]
+        )
+        self.assertEqual(
+            list(
+                Invoice.objects.filter(user=self.user)
+                .order_by("number")
+                .values_list("number", flat=True)
+            ),
+            [1, 2, 3, 4, 5],
+        )
+
+    def test_numbers_are_reserved_in_blocks(self):
+        self.create_invoice()
+        block_size = settings.INVOICE_NUMBER_BLOCK_SIZE
+        sequence = InvoiceSequence.objects.get(user=self.user)
+        self.assertEqual(sequence.next_number, 1 + block_size)
+        with self.assertNumQueries(1):
+            # Just the INSERT, the number comes from this process's block
+            Invoice.objects.create(
+                title="Invoice", user=self.user, client=self.customer
+            )
+
+    def test_rolled_back_reservations_are_not_reused(self):
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                numbers = numbering.allocate(self.user.pk, count=3)
+                raise RuntimeError
+        # The reservation was rolled back, its block never reached the pool
+        self.assertEqual(numbering.allocate(self.user.pk, count=3), numbers)
+        self.assertEqual(numbers, [1, 2, 3])
+
+    def test_numbers_are_unique(self):
+        invoice = self.create_invoice()
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Invoice.objects.create(
+                title="Copy",
+                user=self.user,
+                client=self.customer,
+                number=invoice.number,
+            )
+
+    def test_lists_show_numbers(self):
+        self.client.force_login(self.user)
+        for _ in range(2):
+            invoice = self.create_invoice()
+        response = self.client.get(reverse("invoice-list"))
+        self.assertContains(response, "#2")
+        response = self.client.get(reverse("invoice-detail", args=[invoice.pk]))
+        self.assertContains(response, "Invoice #2")
+
+
+class InvoiceNumberStressTests(TransactionTestCase):
+    """Workers numbering invoices for the same user all at once"""
+
+    threads = 8
+    invoices_per_thread = 40
+
+    @classmethod
+    def setUpClass(cls):
+        primary = connections["default"]
+        if primary.vendor == "sqlite":
+            # Connections from other threads can't wait for a lock on the
+            # in-memory test database, so they share a file copy of it
+            directory = tempfile.mkdtemp()
+            cls.addClassCleanup(shutil.rmtree, directory, ignore_errors=True)
+            path = os.path.join(directory, "stress.sqlite3")
+            primary.ensure_connection()
+            with closing(sqlite3.connect(path)) as copy:
+                primary.connection.backup(copy)
+            connections.settings[STRESS_DB] = {**primary.settings_dict, "NAME": path}
+            cls.addClassCleanup(cls.remove_database)
+            cls.using = STRESS_DB
+        else:
+            cls.using = "default"
+        cls.databases = {"default", cls.using}
+        super().setUpClass()
+
+    @classmethod
+    def remove_database(cls):
+        connections[STRESS_DB].close()
+        del connections[STRESS_DB]
+        del connections.settings[STRESS_DB]
+
+    def test_no_duplicates_and_little_locking(self):
+        user = get_user_model().objects.db_manager(self.using).create_user("stress")
+        self.addCleanup(numbering.forget, user.pk)
+        reservations = []
+        reserve = numbering._reserve
+
+        def counting_reserve(*args):
+            reservations.append(args)
+            return reserve(*args)
+
+        numbering._reserve = counting_reserve
+        self.addCleanup(setattr, numbering, "_reserve", reserve)
+
+        numbers, errors = [], []
+        start = threading.Barrier(self.threads)
+
+        def worker():
+            try:
+                start.wait()
+                for _ in range(self.invoices_per_thread):
+                    with transaction.atomic(using=self.using):
+                        numbers.extend(numbering.allocate(user.pk, using=self.using))
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connections.close_all()
+
+        workers = [threading.Thread(target=worker) for _ in range(self.threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        total = self.threads * self.invoices_per_thread
+        self.assertEqual(len(set(numbers)), total)
+        # Every reserved number was either handed out or is still pooled
+        sequence = InvoiceSequence.objects.using(self.using).get(user=user)
+        pooled = numbering._pools[(self.using, user.pk)]
+        self.assertEqual(sorted(numbers + pooled), list(range(1, sequence.next_number)))
+        # Only refills touch (and lock) the sequence row
+        block_size = settings.INVOICE_NUMBER_BLOCK_SIZE
+        self.assertLessEqual(len(reservations), total // block_size + self.threads)
@@ -0,0 +1,210 @@
+import datetime
+import socket
+import unittest
+from io import StringIO
+from smtplib import SMTPServerDisconnected
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from invoices.models import Invoice, InvoiceItem, OutboundEmail
+from invoices.outbox import enqueue_invoice_email, send_due_emails
+from invoices.tests.fixtures import PdfCacheMixin, create_client, create_user
+
+try:
+    from aiosmtpd.controller import Controller
+except ImportError:
+    Controller = None
+
+
+class RecordingHandler:
+    """aiosmtpd handler keeping the messages and the connections they came on"""
+
+    def __init__(self):
+        self.messages = []
+        self.peers = set()
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope)
+        self.peers.add(session.peer)
+        return "250 OK"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@override_settings(
+    EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+    EMAIL_OUTBOX_MAX_ATTEMPTS=2,
+    EMAIL_OUTBOX_RETRY_DELAY=60,
+)
+class OutboxTests(PdfCacheMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.render = self.patch_render(return_value=b"%PDF-1.7")
+        self.user = create_user(company="Acme")
+        self.customer = create_client(self.user)
+        self.invoice = self.create_invoice()
+        self.client.force_login(self.user)
+
+    def create_invoice(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            invoice = Invoice.objects.create(
+                title="Test Invoice", user=self.user, client=self.customer
+            )
+            InvoiceItem.objects.create(
+                invoice=invoice, item="Test Line Item", quantity=3, rate=20
+            )
+        return invoice
+
+    def send(self, **options):
+        out = StringIO()
+        call_command("send_invoice_emails", once=True, stdout=out, **options)
+        return out.getvalue()
+
+    def test_view_queues_email_without_sending(self):
+        url = reverse("invoice-email", args=[self.invoice.pk])
+        response = self.client.post(url)
+        self.assertRedirects(
+            response, reverse("invoice-detail", args=[self.invoice.pk])
+        )
+        self.client.post(url)
+        email = OutboundEmail.objects.get()
+        self.assertEqual(email.to, "test@example.com")
+        self.assertEqual(email.status, OutboundEmail.PENDING)
+        self.assertEqual(mail.outbox, [])
+        self.assertEqual(self.client.get(url).status_code, 405)
+
+        other_user = get_user_model().objects.create_user(username="other")
+        self.client.force_login(other_user)
+        self.assertEqual(self.client.post(url).status_code, 404)
+
+    def test_sends_invoice_pdf(self):
+        email = enqueue_invoice_email(self.invoice)
+        output = self.send()
+        self.assertIn("Sent 1 email(s) in total, 0 failed", output)
+        self.assertIn("msgs/sec", output)
+
+        (message,) = mail.outbox
+        self.assertEqual(message.to, ["test@example.com"])
+        self.assertEqual(message.reply_to, ["test@email.com"])
+        self.assertEqual(message.subject, f"Invoice #{self.invoice.number} from Acme")
+        self.assertIn("60.00", message.body)
+        ((filename, content, mimetype),) = message.attachments
+        self.assertEqual((content, mimetype), (b"%PDF-1.7", "application/pdf"))
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutboundEmail.SENT)
+        self.assertIsNotNone(email.sent_at)
+
+        # Nothing is sent twice
+        self.send()
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_failed_sends_are_retried_with_backoff(self):
+        email = enqueue_invoice_email(self.invoice)
+        with mock.patch(
+            "django.core.mail.backends.locmem.EmailBackend.send_messages",
+            side_effect=SMTPServerDisconnected("Connection unexpectedly closed"),
+        ):
+            output = self.send()
+            self.assertIn("0 email(s) in total, 1 failed", output)
+            email.refresh_from_db()
+            self.assertEqual(email.status, OutboundEmail.PENDING)
+            self.assertEqual(email.attempts, 1)
+            self.assertIn("SMTPServerDisconnected", email.error)
+            delay = email.next_attempt_at - timezone.now()
+            self.assertGreater(delay, datetime.timedelta(seconds=50))
+
+            # Not due yet
+            self.send()
+            email.refresh_from_db()
+            self.assertEqual(email.attempts, 1)
+
+            OutboundEmail.objects.update(next_attempt_at=timezone.now())
+            self.send()
+            email.refresh_from_db()
+            self.assertEqual(email.status, OutboundEmail.FAILED)
+            self.assertEqual(email.attempts, 2)
+        self.assertEqual(mail.outbox, [])
+
+    def test_stale_claims_are_requeued(self):
+        email = enqueue_invoice_email(self.invoice)
+        OutboundEmail.objects.update(
+            status=OutboundEmail.SENDING,
+            started_at=timezone.now() - datetime.timedelta(hours=1),
+        )
+        output = self.send()
+        self.assertIn("Requeued 1 stale email(s)", output)
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutboundEmail.SENT)
+
+    def test_dropped_idle_connections_are_reopened(self):
+        email = enqueue_invoice_email(self.invoice)
+        with mock.patch(
+            "django.core.mail.backends.locmem.EmailBackend.send_messages",
+            side_effect=[SMTPServerDisconnected("Connection unexpectedly closed"), 1],
+        ) as send_messages:
+            output = self.send()
+        self.assertIn("Sent 1 email(s) in total, 0 failed", output)
+        self.assertEqual(send_messages.call_count, 2)
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutboundEmail.SENT)
+        self.assertEqual(email.attempts, 1)
+
+    def test_claims_going_stale_while_running_are_requeued(self):
+        enqueue_invoice_email(self.invoice)
+        second = enqueue_invoice_email(self.create_invoice())
+        passes = []
+
+        def peer_claims_and_dies(pool, limit):
+            if not passes:
+                # During the first pass, long enough ago to be stale by the next
+                OutboundEmail.objects.filter(pk=second.pk).update(
+                    status=OutboundEmail.SENDING,
+                    started_at=timezone.now() - datetime.timedelta(hours=1),
+                )
+            passes.append(limit)
+            return send_due_emails(pool, limit)
+
+        with mock.patch(
+            "invoices.management.commands.send_invoice_emails.send_due_emails",
+            side_effect=peer_claims_and_dies,
+        ):
+            output = self.send(batch_size=1)
+        self.assertIn("Requeued 1 stale email(s)", output)
+        self.assertIn("Sent 2 email(s) in total, 0 failed", output)
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertFalse(OutboundEmail.objects.exclude(status=OutboundEmail.SENT))
+
+    @unittest.skipIf(Controller is None, "aiosmtpd isn't installed")
+    def test_smtp_delivery_reuses_connections(self):
+        handler = RecordingHandler()
+        port = free_port()
+        server = Controller(handler, hostname="127.0.0.1", port=port)
+        server.start()
+        self.addCleanup(server.stop)
+
+        for _ in range(30):
+            enqueue_invoice_email(self.create_invoice())
+        with override_settings(
+            EMAIL_BACKEND="django.core.mail.backends.smtp.EmailBackend",
+            EMAIL_HOST="127.0.0.1",
+            EMAIL_PORT=port,
+        ):
+            output = self.send(connections=3, batch_size=10)
+
+        self.assertIn("Sent 30 email(s) in total, 0 failed", output)
+        self.assertEqual(len(handler.messages), 30)
+        self.assertLessEqual(len(handler.peers), 3)
+        self.assertEqual(
+            OutboundEmail.objects.filter(status=OutboundEmail.SENT).count(), 30
+        )
+        self.assertIn(b"Invoice #", handler.messages[0].content)
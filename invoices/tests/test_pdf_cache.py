@@ -0,0 +1,128 @@
+import os
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from invoices import pdf_cache
+from invoices.pdf import PDF_STYLESHEET, InvoiceRenderer, get_renderer, warm_up
+from invoices.models import Invoice, InvoiceItem
+from invoices.tests.fixtures import PdfCacheMixin, create_client, create_user
+
+
+@override_settings(PDF_EXPORT_PROCESSES=0)
+class PdfCacheTests(PdfCacheMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.render = self.patch_render(
+            side_effect=lambda invoice, *args, **kwargs: b"%PDF " + bytes(64),
+        )
+        self.user = create_user()
+        self.client1 = create_client(self.user)
+        self.invoice = Invoice.objects.create(
+            title="Test Invoice 1", user=self.user, client=self.client1
+        )
+        self.item = InvoiceItem.objects.create(
+            invoice=self.invoice, item="Test Line Item", quantity=3, rate=20
+        )
+
+    def get_pdf(self):
+        invoice = Invoice.objects.get(pk=self.invoice.pk)
+        return pdf_cache.get_invoice_pdf(invoice)
+
+    def test_repeat_download_is_served_from_cache(self):
+        first = self.get_pdf()
+        second = self.get_pdf()
+        self.assertEqual(first, second)
+        self.assertEqual(self.render.call_count, 1)
+
+    def test_item_change_invalidates_cache(self):
+        self.get_pdf()
+        self.item.quantity = 4
+        self.item.save()
+        self.get_pdf()
+        self.assertEqual(self.render.call_count, 2)
+
+    def test_client_change_invalidates_cache(self):
+        self.get_pdf()
+        self.client1.company = "Ycorp"
+        self.client1.save()
+        self.get_pdf()
+        self.assertEqual(self.render.call_count, 2)
+
+    def test_login_does_not_invalidate_cache(self):
+        self.get_pdf()
+        self.client.login(username="testuser", password="secretpassword")
+        self.get_pdf()
+        self.assertEqual(self.render.call_count, 1)
+
+    def test_evict_removes_least_recently_used_entries(self):
+        self.get_pdf()
+        other = Invoice.objects.create(
+            title="Test Invoice 2", user=self.user, client=self.client1
+        )
+        pdf_cache.get_invoice_pdf(other)
+        oldest = next(Path(self.cache_dir, str(self.invoice.pk)).glob("*.pdf"))
+        os.utime(oldest, (0, 0))
+        size = oldest.stat().st_size
+
+        pdf_cache.evict(max_size=size)
+
+        self.assertFalse(oldest.exists())
+        self.assertEqual(len(list(Path(self.cache_dir).glob("*/*.pdf"))), 1)
+
+    def test_generate_pdf_view_uses_cache(self):
+        self.client.login(username="testuser", password="secretpassword")
+        url = reverse("generate_pdf", args=[self.invoice.pk])
+        self.client.get(url)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/pdf")
+        self.assertEqual(self.render.call_count, 1)
+
+
+@override_settings(PDF_EXPORT_PROCESSES=0)
+class InvoiceRendererTests(PdfCacheMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_user()
+        self.client.force_login(self.user)
+        self.invoice = Invoice.objects.create(
+            title="Rendered invoice", user=self.user, client=create_client(self.user)
+        )
+        self.item = InvoiceItem.objects.create(
+            invoice=self.invoice, item="Rendered line", quantity=2, rate=15
+        )
+
+    def test_renderer_is_reused(self):
+        warm_up()
+        self.assertIs(get_renderer(), get_renderer())
+        pdf = get_renderer().render(self.invoice, [self.item])
+        self.assertTrue(pdf.startswith(b"%PDF"))
+
+    def test_layout_changes_replace_cached_pdfs_and_etags(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        stylesheet = Path(directory.name) / "html-invoice.css"
+        css = PDF_STYLESHEET.read_text()
+        stylesheet.write_text(css)
+        renderer = InvoiceRenderer(stylesheet)
+        self.assertEqual(InvoiceRenderer(stylesheet).version, renderer.version)
+        stylesheet.write_text(css + "\nbody { color: #333; }\n")
+        restyled = InvoiceRenderer(stylesheet)
+        retemplated = InvoiceRenderer(stylesheet, template_name="invoice_detail.html")
+        renderers = [renderer, restyled, retemplated]
+        self.assertEqual(len({renderer.version for renderer in renderers}), 3)
+
+        self.patch_render(return_value=b"%PDF")
+        url = reverse("generate_pdf", args=[self.invoice.pk])
+        keys, etags = set(), set()
+        for renderer in renderers:
+            with mock.patch("invoices.pdf_cache.get_renderer", return_value=renderer):
+                keys.add(pdf_cache.cache_key(self.invoice, [self.item]))
+            with mock.patch("invoices.views.get_renderer", return_value=renderer):
+                etags.add(self.client.get(url)["ETag"])
+        self.assertEqual(len(keys), 3)
+        self.assertEqual(len(etags), 3)
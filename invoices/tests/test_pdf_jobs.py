@@ -0,0 +1,149 @@
+import datetime
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from invoices import pdf_cache
+from invoices.jobs import claim_jobs, run_job
+from invoices.models import Invoice, InvoiceItem, PdfRenderJob
+from invoices.tests.fixtures import PdfCacheMixin, create_client, create_user
+
+
+class InlinePool:
+    """Stands in for the render pool, running each job as it's submitted"""
+
+    def __init__(self, broken=False):
+        self.broken = broken
+
+    def submit(self, fn, *args):
+        if self.broken:
+            raise BrokenProcessPool("A child process terminated abruptly")
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+
+class PdfRenderJobTests(PdfCacheMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.render = self.patch_render(return_value=b"%PDF-1.7")
+        self.user = create_user()
+        self.client1 = create_client(self.user)
+        self.invoice = Invoice.objects.create(
+            title="Test Invoice 1", user=self.user, client=self.client1
+        )
+        InvoiceItem.objects.create(
+            invoice=self.invoice, item="Test Line Item", quantity=3, rate=20
+        )
+        self.client.login(username="testuser", password="secretpassword")
+
+    def enqueue(self):
+        url = reverse("generate_pdf", args=[self.invoice.pk])
+        return self.client.get(url, {"async": 1})
+
+    def test_async_generate_returns_job_without_rendering(self):
+        response = self.enqueue()
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()["status"], PdfRenderJob.PENDING)
+        self.assertFalse(self.render.called)
+
+    def test_enqueue_reuses_pending_job(self):
+        first = self.enqueue().json()["job_id"]
+        second = self.enqueue().json()["job_id"]
+        self.assertEqual(first, second)
+        self.assertEqual(PdfRenderJob.objects.count(), 1)
+
+    def test_claim_jobs_claims_each_job_once(self):
+        self.enqueue()
+        self.assertEqual(len(claim_jobs(10)), 1)
+        self.assertEqual(claim_jobs(10), [])
+
+    def test_finished_job_can_be_downloaded(self):
+        job_id = self.enqueue().json()["job_id"]
+        for claimed in claim_jobs(10):
+            run_job(claimed)
+
+        status = self.client.get(reverse("pdf-job-status", args=[job_id])).json()
+        self.assertEqual(status["status"], PdfRenderJob.DONE)
+
+        response = self.client.get(status["download_url"])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b"%PDF-1.7")
+        self.assertEqual(self.render.call_count, 1)
+
+    def test_failed_render_is_reported(self):
+        self.render.side_effect = RuntimeError("layout failed")
+        job_id = self.enqueue().json()["job_id"]
+        for claimed in claim_jobs(10):
+            run_job(claimed)
+
+        status = self.client.get(reverse("pdf-job-status", args=[job_id])).json()
+        self.assertEqual(status["status"], PdfRenderJob.FAILED)
+        self.assertIn("layout failed", status["error"])
+
+    def test_download_of_stale_result_requeues_job(self):
+        job_id = self.enqueue().json()["job_id"]
+        for claimed in claim_jobs(10):
+            run_job(claimed)
+        pdf_cache.invalidate(self.invoice.pk)
+
+        response = self.client.get(reverse("pdf-job-download", args=[job_id]))
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()["status"], PdfRenderJob.PENDING)
+
+    def test_other_users_cannot_see_job(self):
+        job_id = self.enqueue().json()["job_id"]
+        get_user_model().objects.create_user(username="other", password="secret")
+        self.client.login(username="other", password="secret")
+        response = self.client.get(reverse("pdf-job-status", args=[job_id]))
+        self.assertEqual(response.status_code, 404)
+
+    def render_pdfs(self, *pools, claim=claim_jobs):
+        out, err = StringIO(), StringIO()
+        with mock.patch(
+            "invoices.management.commands.render_pdfs.create_render_pool",
+            side_effect=pools,
+        ), mock.patch(
+            "invoices.management.commands.render_pdfs.claim_jobs", side_effect=claim
+        ):
+            call_command("render_pdfs", processes=1, once=True, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_broken_pool_is_replaced_and_its_jobs_requeued(self):
+        job_id = self.enqueue().json()["job_id"]
+        _, err = self.render_pdfs(InlinePool(broken=True), InlinePool())
+        self.assertIn("Render pool broke, requeued 1 job(s)", err)
+        self.assertEqual(PdfRenderJob.objects.get(pk=job_id).status, PdfRenderJob.DONE)
+
+    def test_jobs_going_stale_while_running_are_requeued(self):
+        stuck = PdfRenderJob.objects.create(invoice=self.invoice)
+        # Keeps the first pass busy, so --once doesn't stop before the second
+        PdfRenderJob.objects.create(invoice=self.invoice)
+        passes = []
+
+        def peer_claims_and_dies(limit):
+            if not passes:
+                # During the first pass, long enough ago to be stale by the next
+                PdfRenderJob.objects.filter(pk=stuck.pk).update(
+                    status=PdfRenderJob.RUNNING,
+                    started_at=timezone.now() - datetime.timedelta(hours=1),
+                )
+            passes.append(limit)
+            return claim_jobs(limit)
+
+        out, _ = self.render_pdfs(InlinePool(), claim=peer_claims_and_dies)
+        self.assertIn("Requeued 1 stale job(s)", out)
+        self.assertEqual(
+            set(PdfRenderJob.objects.values_list("status", flat=True)),
+            {PdfRenderJob.DONE},
+        )
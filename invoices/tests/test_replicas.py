@@ -0,0 +1,124 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+from contextlib import closing
+from unittest import SkipTest
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from invoices.models import Invoice, PdfRenderJob
+from invoices.replicas import PIN_COOKIE
+from invoices.tests.fixtures import create_client, create_user
+
+REPLICA = "replica_stand_in"
+
+
+@override_settings(DATABASE_REPLICAS=[REPLICA])
+class ReplicaTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        primary = connections["default"]
+        if primary.vendor != "sqlite":
+            raise SkipTest("The replica stand-in is a copy of the SQLite database")
+        # A second SQLite database with the primary's tables stands in for a
+        # replica; tests copy rows into it to play replication
+        directory = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, directory, ignore_errors=True)
+        path = os.path.join(directory, "replica.sqlite3")
+        primary.ensure_connection()
+        with closing(sqlite3.connect(path)) as replica:
+            primary.connection.backup(replica)
+        connections.settings[REPLICA] = {**primary.settings_dict, "NAME": path}
+        cls.addClassCleanup(cls.remove_replica)
+        # Set here, not on the class, so the test runner doesn't try to
+        # create the stand-in
+        cls.databases = {"default", REPLICA}
+        super().setUpClass()
+
+    @classmethod
+    def remove_replica(cls):
+        connections[REPLICA].close()
+        del connections[REPLICA]
+        del connections.settings[REPLICA]
+
+    def setUp(self):
+        self.user = create_user()
+        self.client.force_login(self.user)
+        self.customer = create_client(self.user)
+        self.invoice = Invoice.objects.create(
+            title="Replicated title", user=self.user, client=self.customer
+        )
+        self.detail_url = reverse("invoice-detail", args=[self.invoice.pk])
+
+    def replicate(self):
+        for obj in (self.user, self.customer, self.invoice):
+            type(obj).objects.using(REPLICA).filter(pk=obj.pk).delete()
+            obj.save(using=REPLICA, force_insert=True)
+            obj._state.db = "default"
+        # Drop tables cached from the replica before it caught up
+        cache.clear()
+
+    def test_marked_views_read_from_the_replica(self):
+        # Not replicated yet
+        self.assertEqual(self.client.get(self.detail_url).status_code, 404)
+        self.assertNotContains(
+            self.client.get(reverse("invoice-list")), self.detail_url
+        )
+
+        self.replicate()
+        self.assertContains(self.client.get(self.detail_url), "Replicated title")
+        response = self.client.get(reverse("invoice-list"))
+        self.assertContains(response, self.detail_url)
+        self.assertEqual(
+            response.context["fragment_timeout"], settings.DATABASE_REPLICA_PIN_SECONDS
+        )
+        # Unmarked views read from the primary
+        response = self.client.get(reverse("invoice-edit", args=[self.invoice.pk]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_writers_read_their_writes_from_the_primary(self):
+        self.replicate()
+        response = self.client.post(
+            reverse("invoice-edit", args=[self.invoice.pk]),
+            {
+                "title": "Edited title",
+                "client": self.customer.pk,
+                "items-TOTAL_FORMS": 0,
+                "items-INITIAL_FORMS": 0,
+            },
+        )
+        self.assertRedirects(response, self.detail_url, fetch_redirect_response=False)
+        self.assertIn(PIN_COOKIE, response.cookies)
+        self.assertEqual(Invoice.objects.get().title, "Edited title")
+
+        # The replica hasn't caught up, but this browser reads the primary
+        self.assertContains(self.client.get(self.detail_url), "Edited title")
+
+        # Once the pin expires, it's back to the replica
+        del self.client.cookies[PIN_COOKIE]
+        self.assertContains(self.client.get(self.detail_url), "Replicated title")
+
+    def test_objects_read_from_a_replica_are_saved_to_the_primary(self):
+        self.replicate()
+        replica_copy = Invoice.objects.using(REPLICA).get()
+        replica_copy.title = "Saved"
+        replica_copy.save()
+        self.assertEqual(Invoice.objects.get().title, "Saved")
+        self.assertEqual(Invoice.objects.using(REPLICA).get().title, "Replicated title")
+
+    def test_queued_renders_are_found_on_the_primary(self):
+        self.replicate()
+        url = reverse("generate_pdf", args=[self.invoice.pk]) + "?async=1"
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 202)
+        # The replica hasn't caught up with the queued job, the second click
+        # still finds it
+        self.assertFalse(PdfRenderJob.objects.using(REPLICA).exists())
+        second = self.client.get(url)
+        self.assertEqual(second.json()["job_id"], first.json()["job_id"])
+        self.assertEqual(PdfRenderJob.objects.count(), 1)
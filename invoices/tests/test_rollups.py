@@ -0,0 +1,77 @@
+import datetime
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+
+from invoices.models import Invoice, InvoiceItem, RevenueRollup
+from invoices.tests.fixtures import create_client, create_user
+
+
+class RevenueRollupTests(TestCase):
+    def setUp(self):
+        self.user = create_user()
+        self.client1, self.client2 = [
+            create_client(self.user, first_name=name) for name in ("First", "Second")
+        ]
+
+    def create_invoice(self, client, date, *amounts):
+        with self.captureOnCommitCallbacks(execute=True):
+            invoice = Invoice.objects.create(
+                title="Invoice", user=self.user, client=client
+            )
+            Invoice.objects.filter(pk=invoice.pk).update(create_date=date)
+            for amount in amounts:
+                InvoiceItem.objects.create(
+                    invoice=invoice, item="Line", quantity=1, rate=amount
+                )
+        return invoice
+
+    def rollup(self, **scope):
+        scope.setdefault("client", None)
+        scope.setdefault("month", None)
+        return RevenueRollup.objects.get(user=self.user, **scope)
+
+    def test_rollups_follow_invoice_changes(self):
+        first = self.create_invoice(self.client1, datetime.date(2019, 1, 5), 10, 20)
+        self.create_invoice(self.client1, datetime.date(2019, 2, 7), 5)
+        self.create_invoice(self.client2, datetime.date(2019, 2, 9), 100)
+
+        client_total = self.rollup(client=self.client1)
+        self.assertEqual(client_total.invoice_count, 2)
+        self.assertEqual(client_total.revenue, 35)
+        self.assertEqual(client_total.first_invoice_date, datetime.date(2019, 1, 5))
+        self.assertEqual(client_total.last_invoice_date, datetime.date(2019, 2, 7))
+
+        february = self.rollup(month=datetime.date(2019, 2, 1))
+        self.assertEqual(february.invoice_count, 2)
+        self.assertEqual(february.revenue, 105)
+        self.assertEqual(self.rollup().revenue, 135)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.client = self.client2
+            first.save()
+        self.assertEqual(self.rollup(client=self.client1).revenue, 5)
+        self.assertEqual(self.rollup(client=self.client2).revenue, 130)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual(self.rollup(client=self.client2).invoice_count, 1)
+        self.assertEqual(self.rollup().revenue, 105)
+
+    def test_rebuild_matches_incremental_rollups(self):
+        self.create_invoice(self.client1, datetime.date(2019, 1, 5), 10, 20)
+        self.create_invoice(self.client2, datetime.date(2019, 3, 1), 7)
+        fields = ("user", "client", "month", "invoice_count", "revenue")
+        incremental = sorted(RevenueRollup.objects.values_list(*fields), key=str)
+
+        RevenueRollup.objects.all().delete()
+        call_command("rebuild_rollups", stdout=open("/dev/null", "w"))
+        rebuilt = sorted(RevenueRollup.objects.values_list(*fields), key=str)
+        self.assertEqual(incremental, rebuilt)
+
+    def test_client_detail_shows_summary(self):
+        self.create_invoice(self.client1, datetime.date(2019, 1, 5), 10, 20)
+        self.client.login(username="testuser", password="secretpassword")
+        response = self.client.get(reverse("client-detail", args=[self.client1.pk]))
+        self.assertEqual(response.context["summary"].revenue, 30)
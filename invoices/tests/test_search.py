@@ -0,0 +1,108 @@
+from django.contrib.auth import get_user_model
+from unittest import mock
+
+from django.test import TestCase
+from django.urls import reverse
+
+from invoices import search
+from invoices.models import Client, Invoice, InvoiceItem
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            username="testuser", email="test@email.com", password="secretpassword"
+        )
+        self.client.force_login(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.customer = Client.objects.create(
+                first_name="Ada",
+                last_name="Lovelace",
+                email="ada@example.com",
+                company="Analytical Engines",
+                address1="1234 Paradise Lane",
+                address2="Good Street",
+                country="Zimbabwe",
+                created_by=self.user,
+            )
+            self.invoice = Invoice.objects.create(
+                title="Website redesign", user=self.user, client=self.customer
+            )
+            InvoiceItem.objects.create(
+                invoice=self.invoice, item="Logo artwork", quantity=1, rate=10
+            )
+
+    def hits(self, query, user=None):
+        return search.search(user or self.user, query)
+
+    def test_finds_titles_clients_and_items(self):
+        invoice_hit = ("invoice", self.invoice.pk)
+        client_hit = ("client", self.customer.pk)
+        self.assertEqual(self.hits("website"), [invoice_hit])
+        self.assertEqual(self.hits("artwork"), [invoice_hit])
+        self.assertIn(client_hit, self.hits("analytical"))
+        self.assertIn(invoice_hit, self.hits("analytical"))
+
+    def test_terms_match_word_prefixes(self):
+        self.assertEqual(self.hits("redes web"), [("invoice", self.invoice.pk)])
+        self.assertEqual(self.hits("redesign unrelated"), [])
+
+    def test_title_matches_rank_first(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            other = Invoice.objects.create(
+                title="Maintenance", user=self.user, client=self.customer
+            )
+            InvoiceItem.objects.create(
+                invoice=other, item="Website hosting", quantity=1, rate=5
+            )
+        self.assertEqual(
+            self.hits("website"), [("invoice", self.invoice.pk), ("invoice", other.pk)]
+        )
+
+    def test_index_follows_changes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.invoice.title = "Brochure"
+            self.invoice.save()
+            self.customer.company = "Difference Engines"
+            self.customer.save()
+        self.assertEqual(self.hits("website"), [])
+        self.assertEqual(self.hits("brochure"), [("invoice", self.invoice.pk)])
+        self.assertEqual(len(self.hits("difference")), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.invoice.delete()
+        self.assertEqual(self.hits("brochure"), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.customer.delete()
+        self.assertEqual(self.hits("difference"), [])
+
+    def test_only_own_documents_match(self):
+        other_user = get_user_model().objects.create_user(
+            username="other", email="other@email.com", password="secretpassword"
+        )
+        self.assertEqual(self.hits("website", other_user), [])
+
+    def test_rebuild_matches_incremental_index(self):
+        incremental = sorted(self.hits("ada"))
+        search.rebuild()
+        self.assertEqual(sorted(self.hits("ada")), incremental)
+
+    def test_search_page(self):
+        response = self.client.get(reverse("search"), {"q": "logo"})
+        self.assertContains(response, "Website redesign")
+        response = self.client.get(reverse("search"), {"q": "!!"})
+        self.assertEqual(response.context["results"], [])
+
+    def test_search_page_shows_only_own_rows(self):
+        other_user = get_user_model().objects.create_user(
+            username="other", email="other@email.com", password="secretpassword"
+        )
+        self.client.force_login(other_user)
+        # As if the index mixed up whose documents these are
+        leaked = [
+            search.SearchHit("invoice", self.invoice.pk),
+            search.SearchHit("client", self.customer.pk),
+        ]
+        with mock.patch("invoices.search.search", return_value=leaked):
+            response = self.client.get(reverse("search"), {"q": "website"})
+        self.assertEqual(response.context["results"], [])
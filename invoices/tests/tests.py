@@ -1,10 +1,15 @@
 import datetime
+from decimal import Decimal
 
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DatabaseError, connection, transaction
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from freezegun import freeze_time
 
+from invoices import views
 from invoices.models import Client, Invoice, InvoiceItem
 
 
@@ -374,3 +379,282 @@ class ViewsLoggedInNewUserTests(TestCase):
     def test_empty_invoice_list_view(self):
         response = self.client.get(reverse("invoice-list"))
         self.assertContains(response, "You have not created any invoices yet.")
+
+
+class InvoiceTotalTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            username="testuser", email="test@email.com", password="secretpassword"
+        )
+        self.client1 = Client.objects.create(
+            first_name="Test",
+            last_name="Client",
+            email="test@example.com",
+            company="Xcorp",
+            address1="1234 Paradise Lane",
+            address2="Good Street",
+            country="Zimbabwe",
+            created_by=self.user,
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.invoice = Invoice.objects.create(
+                title="Test Invoice 1", user=self.user, client=self.client1
+            )
+
+    def test_total_is_recomputed_once_per_transaction(self):
+        item_count = 50
+        with self.captureOnCommitCallbacks() as callbacks:
+            for n in range(item_count):
+                InvoiceItem.objects.create(
+                    invoice=self.invoice, item=f"Line {n}", quantity=1, rate=2
+                )
+        # Every change registers the same batch, which only does its work once
+        self.assertTrue(all(callback is callbacks[0] for callback in callbacks))
+
+        # Totals, the invoice's client and user (2), reindexing (5) and the
+        # client and user rollups (13), whatever the number of items
+        with self.assertNumQueries(20):
+            for callback in callbacks:
+                callback()
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.invoice_total, 2 * item_count)
+
+    def test_total_survives_rolled_back_savepoint(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    InvoiceItem.objects.create(
+                        invoice=self.invoice, item="Undone", quantity=1, rate=99
+                    )
+                    raise DatabaseError
+            except DatabaseError:
+                pass
+            InvoiceItem.objects.create(
+                invoice=self.invoice, item="Kept", quantity=3, rate=20
+            )
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.invoice_total, 60)
+
+    def test_rolled_back_changes_are_flushed_with_the_next_batch(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            try:
+                with transaction.atomic():
+                    InvoiceItem.objects.create(
+                        invoice=self.invoice, item="Undone", quantity=1, rate=99
+                    )
+                    raise DatabaseError
+            except DatabaseError:
+                pass
+        self.assertEqual(callbacks, [])
+        with self.captureOnCommitCallbacks(execute=True):
+            InvoiceItem.objects.create(
+                invoice=self.invoice, item="Kept", quantity=3, rate=20
+            )
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.invoice_total, 60)
+
+    def test_stale_invoice_save_does_not_clobber_total(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            InvoiceItem.objects.create(
+                invoice=self.invoice, item="Line", quantity=3, rate=20
+            )
+            self.invoice.title = "Renamed"
+            self.invoice.save()
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.invoice_total, 60)
+
+    def test_deleting_items_updates_total(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            item = InvoiceItem.objects.create(
+                invoice=self.invoice, item="Line", quantity=3, rate=20
+            )
+        with self.captureOnCommitCallbacks(execute=True):
+            item.delete()
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.invoice_total, 0)
+
+
+class ListQueryCountTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            username="testuser", email="test@email.com", password="secretpassword"
+        )
+        self.client1 = Client.objects.create(
+            first_name="Test",
+            last_name="Client",
+            email="test@example.com",
+            company="Xcorp",
+            address1="1234 Paradise Lane",
+            address2="Good Street",
+            country="Zimbabwe",
+            created_by=self.user,
+        )
+        self.client.login(username="testuser", password="secretpassword")
+
+    def add_invoices(self, count):
+        for n in range(count):
+            client = Client.objects.create(
+                first_name=f"Client {n}",
+                last_name="Client",
+                email="test@example.com",
+                company="Xcorp",
+                address1="1234 Paradise Lane",
+                address2="Good Street",
+                country="Zimbabwe",
+                created_by=self.user,
+            )
+            Invoice.objects.create(title=f"Invoice {n}", user=self.user, client=client)
+            Invoice.objects.create(
+                title=f"Invoice {n}", user=self.user, client=self.client1
+            )
+
+    def count_queries(self, url):
+        # Compare uncached renders, fragments cached by the first pass would
+        # otherwise be served again since on_commit never fires here
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_rows(self):
+        urls = [
+            reverse("home"),
+            reverse("invoice-list"),
+            reverse("client-list"),
+            reverse("client-detail", args=[self.client1.pk]),
+        ]
+        self.add_invoices(2)
+        few = [self.count_queries(url) for url in urls]
+        self.add_invoices(8)
+        many = [self.count_queries(url) for url in urls]
+        self.assertEqual(few, many)
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            username="testuser", email="test@email.com", password="secretpassword"
+        )
+        client = Client.objects.create(
+            first_name="Test",
+            last_name="Client",
+            email="test@example.com",
+            company="Xcorp",
+            address1="1234 Paradise Lane",
+            address2="Good Street",
+            country="Zimbabwe",
+            created_by=self.user,
+        )
+        # Several invoices share each date so the id tie-break matters
+        self.invoices = []
+        for n in range(45):
+            invoice = Invoice.objects.create(
+                title=f"Invoice {n}", user=self.user, client=client
+            )
+            Invoice.objects.filter(pk=invoice.pk).update(
+                create_date=datetime.date(2019, 1, 1 + n // 4)
+            )
+            self.invoices.append(invoice)
+        self.client.login(username="testuser", password="secretpassword")
+
+    def walk(self, url, direction, cursor=None):
+        ids = []
+        while True:
+            response = self.client.get(url, {"cursor": cursor} if cursor else {})
+            page = response.context["page_obj"]
+            ids.extend(invoice.pk for invoice in page)
+            cursor = getattr(page, f"{direction}_token")()
+            if cursor is None:
+                return ids, page
+
+    def test_pages_cover_every_invoice_once_in_order(self):
+        ids, _ = self.walk(reverse("invoice-list"), "next")
+        expected = Invoice.objects.order_by("-create_date", "-id")
+        self.assertEqual(ids, list(expected.values_list("pk", flat=True)))
+
+    def test_previous_pages_lead_back_to_the_start(self):
+        url = reverse("invoice-list")
+        _, last_page = self.walk(url, "next")
+        ids, first_page = self.walk(url, "previous", last_page.previous_token())
+        self.assertFalse(first_page.has_previous())
+        self.assertEqual(len(ids), 45 - len(last_page))
+
+    def test_pages_are_not_counted(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse("home"))
+        self.assertFalse(any("COUNT(" in query["sql"] for query in queries))
+
+    def test_tampered_cursor_is_rejected(self):
+        response = self.client.get(reverse("invoice-list"), {"cursor": "bogus"})
+        self.assertEqual(response.status_code, 404)
+
+
+class InvoiceItemPaginationTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            username="testuser", email="test@email.com", password="secretpassword"
+        )
+        client = Client.objects.create(
+            first_name="Test",
+            last_name="Client",
+            email="test@example.com",
+            company="Xcorp",
+            address1="1234 Paradise Lane",
+            address2="Good Street",
+            country="Zimbabwe",
+            created_by=self.user,
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.invoice = Invoice.objects.create(
+                title="Long invoice", user=self.user, client=client
+            )
+            InvoiceItem.objects.bulk_create(
+                InvoiceItem(
+                    invoice=self.invoice, item=f"Line {n}", quantity=n % 3, rate=2
+                )
+                for n in range(1, 251)
+            )
+            # bulk_create sends no signals, save one item to refresh the totals
+            InvoiceItem.objects.create(
+                invoice=self.invoice, item="Line 251", quantity=1, rate=2
+            )
+        self.client.login(username="testuser", password="secretpassword")
+
+    def test_detail_page_shows_first_page_and_stored_totals(self):
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.item_count, 251)
+        response = self.client.get(reverse("invoice-detail", args=[self.invoice.pk]))
+        items = response.context["invoice_items"]
+        self.assertEqual(len(items), views.ITEM_PAGE_SIZE)
+        self.assertEqual(items[0].item, "Line 251")
+        self.assertEqual(
+            response.context["page_subtotal"], sum(item.subtotal() for item in items)
+        )
+        self.assertContains(response, "251 items")
+        self.assertContains(response, "Total: $502.00")
+
+    def test_json_pages_cover_every_item_once(self):
+        url = reverse("invoice-items", args=[self.invoice.pk])
+        items = []
+        cursor = None
+        while True:
+            page = self.client.get(url, {"cursor": cursor} if cursor else {}).json()
+            items.extend(page["items"])
+            self.assertEqual(
+                Decimal(page["page_subtotal"]),
+                sum(Decimal(item["subtotal"]) for item in page["items"]),
+            )
+            cursor = page["next"]
+            if cursor is None:
+                break
+        self.assertEqual(
+            [item["id"] for item in items],
+            list(self.invoice.items.order_by("-id").values_list("pk", flat=True)),
+        )
+
+    def test_json_pages_are_private(self):
+        get_user_model().objects.create_user(username="other", password="password")
+        self.client.login(username="other", password="password")
+        response = self.client.get(reverse("invoice-items", args=[self.invoice.pk]))
+        self.assertEqual(response.status_code, 404)
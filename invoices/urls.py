@@ -1,14 +1,31 @@
 from django.urls import path
 
 from . import views
+from .replicas import replica_reads
 
 urlpatterns = [
-    path("", views.HomePage.as_view(), name="home"),
+    path("", replica_reads(views.HomePage.as_view()), name="home"),
     # Invoices
-    path("invoices/", views.InvoiceListView.as_view(), name="invoice-list"),
+    path(
+        "invoices/",
+        replica_reads(views.InvoiceListView.as_view()),
+        name="invoice-list",
+    ),
     path("invoices/new/", views.InvoiceCreateView.as_view(), name="new-invoice"),
     path(
-        "invoices/<int:pk>/", views.InvoiceDetailView.as_view(), name="invoice-detail"
+        "invoices/archive/",
+        replica_reads(views.ArchivedInvoiceListView.as_view()),
+        name="invoice-archive",
+    ),
+    path(
+        "invoices/<int:pk>/",
+        replica_reads(views.InvoiceDetailView.as_view()),
+        name="invoice-detail",
+    ),
+    path(
+        "invoices/<int:pk>/items/",
+        replica_reads(views.invoice_items),
+        name="invoice-items",
     ),
     path(
         "invoices/edit/<int:pk>/",
@@ -25,13 +42,30 @@ urlpatterns = [
         views.InvoiceDeleteView.as_view(),
         name="invoice-delete",
     ),
+    path("invoices/<int:pk>/email/", views.email_invoice, name="invoice-email"),
     path(
         "invoices/generate/<invoice_id>",
-        views.generate_pdf_invoice,
+        replica_reads(views.generate_pdf_invoice),
         name="generate_pdf",
     ),
+    path("invoices/export/", views.export_invoice_pdfs, name="invoice-export"),
+    path(
+        "invoices/export/items.<str:file_format>",
+        views.export_invoice_rows,
+        name="invoice-rows-export",
+    ),
+    path(
+        "invoices/pdf-jobs/<uuid:job_id>/",
+        views.pdf_job_status,
+        name="pdf-job-status",
+    ),
+    path(
+        "invoices/pdf-jobs/<uuid:job_id>/download/",
+        views.pdf_job_download,
+        name="pdf-job-download",
+    ),
     # Clients
-    path("clients/", views.ClientListView.as_view(), name="client-list"),
+    path("clients/", replica_reads(views.ClientListView.as_view()), name="client-list"),
     path("clients/new/", views.ClientCreateView.as_view(), name="new-client"),
     path("clients/<int:pk>/", views.ClientDetailView.as_view(), name="client-detail"),
     path(
@@ -42,5 +76,7 @@ urlpatterns = [
         views.ClientDeleteView.as_view(),
         name="client-delete",
     ),
+    # Search
+    path("search/", views.search_view, name="search"),
     path("upload/", views.simple_upload, name="upload"),
 ]
@@ -1,11 +1,24 @@
+from concurrent.futures.process import BrokenProcessPool
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
 from django.core.files.storage import FileSystemStorage
+from django.db import transaction
 from django.forms.models import inlineformset_factory
-from django.http import HttpResponse
-from django.shortcuts import get_object_or_404, render
-from django.template.loader import render_to_string
+from django.http import (
+    Http404,
+    HttpResponse,
+    HttpResponseBadRequest,
+    JsonResponse,
+)
+from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse, reverse_lazy
+from django.utils.functional import SimpleLazyObject
+from django.views.decorators.http import require_POST
 from django.views.generic import (
     CreateView,
     DeleteView,
@@ -13,10 +26,62 @@ from django.views.generic import (
     ListView,
     UpdateView,
 )
-from weasyprint import HTML
 
-from .forms import InvoiceCreateForm, InvoiceEditForm, ClientCreateForm
-from .models import Client, Invoice, InvoiceItem
+from . import archive, fragments, replicas, search, tabular
+from .async_support import (
+    AsyncKeysetListMixin,
+    AsyncLoginRequiredMixin,
+    aget_object_or_404,
+    async_login_required,
+)
+from .conditional import add_validators, csrf_secret, invoice_etag, not_modified
+from .export import discard_render_pool, get_render_pool, render_invoice_pdfs
+from .forms import (
+    BaseInvoiceItemFormSet,
+    ClientCreateForm,
+    InvoiceCreateForm,
+    InvoiceEditForm,
+    InvoiceExportForm,
+)
+from .jobs import enqueue_pdf_render, requeue
+from .models import (
+    ArchivedInvoice,
+    Client,
+    Invoice,
+    InvoiceItem,
+    PdfRenderJob,
+    RevenueRollup,
+)
+from .outbox import enqueue_invoice_email
+from .pagination import KeysetPage, KeysetPaginationMixin
+from .pdf import get_renderer, pdf_filename
+from .pdf_cache import aget_invoice_pdf, get_cached_pdf
+from .streaming import streaming_response, zip_stream
+
+# Columns rendered by the invoice tables in home.html, dashboard.html and
+# client_detail.html. The client is joined in so rows don't query it one by one.
+INVOICE_LIST_FIELDS = (
+    "title",
+    "number",
+    "invoice_total",
+    "create_date",
+    "client__first_name",
+    "client__last_name",
+)
+
+# Line items shown on an invoice's page, and returned per request by
+# invoice_items; the invoice's total and item count are stored on it
+ITEM_PAGE_SIZE = 100
+
+
+def invoice_list_queryset(**filters):
+    return (
+        Invoice.objects.filter(**filters)
+        .select_related("client")
+        .only(*INVOICE_LIST_FIELDS)
+        .order_by("-create_date", "-id")
+    )
+
 
 InvoiceItemsFormset = inlineformset_factory(
     Invoice,
@@ -26,63 +91,163 @@ InvoiceItemsFormset = inlineformset_factory(
         "quantity",
         "rate",
     ),
+    formset=BaseInvoiceItemFormSet,
     extra=1,
 )
 
 
-class HomePage(ListView):
+class FragmentCacheMixin:
+    """Context for the {% cache %} block around a user's invoice table
+
+    `fragment_name` must match the block's name in the template. Nothing in
+    the cached block may be fetched before the template runs, so a cache hit
+    costs no queries for it.
+    """
+
+    fragment_name = None
+
+    def get_context_data(self, **kwargs):
+        data = super().get_context_data(**kwargs)
+        if self.request.user.is_authenticated:
+            version = fragments.get_version(self.request.user.pk)
+            cursor = self.request.GET.get(self.cursor_kwarg, "")
+            data["fragment_key"] = f"{self.request.user.pk}:{version}:{cursor}"
+        data["fragment_timeout"] = fragments.get_timeout()
+        if replicas.read_alias():
+            # The replica may not have caught up with the last version bump,
+            # so keep what was read from it no longer than it may lag
+            data["fragment_timeout"] = min(
+                data["fragment_timeout"], settings.DATABASE_REPLICA_PIN_SECONDS
+            )
+        return data
+
+    async def is_fragment_cached(self, context):
+        if "fragment_key" not in context:
+            return False
+        key = make_template_fragment_key(self.fragment_name, [context["fragment_key"]])
+        return await cache.ahas_key(key)
+
+
+class HomePage(
+    FragmentCacheMixin, AsyncKeysetListMixin, KeysetPaginationMixin, ListView
+):
     template_name = "home.html"
     context_object_name = "invoices"
     paginate_by = 10
+    fragment_name = "home_invoices"
 
     def get_queryset(self):
         if self.request.user.is_authenticated:
-            invoices = Invoice.objects.filter(user=self.request.user).order_by(
-                "-create_date"
-            )
-            return invoices
+            return invoice_list_queryset(user=self.request.user)
         else:
             return Invoice.objects.none()
 
-    def get_context_data(self, **kwargs):
-        # Call the base implementation first to get the data
-        context = super(HomePage, self).get_context_data(**kwargs)
-        try:
-            recent_invoices = context["invoices"][:4]
-        except (IndexError, AttributeError):
-            recent_invoices = None
-        context["recent_invoices"] = recent_invoices
-        return context
-
 
-class InvoiceListView(LoginRequiredMixin, ListView):
+class InvoiceListView(
+    AsyncLoginRequiredMixin,
+    FragmentCacheMixin,
+    AsyncKeysetListMixin,
+    KeysetPaginationMixin,
+    ListView,
+):
     template_name = "dashboard.html"
+    paginate_by = 20
+    fragment_name = "dashboard_invoices"
 
     def get_queryset(self):
         if self.request.user.is_authenticated:
-            invoices = Invoice.objects.filter(user=self.request.user)
-            return invoices
+            return invoice_list_queryset(user=self.request.user)
         else:
             return Invoice.objects.none()
 
+    def get_context_data(self, **kwargs):
+        data = super().get_context_data(**kwargs)
+        data["summary"] = SimpleLazyObject(
+            RevenueRollup.objects.filter(
+                user=self.request.user, client__isnull=True, month__isnull=True
+            ).first
+        )
+        return data
+
+
+def invoice_items_page(invoice, cursor=None):
+    """One page of an invoice's line items, newest first"""
+    return KeysetPage(invoice.items.all(), ("-id",), ITEM_PAGE_SIZE, cursor)
+
+
+class ArchivedInvoiceListView(
+    AsyncLoginRequiredMixin, AsyncKeysetListMixin, KeysetPaginationMixin, ListView
+):
+    template_name = "archived_invoices.html"
+    paginate_by = 20
+
+    def get_queryset(self):
+        if self.request.user.is_authenticated:
+            return (
+                ArchivedInvoice.objects.filter(user=self.request.user)
+                .select_related("client")
+                .defer("data")
+                .order_by("-create_date", "-id")
+            )
+        else:
+            return ArchivedInvoice.objects.none()
+
 
-class InvoiceDetailView(LoginRequiredMixin, DetailView):
+async def aget_invoice_or_404(queryset, user, pk):
+    """Invoice `pk` from `queryset`, or the user's archived invoice `pk`"""
+    try:
+        return await queryset.aget(pk=pk)
+    except Invoice.DoesNotExist:
+        pass
+    invoice = await archive.aget_archived_invoice(pk, user=user)
+    if invoice is None:
+        raise Http404("No Invoice matches the query.")
+    return invoice
+
+
+class InvoiceDetailView(AsyncLoginRequiredMixin, DetailView):
     template_name = "invoice_detail.html"
 
     def get_queryset(self):
         if self.request.user.is_authenticated:
-            return Invoice.objects.filter(user=self.request.user)
+            return Invoice.objects.filter(user=self.request.user).select_related(
+                "client", "user"
+            )
         else:
             return Invoice.objects.none()
 
+    async def get(self, request, *args, **kwargs):
+        self.object = await aget_invoice_or_404(
+            self.get_queryset(), request.user, self.kwargs[self.pk_url_kwarg]
+        )
+        cursor = request.GET.get("cursor")
+        # The page has the email form, whose CSRF token must stay current
+        etag = invoice_etag(self.object, "html", cursor, csrf_secret(request))
+        response = not_modified(request, etag, self.object.updated_at)
+        if response is not None:
+            return response
+
+        if self.object.archived_items is None:
+            invoice_items = page = invoice_items_page(self.object, cursor)
+            await page.afetch()
+        else:
+            # An archived invoice's items all come out of the archive at once
+            invoice_items, page = self.object.archived_items[::-1], None
+        context = self.get_context_data(
+            object=self.object,
+            invoice_items=invoice_items,
+            page_obj=page,
+            page_subtotal=sum(item.subtotal() for item in invoice_items),
+        )
+        response = self.render_to_response(context)
+        return add_validators(response, etag, self.object.updated_at)
+
     def get_context_data(self, **kwargs):
         # Call the base implementation first to get the data
         context = super(InvoiceDetailView, self).get_context_data(**kwargs)
         # Add client to the context -- to be used by invoice template
         client = context["invoice"].client
         context["client"] = client
-        # Add invoice items queryset
-        context["invoice_items"] = context["invoice"].items.all()
         user = context["invoice"].user
         context["user"] = user
         return context
@@ -114,11 +279,13 @@ class InvoiceCreateView(LoginRequiredMixin, CreateView):
         form.instance.user = self.request.user
         context = self.get_context_data()
         invoice_items = context["invoice_items"]
-        self.invoice = form.save()
-        if invoice_items.is_valid():
-            invoice_items.instance = self.invoice
-            invoice_items.save()
-        return super().form_valid(form)
+        # One transaction, so the invoice total is recomputed once on commit
+        with transaction.atomic():
+            self.invoice = form.save()
+            if invoice_items.is_valid():
+                invoice_items.instance = self.invoice
+                invoice_items.save()
+            return super().form_valid(form)
 
     def get_success_url(self):
         return reverse("invoice-detail", args=[self.object.pk])
@@ -148,11 +315,12 @@ class InvoiceUpdateView(LoginRequiredMixin, UpdateView):
     def form_valid(self, form):
         context = self.get_context_data()
         invoice_items = context["invoice_items"]
-        self.object = form.save()
-        if invoice_items.is_valid():
-            invoice_items.instance = self.object
-            invoice_items.save()
-        return super().form_valid(form)
+        with transaction.atomic():
+            self.object = form.save()
+            if invoice_items.is_valid():
+                invoice_items.instance = self.object
+                invoice_items.save()
+            return super().form_valid(form)
 
     def get_success_url(self):
         return reverse("invoice-detail", args=[self.object.pk])
@@ -181,23 +349,27 @@ class ClientCreateView(LoginRequiredMixin, CreateView):
         return super().form_valid(form)
 
 
-class ClientListView(LoginRequiredMixin, ListView):
+class ClientListView(
+    AsyncLoginRequiredMixin, AsyncKeysetListMixin, KeysetPaginationMixin, ListView
+):
     template_name = "clients.html"
+    paginate_by = 20
+    keyset_ordering = ("last_name", "id")
 
     def get_queryset(self):
         if self.request.user.is_authenticated:
-            return Client.objects.filter(created_by=self.request.user)
+            return (
+                Client.objects.filter(created_by=self.request.user)
+                .only("first_name", "last_name", "company")
+                .order_by("last_name", "id")
+            )
         else:
             return Client.objects.none()
 
 
-class ClientDetailView(LoginRequiredMixin, DetailView):
+class ClientDetailView(AsyncLoginRequiredMixin, DetailView):
     template_name = "client_detail.html"
 
-    def get_object(self):
-        client = super().get_object()
-        return client
-
     def get_queryset(self):
         if self.request.user.is_authenticated:
             return Client.objects.filter(created_by=self.request.user)
@@ -206,15 +378,22 @@ class ClientDetailView(LoginRequiredMixin, DetailView):
 
     def get_invoices_set(self):
         if self.request.user.is_authenticated:
-            return Invoice.objects.filter(client=self.get_object())
+            return invoice_list_queryset(user=self.request.user, client=self.object)
         else:
             return Invoice.objects.none()
 
-    def get_context_data(self, **kwargs):
-        data = super().get_context_data(**kwargs)
-        invoices = self.get_invoices_set()
-        data["invoices"] = invoices
-        return data
+    async def get(self, request, *args, **kwargs):
+        self.object = await aget_object_or_404(
+            self.get_queryset(), pk=self.kwargs[self.pk_url_kwarg]
+        )
+        invoices = [invoice async for invoice in self.get_invoices_set()]
+        summary = await RevenueRollup.objects.filter(
+            client=self.object, month__isnull=True
+        ).afirst()
+        context = self.get_context_data(
+            object=self.object, invoices=invoices, summary=summary
+        )
+        return self.render_to_response(context)
 
 
 class ClientUpdateView(LoginRequiredMixin, UpdateView):
@@ -248,37 +427,181 @@ class ClientDeleteView(LoginRequiredMixin, DeleteView):
             return Client.objects.none()
 
 
-@login_required
-def generate_pdf_invoice(request, invoice_id):
+@async_login_required
+async def generate_pdf_invoice(request, invoice_id):
     """Generate PDF Invoice"""
 
-    queryset = Invoice.objects.filter(user=request.user)
-    invoice = get_object_or_404(queryset, pk=invoice_id)
+    queryset = Invoice.objects.filter(user=request.user).select_related(
+        "client", "user"
+    )
+    invoice = await aget_invoice_or_404(queryset, request.user, invoice_id)
+
+    if request.GET.get("async") and invoice.archived_items is None:
+        # Hand the render to the `render_pdfs` worker and let the client poll
+        job = await sync_to_async(enqueue_pdf_render)(invoice)
+        return JsonResponse(pdf_job_status_data(job), status=202)
+
+    etag = invoice_etag(invoice, "pdf", get_renderer().version)
+    response = not_modified(request, etag, invoice.updated_at)
+    if response is not None:
+        return response
+
+    # Renders run in this worker's render processes, if it has any, so the
+    # event loop isn't held up while WeasyPrint lays out the invoice
+    executor = get_render_pool() if settings.PDF_EXPORT_PROCESSES else None
+    try:
+        pdf_file = await aget_invoice_pdf(
+            invoice, base_url=request.build_absolute_uri(), executor=executor
+        )
+    except BrokenProcessPool:
+        discard_render_pool(executor)
+        raise
+    return add_validators(pdf_response(invoice, pdf_file), etag, invoice.updated_at)
+
+
+@async_login_required
+async def invoice_items(request, pk):
+    """A page of an invoice's line items as JSON, with a cursor to the next"""
+    invoice = await aget_object_or_404(
+        Invoice.objects.filter(user=request.user).only("pk"), pk=pk
+    )
+    page = invoice_items_page(invoice, request.GET.get("cursor"))
+    await page.afetch()
+    return JsonResponse(
+        {
+            "items": [
+                {
+                    "id": item.pk,
+                    "item": item.item,
+                    "quantity": item.quantity,
+                    "rate": item.rate,
+                    "tax": item.tax,
+                    "subtotal": item.subtotal(),
+                }
+                for item in page
+            ],
+            "page_subtotal": sum(item.subtotal() for item in page),
+            "next": page.next_token(),
+        }
+    )
+
+
+def pdf_response(invoice, pdf_file):
+    response = HttpResponse(pdf_file, content_type="application/pdf")
+    response["Content-Disposition"] = "filename=%s" % (pdf_filename(invoice))
+    return response
 
-    client = invoice.client
-    user = invoice.user
-    invoice_items = InvoiceItem.objects.filter(invoice=invoice)
 
-    context = {
-        "invoice": invoice,
-        "client": client,
-        "user": user,
-        "invoice_items": invoice_items,
-        "host": request.get_host(),
+def pdf_job_status_data(job):
+    data = {
+        "job_id": str(job.pk),
+        "invoice_id": job.invoice_id,
+        "status": job.status,
+        "status_url": job.get_absolute_url(),
     }
-    print(request.get_host())
+    if job.status == PdfRenderJob.DONE:
+        data["download_url"] = reverse("pdf-job-download", args=[job.pk])
+    if job.status == PdfRenderJob.FAILED:
+        data["error"] = job.error
+    return data
 
-    html_template = render_to_string("pdf/html-invoice.html", context)
 
-    pdf_file = HTML(
-        string=html_template, base_url=request.build_absolute_uri()
-    ).write_pdf()
-    pdf_filename = f"invoice_{invoice.id}.pdf"
-    response = HttpResponse(pdf_file, content_type="application/pdf")
-    response["Content-Disposition"] = "filename=%s" % (pdf_filename)
+def get_user_pdf_job(request, job_id):
+    queryset = PdfRenderJob.objects.filter(invoice__user=request.user)
+    return get_object_or_404(queryset, pk=job_id)
+
+
+@login_required
+def pdf_job_status(request, job_id):
+    """Report the progress of a queued PDF render"""
+    job = get_user_pdf_job(request, job_id)
+    return JsonResponse(pdf_job_status_data(job))
+
+
+@login_required
+def pdf_job_download(request, job_id):
+    """Serve the PDF produced by a finished render job"""
+    job = get_user_pdf_job(request, job_id)
+    if job.status != PdfRenderJob.DONE:
+        return JsonResponse(pdf_job_status_data(job), status=202)
+
+    invoice = Invoice.objects.select_related("client", "user").get(pk=job.invoice_id)
+    pdf_file = get_cached_pdf(invoice)
+    if pdf_file is None:
+        # The invoice changed or the file was evicted since the job ran.
+        # Render it again in the background rather than in this worker.
+        job = requeue(job)
+        return JsonResponse(pdf_job_status_data(job), status=202)
+    return pdf_response(invoice, pdf_file)
+
+
+@require_POST
+@login_required
+def email_invoice(request, pk):
+    """Queue the invoice to be emailed to its client"""
+    queryset = Invoice.objects.filter(user=request.user).select_related("client")
+    invoice = get_object_or_404(queryset, pk=pk)
+    # Sent by `manage.py send_invoice_emails`, not while the client waits
+    enqueue_invoice_email(invoice)
+    return redirect("invoice-detail", pk=invoice.pk)
+
+
+@login_required
+def export_invoice_pdfs(request):
+    """Stream the PDFs of a client's invoices or a date range as a ZIP file"""
+    form = InvoiceExportForm(request.GET, user=request.user)
+    if not form.is_valid():
+        return HttpResponseBadRequest(form.errors.as_text())
+
+    invoice_ids = form.get_invoices().values_list("pk", flat=True).iterator()
+    members = ((name, [pdf]) for name, pdf in render_invoice_pdfs(invoice_ids))
+    response = streaming_response(
+        request, zip_stream(members), content_type="application/zip"
+    )
+    response["Content-Disposition"] = 'attachment; filename="invoices.zip"'
+    return response
+
+
+@login_required
+def export_invoice_rows(request, file_format):
+    """Stream every line item of the selected invoices as CSV or XLSX"""
+    if file_format not in tabular.FORMATS:
+        raise Http404("Unknown export format")
+    form = InvoiceExportForm(request.GET, user=request.user)
+    if not form.is_valid():
+        return HttpResponseBadRequest(form.errors.as_text())
+
+    stream, content_type, extension = tabular.FORMATS[file_format]
+    rows = tabular.export_rows(form.get_invoices())
+    response = streaming_response(request, stream(rows), content_type=content_type)
+    response["Content-Disposition"] = f'attachment; filename="invoices.{extension}"'
     return response
 
 
+@login_required
+def search_view(request):
+    """Invoices and clients matching ?q=, best matches first"""
+    query = request.GET.get("q", "").strip()
+    hits = search.search(request.user, query)
+    # The index only returns the user's own documents, but the rows are
+    # scoped too, so a stale or wrong entry can't show anyone else's
+    objects = {
+        "invoice": Invoice.objects.filter(user=request.user)
+        .select_related("client")
+        .in_bulk([hit.object_id for hit in hits if hit.kind == "invoice"]),
+        "client": Client.objects.filter(created_by=request.user).in_bulk(
+            [hit.object_id for hit in hits if hit.kind == "client"]
+        ),
+    }
+    # The index is updated on commit, so a hit can briefly outlive its row
+    results = [
+        (hit.kind, objects[hit.kind][hit.object_id])
+        for hit in hits
+        if hit.object_id in objects[hit.kind]
+    ]
+    return render(request, "search.html", {"query": query, "results": results})
+
+
 def simple_upload(request):
     if request.method == "POST" and request.FILES["myfile"]:
         myfile = request.FILES["myfile"]